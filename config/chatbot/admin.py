@@ -1,7 +1,9 @@
 # chatbot/admin.py
 from django.contrib import admin
-from .models import FAQ, FormSubmission, AnalyticsLog
+from .models import FAQ, FormSubmission, AnalyticsLog, UsageCounter, AnalyticsRollup
 
 admin.site.register(FAQ)
 admin.site.register(FormSubmission)
-admin.site.register(AnalyticsLog)
\ No newline at end of file
+admin.site.register(AnalyticsLog)
+admin.site.register(UsageCounter)
+admin.site.register(AnalyticsRollup)
@@ -0,0 +1,305 @@
+"""
+Buffered analytics ingestion.
+
+Chat interactions call `record_event()`, which only appends to an in-memory
+buffer. A background thread writes the buffer with one bulk_create per
+tenant schema whenever ANALYTICS_FLUSH_SIZE events are waiting or every
+ANALYTICS_FLUSH_INTERVAL seconds, and once more when the worker exits.
+When the buffer is full new events are dropped (and counted) rather than
+slowing the chat request down.
+
+Every write also adds to the AnalyticsRollup day counters in the same
+transaction, which is what the dashboard reads.
+"""
+from collections import Counter, defaultdict, deque
+from django.conf import settings
+from django.db import IntegrityError, connection, close_old_connections, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncHour, TruncWeek
+from django.utils import timezone
+from django_tenants.utils import schema_context
+from tenants.instrumentation import stage
+from datetime import datetime, time, timedelta
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+EVENT_TEXT = 'interaction_text'
+EVENT_RULE = 'interaction_rule'
+# a "did you mean" suggestion the user picked
+EVENT_FAQ = 'interaction_faq'
+EVENT_LEAD = 'lead_submitted'
+
+
+def rollup_key(event_type, details):
+    '''rule events of the tracked nodes (welcome_node, show_form, ...) get their own counter'''
+    if event_type == EVENT_RULE and isinstance(details, dict):
+        message = details.get('message')
+        if message in settings.ANALYTICS_ROLLUP_RULE_KEYS:
+            return message
+    return ''
+
+def update_rollups(events):
+    '''adds (event_type, details, timestamp) events of the active schema to the day counters'''
+    from .models import AnalyticsRollup
+
+    counts = Counter(
+        (timezone.localdate(timestamp), event_type, rollup_key(event_type, details))
+        for event_type, details, timestamp in events
+    )
+    for (day, event_type, key), amount in counts.items():
+        lookup = {'day': day, 'event_type': event_type, 'key': key}
+
+        if AnalyticsRollup.objects.filter(**lookup).update(count=F('count') + amount):
+            continue
+        try:
+            with transaction.atomic():
+                AnalyticsRollup.objects.create(count=amount, **lookup)
+        except IntegrityError:
+            # created concurrently by another worker
+            AnalyticsRollup.objects.filter(**lookup).update(count=F('count') + amount)
+
+
+def retention_cutoff(days=None):
+    '''
+    start of the oldest month whose raw events are kept: manage.py archive_analytics
+    removes AnalyticsLog rows before it, so the rollups of earlier days can no
+    longer be rebuilt from the log.
+    '''
+    days = settings.ANALYTICS_RETENTION_DAYS if days is None else days
+    return timezone.localtime(timezone.now() - timedelta(days=days)).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0,
+    )
+
+
+class AnalyticsBuffer:
+
+    def __init__(self, max_size=None, flush_size=None, flush_interval=None):
+        self.max_size = max_size or settings.ANALYTICS_BUFFER_SIZE
+        self.flush_size = flush_size or settings.ANALYTICS_FLUSH_SIZE
+        self.flush_interval = flush_interval or settings.ANALYTICS_FLUSH_INTERVAL
+
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+    def record(self, schema_name, event_type, details=None, timestamp=None):
+        '''queues one event, returns False if it had to be dropped'''
+        self._ensure_thread()
+
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self.dropped += 1
+                return False
+
+            self._events.append((schema_name, event_type, details, timestamp or timezone.now()))
+            self.recorded += 1
+            pending = len(self._events)
+
+        if pending >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def _ensure_thread(self):
+        # started lazily (and again after a fork) so a preloading gunicorn master
+        # never owns the thread its workers depend on
+        if self._pid == os.getpid() or self._stopped:
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='analytics-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _drain(self):
+        with self._lock:
+            events, self._events = self._events, deque()
+        return events
+
+    def flush(self):
+        '''writes everything buffered so far, returns the number of events saved'''
+        from .models import AnalyticsLog
+
+        with self._flush_lock:
+            events = self._drain()
+            if not events:
+                return 0
+
+            by_schema = defaultdict(list)
+            for schema_name, event_type, details, timestamp in events:
+                by_schema[schema_name].append(
+                    AnalyticsLog(event_type=event_type, details=details, timestamp=timestamp)
+                )
+
+            saved = 0
+            close_old_connections()
+            for schema_name, logs in by_schema.items():
+                try:
+                    with schema_context(schema_name), transaction.atomic():
+                        AnalyticsLog.objects.bulk_create(logs, batch_size=500)
+                        update_rollups((log.event_type, log.details, log.timestamp) for log in logs)
+                except Exception:
+                    logger.exception('Could not write %d analytics events for %s', len(logs), schema_name)
+                    self.failed += len(logs)
+                else:
+                    saved += len(logs)
+
+            self.flushed += saved
+            return saved
+
+    def shutdown(self):
+        '''stops the background thread and writes what is left'''
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        return {
+            'buffered': len(self._events),
+            'recorded': self.recorded,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_buffer():
+    global _buffer
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = AnalyticsBuffer()
+                atexit.register(_buffer.shutdown)
+
+    return _buffer
+
+@stage('analytics')
+def record_event(event_type, details=None):
+    '''logs an analytics event for the active tenant without waiting on the database'''
+    if settings.ANALYTICS_BUFFER_ENABLED:
+        get_buffer().record(connection.schema_name, event_type, details)
+    else:
+        from .models import AnalyticsLog
+        with transaction.atomic():
+            log = AnalyticsLog.objects.create(event_type=event_type, details=details)
+            update_rollups([(event_type, details, log.timestamp)])
+
+def flush_events():
+    '''writes buffered events now (worker shutdown, management commands, tests)'''
+    if _buffer is not None:
+        return _buffer.flush()
+    return 0
+
+
+BUCKETS = ('hour', 'day', 'week')
+
+def _bucket_starts(start, end, bucket):
+    '''every bucket start between the start and end dates (inclusive), oldest first'''
+    if bucket == 'hour':
+        current = datetime.combine(start, time.min, tzinfo=timezone.get_current_timezone())
+        last = datetime.combine(end, time.max, tzinfo=timezone.get_current_timezone())
+        step = timedelta(hours=1)
+    elif bucket == 'week':
+        current, last, step = start - timedelta(days=start.weekday()), end, timedelta(weeks=1)
+    else:
+        current, last, step = start, end, timedelta(days=1)
+
+    starts = []
+    while current <= last:
+        starts.append(current)
+        current += step
+    return starts
+
+def _logs_between(start, end):
+    from .models import AnalyticsLog
+
+    tz = timezone.get_current_timezone()
+    # a plain range on timestamp (not __date) so the index can be used
+    return AnalyticsLog.objects.filter(
+        timestamp__gte=datetime.combine(start, time.min, tzinfo=tz),
+        timestamp__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+
+def timeseries(start, end, bucket='day'):
+    '''
+    Event counts of the active tenant per bucket and event type, aggregated in the database.
+    Day and week buckets are read from the rollups, hour buckets from AnalyticsLog.
+    Rule events of the tracked nodes are also reported as "interaction_rule:<node id>".
+    '''
+    from .models import AnalyticsRollup
+
+    if bucket == 'hour':
+        rows = _logs_between(start, end).annotate(bucket=TruncHour('timestamp')).values('bucket', 'event_type').annotate(
+            total=Count('id'),
+        ).order_by()
+        rows = [dict(row, key='') for row in rows]
+    else:
+        truncate = TruncWeek('day') if bucket == 'week' else F('day')
+        rows = AnalyticsRollup.objects.filter(day__gte=start, day__lte=end).annotate(
+            bucket=truncate,
+        ).values('bucket', 'event_type', 'key').annotate(total=Sum('count')).order_by()
+
+    starts = _bucket_starts(start, end, bucket)
+    position = {bucket_start: i for i, bucket_start in enumerate(starts)}
+    series = defaultdict(lambda: [0] * len(starts))
+
+    for row in rows:
+        bucket_start = row['bucket']
+        if isinstance(bucket_start, datetime) and bucket != 'hour':
+            bucket_start = bucket_start.date()
+        i = position.get(bucket_start)
+        if i is None:
+            continue
+
+        series[row['event_type']][i] += row['total']
+        if row['key']:
+            series[f"{row['event_type']}:{row['key']}"][i] += row['total']
+
+    return {
+        'bucket': bucket,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'buckets': [bucket_start.isoformat() for bucket_start in starts],
+        'series': dict(sorted(series.items())),
+    }
+
+def timeseries_marker(start, end, bucket='day'):
+    '''
+    cheap fingerprint of the rows timeseries() reads (one ungrouped aggregate
+    for the ETag): rollup counts only grow and log ids only increase, so any
+    event added to the range changes it, as do archived logs.
+    '''
+    from .models import AnalyticsRollup
+
+    if bucket == 'hour':
+        marker = _logs_between(start, end).aggregate(rows=Count('id'), last=Max('id'))
+    else:
+        marker = AnalyticsRollup.objects.filter(day__gte=start, day__lte=end).aggregate(
+            rows=Count('id'), total=Sum('count'),
+        )
+    return sorted(marker.items())
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
 
-class TenantsConfig(AppConfig):
+class ChatbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'config.tenants'
+    name = 'config.chatbot'
+    label = 'chatbot'
+
+    def ready(self):
+        # registers the model signal handlers (cache invalidation etc.)
+        from . import signals  # noqa: F401
+        from django.conf import settings
+
+        if settings.NLP_PRELOAD_MODEL:
+            # load the weights at startup instead of on the first chat message.
+            # under gunicorn --preload this runs once in the master process
+            from .nlp import embedding_model
+            embedding_model.load()
@@ -0,0 +1,164 @@
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django_tenants.utils import tenant_context
+from .analytics import record_event, EVENT_TEXT, EVENT_RULE, EVENT_FAQ
+from .flows import get_flow_graph
+from .nlp import (normalize_query, get_query_cache, embed_query, match_faq, get_faq,
+                  lookup_answer, rank_faqs, decide, resolve, InferenceUnavailable)
+import asyncio
+import contextvars
+import os
+import threading
+
+
+class InferenceBusy(Exception):
+    '''raised when the inference queue is full, the view answers 503 right away'''
+
+
+class InferenceExecutor:
+    '''
+    Bounded pool the async interact path runs model inference in.
+
+    `workers` threads encode concurrently, at most `queue_size` more questions
+    wait for a free thread. Anything beyond that is rejected instead of
+    piling up behind a slow model.
+    '''
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or settings.NLP_INFERENCE_WORKERS
+        self.queue_size = settings.NLP_INFERENCE_QUEUE_SIZE if queue_size is None else queue_size
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # created lazily (and again after a fork), threads do not survive fork()
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='nlp-inference')
+                    self._pid = os.getpid()
+        return self._executor
+
+    async def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise InferenceBusy()
+        try:
+            # in the caller's context (like asyncio.to_thread), so request instrumentation sees the call
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), context.run, func, *args)
+        finally:
+            self._slots.release()
+
+
+_executor = None
+
+def get_inference_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = InferenceExecutor()
+
+    return _executor
+
+
+async def run_in_tenant(tenant, func, *args):
+    '''
+    runs a sync (ORM) callable with the tenant's schema active.
+
+    django-tenants keeps the schema as state of the connection, and the
+    async ORM only hands queries to a worker thread, so bare aget()/afirst()
+    calls would run against whatever schema that thread's connection had
+    last. every DB access of the async path goes through here instead.
+    '''
+    def call():
+        with tenant_context(tenant):
+            return func(*args)
+
+    return await sync_to_async(call, thread_sensitive=True)()
+
+
+def _start_text(payload, text):
+    record_event(EVENT_TEXT, {"message": payload})
+    return lookup_answer(connection.schema_name, text) if text else None
+
+def _match_and_resolve(text, user_vector):
+    return resolve(match_faq(connection.schema_name, text, user_vector))
+
+def _rank_candidates(text, user_vector, k):
+    '''top-k matches with their questions, caches the decision like match_faq'''
+    from .models import FAQ
+
+    matches = rank_faqs(text, user_vector, k=max(k, settings.NLP_SUGGESTIONS))
+    decision = decide(matches)
+    get_query_cache().set_answer(connection.schema_name, text, decision)
+    matches = matches[:k]
+
+    questions = dict(FAQ.objects.filter(pk__in=[faq_id for faq_id, _ in matches]).values_list('pk', 'question'))
+    candidates = [
+        {"id": faq_id, "question": questions[faq_id], "score": round(float(score), 4)}
+        for faq_id, score in matches if faq_id in questions
+    ]
+    return candidates, decision
+
+def _faq_response(payload):
+    '''a suggested FAQ the user picked ("faq" interaction), None for unknown ids'''
+    record_event(EVENT_FAQ, {"message": payload})
+    return get_faq(int(payload)) if str(payload).isdigit() else None
+
+def _rule_response(payload):
+    record_event(EVENT_RULE, {"message": payload})
+    return get_flow_graph().response(payload)
+
+
+async def amatch_question(tenant, payload):
+    '''
+    async counterpart of nlp.match_question (+ the analytics event): the cache
+    and DB steps run in the request's thread, the encoder in the inference
+    executor, so the event loop is never blocked. raises InferenceBusy when
+    the inference queue is full, InferenceUnavailable when encoding failed.
+    '''
+    text = normalize_query(payload)
+
+    decision = await run_in_tenant(tenant, _start_text, payload, text)
+    if not text:
+        return None, []
+    if decision is not None:
+        return await run_in_tenant(tenant, resolve, decision)
+
+    user_vector = await get_inference_executor().run(embed_query, text)
+    if user_vector is None:
+        raise InferenceUnavailable()
+
+    return await run_in_tenant(tenant, _match_and_resolve, text, user_vector)
+
+async def astream_question(tenant, payload, emit, k=3):
+    '''
+    amatch_question for the streaming channel: once the index was searched the
+    top-k candidates are reported with `await emit('candidates', [...])`.
+    questions answered from the query cache skip that stage.
+    '''
+    text = normalize_query(payload)
+
+    decision = await run_in_tenant(tenant, _start_text, payload, text)
+    if not text:
+        return None, []
+
+    if decision is None:
+        user_vector = await get_inference_executor().run(embed_query, text)
+        if user_vector is None:
+            raise InferenceUnavailable()
+
+        candidates, decision = await run_in_tenant(tenant, _rank_candidates, text, user_vector, k)
+        await emit('candidates', candidates)
+
+    return await run_in_tenant(tenant, resolve, decision)
+
+async def afaq_response(tenant, payload):
+    return await run_in_tenant(tenant, _faq_response, payload)
+
+async def arule_response(tenant, payload):
+    return await run_in_tenant(tenant, _rule_response, payload)
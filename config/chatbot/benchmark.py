@@ -0,0 +1,407 @@
+"""
+Offline benchmark of the FAQ retrieval engine, driven by `manage.py benchmark_nlp`.
+
+Synthetic tenants of any size are generated from subject x aspect x qualifier
+combinations ("How much does delivery cost in Lyon on the pro plan?"), each FAQ
+with paraphrased user questions whose right answer is known. Every retrieval
+backend is then measured on the same data: search latency percentiles,
+throughput, index memory and top-1/top-k accuracy, plus how many questions
+clear each confidence threshold and how often those answers are right.
+
+Nothing touches the database: the indexes are built straight from the
+generated vectors, stored and decoded in each vector dtype first so the
+precision loss of float16/int8 FAQ.question_vector shows up in the accuracy.
+"""
+from django.conf import settings
+from .lexical import LexicalIndex
+from .loadtest import percentile
+from .nlp import (
+    FAQIndex, IVFIndex, encode_vector, decode_vector, normalize_rows, normalize_query,
+    fuse, generate_vectors, _hybrid_candidates, _memory_usage,
+)
+import time
+import tracemalloc
+import zlib
+import numpy as np
+
+BACKENDS = ['exact', 'ivf', 'lexical', 'hybrid']
+
+SUBJECTS = [
+    'delivery', 'returns', 'gift cards', 'the mobile app', 'the loyalty program', 'student discounts',
+    'installation', 'the warranty', 'repairs', 'spare parts', 'bulk orders', 'custom engraving',
+    'the starter kit', 'the premium bundle', 'online courses', 'private lessons', 'group bookings',
+    'parking', 'wheelchair access', 'the pet policy', 'the newsletter', 'the referral program',
+    'invoices', 'subscriptions', 'cloud backup', 'data export', 'the api', 'two factor login',
+    'team accounts', 'the free trial', 'consultations', 'home visits', 'same day pickup',
+    'international shipping', 'gift wrapping', 'recycling', 'rental equipment', 'event catering',
+    'corporate training', 'the support hotline',
+]
+
+# aspect: (words that mean the same thing, question phrasings). the first
+# phrasing is the FAQ question, user questions use one of the others
+ASPECTS = {
+    'price': ({'cost', 'price', 'charge', 'fee'}, [
+        "how much does {subject} cost", "what is the price of {subject}",
+        "what do you charge for {subject}", "is there a fee for {subject}"]),
+    'availability': ({'available', 'hours', 'times', 'when'}, [
+        "when is {subject} available", "what are the hours for {subject}", "what times can i use {subject}"]),
+    'signup': ({'sign', 'register', 'enroll', 'join'}, [
+        "how do i sign up for {subject}", "how can i register for {subject}", "where do i enroll in {subject}"]),
+    'cancel': ({'cancel', 'cancellation', 'stop', 'terminate'}, [
+        "how do i cancel {subject}", "can i stop {subject}", "what is the cancellation policy for {subject}"]),
+    'duration': ({'long', 'duration', 'take', 'time'}, [
+        "how long does {subject} take", "what is the duration of {subject}", "how much time does {subject} take"]),
+    'requirements': ({'need', 'requirements', 'required', 'prerequisites'}, [
+        "what do i need for {subject}", "what are the requirements for {subject}",
+        "are there prerequisites for {subject}"]),
+    'payment': ({'pay', 'payment', 'card', 'methods'}, [
+        "how can i pay for {subject}", "which payment methods work for {subject}", "can i pay for {subject} by card"]),
+    'contact': ({'contact', 'reach', 'speak', 'call'}, [
+        "who do i contact about {subject}", "how can i reach someone about {subject}",
+        "can i speak to someone about {subject}"]),
+    'discount': ({'discount', 'coupons', 'deal', 'cheaper'}, [
+        "is there a discount on {subject}", "do you have coupons for {subject}", "can i get a deal on {subject}"]),
+    'refund': ({'refund', 'money', 'back', 'reimburse'}, [
+        "can i get a refund for {subject}", "do you refund {subject}", "how do i get my money back for {subject}"]),
+    'change': ({'change', 'modify', 'update', 'edit'}, [
+        "how do i change {subject}", "can i modify {subject}", "where can i update {subject}"]),
+    'problem': ({'problem', 'issues', 'working', 'trouble'}, [
+        "what if {subject} is not working", "i have a problem with {subject}", "who fixes issues with {subject}"]),
+    'location': ({'where', 'find', 'address', 'located'}, [
+        "where is {subject}", "where can i find {subject}", "what is the address for {subject}"]),
+    'limit': ({'limit', 'maximum', 'max', 'often'}, [
+        "is there a limit on {subject}", "what is the maximum for {subject}", "how often can i use {subject}"]),
+    'transfer': ({'give', 'transfer', 'share', 'someone'}, [
+        "can i give {subject} to someone else", "can i transfer {subject}", "can i share {subject} with a friend"]),
+    'languages': ({'language', 'languages', 'spanish', 'english'}, [
+        "which languages is {subject} available in", "is {subject} offered in spanish",
+        "do you have {subject} in other languages"]),
+    'security': ({'safe', 'secure', 'security', 'privacy'}, [
+        "is {subject} safe", "how secure is {subject}", "what about privacy and {subject}"]),
+    'eligibility': ({'eligible', 'qualify', 'allowed', 'who'}, [
+        "who is eligible for {subject}", "do i qualify for {subject}", "who is allowed to use {subject}"]),
+    'trial': ({'try', 'demo', 'test', 'first'}, [
+        "can i try {subject} first", "is there a demo of {subject}", "can i test {subject} before buying"]),
+    'paperwork': ({'paperwork', 'receipt', 'confirmation', 'documents'}, [
+        "what paperwork comes with {subject}", "do i get a receipt for {subject}",
+        "will i get a confirmation for {subject}"]),
+}
+
+CITIES = [
+    'berlin', 'lyon', 'madrid', 'porto', 'milan', 'vienna', 'prague', 'warsaw', 'oslo', 'dublin',
+    'leeds', 'glasgow', 'antwerp', 'utrecht', 'zurich', 'geneva', 'munich', 'hamburg', 'seville', 'naples',
+    'krakow', 'tallinn', 'riga', 'helsinki', 'gothenburg', 'aarhus', 'bordeaux', 'turin', 'valencia', 'bilbao',
+]
+PLANS = ['basic', 'plus', 'pro', 'business', 'enterprise']
+
+PREFIXES = ['', '', '', 'hi, ', 'hello, ', 'quick question: ', 'please tell me ', 'i was wondering ']
+
+# question words that barely change the meaning, for the synthetic encoder
+FILLER_WORDS = {
+    'a', 'an', 'the', 'is', 'are', 'do', 'does', 'i', 'you', 'your', 'my', 'me', 'can', 'how', 'what',
+    'which', 'for', 'of', 'to', 'in', 'on', 'by', 'with', 'about', 'there', 'it', 'if', 'and', 'hi',
+    'hello', 'quick', 'question', 'please', 'tell', 'was', 'wondering', 'get', 'use', 'plan', 'will',
+    'other', 'else', 'not', 'before', 'buying', 'comes', 'offered', 'fixes', 'friend', 'have', 'much',
+}
+FILLER_WEIGHT = 0.15
+
+
+def _combination(index):
+    '''subject, aspect, city, plan of the index-th of all possible FAQs'''
+    index, subject = divmod(index, len(SUBJECTS))
+    index, aspect = divmod(index, len(ASPECTS))
+    plan, city = divmod(index, len(CITIES) + 1)
+    return (SUBJECTS[subject], list(ASPECTS)[aspect],
+            CITIES[city - 1] if city else None, PLANS[plan - 1] if plan else None)
+
+MAX_FAQS = len(SUBJECTS) * len(ASPECTS) * (len(CITIES) + 1) * (len(PLANS) + 1)
+
+def _question(template, subject, city, plan):
+    text = template.format(subject=subject)
+    if city:
+        text += f' in {city}'
+    if plan:
+        text += f' on the {plan} plan'
+    return text
+
+
+class SyntheticTenant:
+    '''
+    n unique FAQs (ids 1..n) and `queries` paraphrased user questions,
+    `expected[i]` being the id of the FAQ that answers `queries[i]`.
+    '''
+
+    def __init__(self, n, queries=500, seed=0):
+        if n > MAX_FAQS:
+            raise ValueError(f"at most {MAX_FAQS} synthetic FAQs can be generated")
+
+        rng = np.random.default_rng(seed)
+        self.name = f'synthetic_{n}'
+        self.faq_ids = np.arange(1, n + 1, dtype=np.int64)
+        self.combinations = [_combination(int(i)) for i in rng.choice(MAX_FAQS, n, replace=False)]
+
+        self.questions, self.answers = [], []
+        for subject, aspect, city, plan in self.combinations:
+            question = _question(ASPECTS[aspect][1][0], subject, city, plan)
+            self.questions.append(question[0].upper() + question[1:] + '?')
+            self.answers.append(f"Everything about the {aspect} of {_question('{subject}', subject, city, plan)}.")
+
+        self.queries, self.expected = [], []
+        for i in rng.integers(n, size=queries):
+            subject, aspect, city, plan = self.combinations[i]
+            templates = ASPECTS[aspect][1]
+            template = templates[rng.integers(1, len(templates))]
+            prefix = PREFIXES[rng.integers(len(PREFIXES))]
+            self.queries.append(prefix + _question(template, subject, city, plan) + '?')
+            self.expected.append(int(self.faq_ids[i]))
+
+    def __len__(self):
+        return len(self.faq_ids)
+
+
+class HashingEncoder:
+    '''
+    Deterministic stand-in for the sentence model: a text is the weighted sum
+    of one random vector per word, synonyms of an aspect sharing theirs, plus
+    `noise` times a random vector of its own (so paraphrases are close but
+    never identical). It has no notion of meaning beyond that, so its accuracy
+    says little about the model but makes latency and memory runs cheap and
+    repeatable.
+    '''
+
+    def __init__(self, dim=384, noise=0.5, seed=0):
+        self.dim = dim
+        self.noise = noise
+        self.seed = seed
+        self.concepts = {word: aspect for aspect, (words, _) in ASPECTS.items() for word in words}
+        self.vectors = {}
+
+    def _random(self, key):
+        return np.random.default_rng(zlib.crc32(f'{self.seed}:{key}'.encode())).standard_normal(self.dim).astype(np.float32)
+
+    def _vector(self, concept):
+        vector = self.vectors.get(concept)
+        if vector is None:
+            vector = self.vectors[concept] = self._random(concept)
+        return vector
+
+    def encode(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(matrix, texts):
+            words = normalize_query(text).split()
+            for word in words:
+                weight = FILLER_WEIGHT if word in FILLER_WORDS else 1.0
+                row += weight * self._vector(self.concepts.get(word, word))
+            if self.noise:
+                row += self.noise * np.sqrt(len(words)) * self._random(f'text:{text}')
+        return normalize_rows(matrix)
+
+
+class ModelEncoder:
+    '''the configured sentence model (or embedding server), in batches'''
+
+    def __init__(self, batch_size=256):
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors = generate_vectors(texts[start:start + self.batch_size])
+            if vectors is None:
+                raise RuntimeError("the embedding model is not available")
+            batches.append(vectors)
+        return normalize_rows(np.vstack(batches).astype(np.float32))
+
+
+def stored_matrix(vectors, dtype):
+    '''the vectors as FAQIndex.build would see them after a round trip through FAQ.question_vector'''
+    return np.vstack([decode_vector(encode_vector(vector, dtype)) for vector in vectors])
+
+def _build(factory):
+    '''(object, MB allocated and still held, seconds) of factory()'''
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    started = time.perf_counter()
+    built = factory()
+    elapsed = time.perf_counter() - started
+
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    if not tracing:
+        tracemalloc.stop()
+    return built, allocated / 2 ** 20, elapsed
+
+def _timed(search, queries):
+    '''results, per query latencies (ms, sorted) and total seconds of search(text, vector) over the queries'''
+    results, latencies = [], []
+    started = time.perf_counter()
+    for text, vector in queries:
+        query_started = time.perf_counter()
+        results.append(search(text, vector))
+        latencies.append((time.perf_counter() - query_started) * 1000)
+    return results, sorted(latencies), time.perf_counter() - started
+
+def _batch_qps(index, vectors, k):
+    batch_size = max(1, settings.NLP_BATCH_MAX_MESSAGES)
+    started = time.perf_counter()
+    for start in range(0, len(vectors), batch_size):
+        index.search_many(vectors[start:start + batch_size], k)
+    elapsed = time.perf_counter() - started
+    return round(len(vectors) / elapsed, 1) if elapsed else None
+
+def score_results(results, expected, thresholds):
+    '''
+    top1/topk: share of questions whose FAQ is the best match / among the k
+    returned. per threshold t: answered@t, the share whose best match scores
+    at least t (and would be answered), and precision@t, the share of those
+    answers that are right.
+    '''
+    total = len(expected) or 1
+    scores = {
+        'top1': sum(bool(matches) and matches[0][0] == faq_id for matches, faq_id in zip(results, expected)) / total,
+        'topk': sum(faq_id in {i for i, _ in matches} for matches, faq_id in zip(results, expected)) / total,
+    }
+    for threshold in thresholds:
+        answered = [matches[0][0] == faq_id for matches, faq_id in zip(results, expected)
+                    if matches and matches[0][1] >= threshold]
+        scores[f'answered@{threshold:g}'] = round(len(answered) / total, 4)
+        scores[f'precision@{threshold:g}'] = round(sum(answered) / len(answered), 4) if answered else None
+
+    scores['top1'] = round(scores['top1'], 4)
+    scores['topk'] = round(scores['topk'], 4)
+    return scores
+
+
+def run_benchmark(sizes, backends=BACKENDS, dtypes=('float32',), encoder=None, queries=500, k=5,
+                  thresholds=(0.5,), nprobe=None, lexical_weight=None, seed=0, log=None):
+    '''one result row per tenant size, backend and vector dtype (lexical rows have no dtype)'''
+    encoder = encoder or HashingEncoder(seed=seed)
+    nprobe = nprobe or settings.NLP_IVF_NPROBE
+    weight = settings.NLP_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    log = log or (lambda message: None)
+    rows = []
+
+    for n in sizes:
+        tenant = SyntheticTenant(n, queries, seed)
+
+        started = time.perf_counter()
+        faq_vectors = encoder.encode(tenant.questions)
+        query_vectors = encoder.encode(tenant.queries)
+        encode_ms = (time.perf_counter() - started) * 1000 / (len(tenant) + len(tenant.queries))
+        log(f"{tenant.name}: {len(tenant)} faqs, {len(tenant.queries)} questions, encoded at {encode_ms:.3f}ms/text")
+
+        texts = [normalize_query(query) for query in tenant.queries]
+        pairs = list(zip(texts, query_vectors))
+
+        def row(backend, dtype, results, latencies, elapsed, index_mb, build_s, **extra):
+            summary = {
+                'tenant': tenant.name, 'faqs': len(tenant), 'backend': backend, 'dtype': dtype,
+                'queries': len(latencies), 'k': k,
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'qps': round(len(latencies) / elapsed, 1) if elapsed else None,
+                'index_mb': round(index_mb, 2),
+                'build_s': round(build_s, 3),
+                **extra,
+                **score_results(results, tenant.expected, thresholds),
+                **_memory_usage(),
+            }
+            rows.append(summary)
+            log(f"  {backend:<8} {dtype or '-':<8} p95 {summary['p95_ms']:.3f}ms  "
+                f"top1 {summary['top1']:.3f}  top{k} {summary['topk']:.3f}")
+
+        lexical = lexical_mb = lexical_s = None
+        if 'lexical' in backends or 'hybrid' in backends:
+            answer_weight = settings.NLP_LEXICAL_ANSWER_WEIGHT if settings.NLP_LEXICAL_INCLUDE_ANSWERS else 0.0
+            docs = [(int(faq_id), normalize_query(question), normalize_query(answer) if answer_weight else '')
+                    for faq_id, question, answer in zip(tenant.faq_ids, tenant.questions, tenant.answers)]
+            lexical, lexical_mb, lexical_s = _build(lambda: LexicalIndex(docs, answer_weight=answer_weight))
+
+        if 'lexical' in backends:
+            results, latencies, elapsed = _timed(lambda text, vector: lexical.search(text, k), pairs)
+            row('lexical', None, results, latencies, elapsed, lexical_mb, lexical_s)
+
+        for dtype in dtypes:
+            stored = stored_matrix(faq_vectors, dtype)
+            vector_bytes = len(encode_vector(faq_vectors[0], dtype))
+            exact, exact_mb, exact_s = _build(lambda: FAQIndex(tenant.faq_ids, normalize_rows(stored)))
+
+            if 'exact' in backends:
+                results, latencies, elapsed = _timed(lambda text, vector: exact.search(vector, k), pairs)
+                row('exact', dtype, results, latencies, elapsed, exact_mb, exact_s,
+                    batch_qps=_batch_qps(exact, query_vectors, k), vector_bytes=vector_bytes)
+
+            if 'ivf' in backends:
+                ivf, ivf_mb, ivf_s = _build(lambda: IVFIndex.train(tenant.faq_ids, exact.matrix))
+                results, latencies, elapsed = _timed(lambda text, vector: ivf.search(vector, k, nprobe), pairs)
+                row('ivf', dtype, results, latencies, elapsed, ivf_mb, ivf_s,
+                    vector_bytes=vector_bytes, nlist=len(ivf.centroids), nprobe=nprobe)
+
+            if 'hybrid' in backends:
+                candidates = _hybrid_candidates(k, weight)
+                results, latencies, elapsed = _timed(
+                    lambda text, vector: fuse(text, exact.search(vector, candidates), k, weight, lexical,
+                                              lambda faq_ids: exact.score_ids(vector, faq_ids)),
+                    pairs,
+                )
+                row('hybrid', dtype, results, latencies, elapsed, exact_mb + lexical_mb, exact_s + lexical_s,
+                    vector_bytes=vector_bytes, lexical_weight=weight)
+
+    return rows
+
+
+# metric: (higher is better, tolerance kind)
+COMPARED_METRICS = {
+    'p50_ms': (False, 'latency'),
+    'p95_ms': (False, 'latency'),
+    'p99_ms': (False, 'latency'),
+    'qps': (True, 'latency'),
+    'batch_qps': (True, 'latency'),
+    'index_mb': (False, 'latency'),
+    'top1': (True, 'accuracy'),
+    'topk': (True, 'accuracy'),
+}
+# latency differences below this are timer noise, whatever the relative change
+LATENCY_NOISE_MS = 0.02
+
+def _row_key(row):
+    return row['faqs'], row['backend'], row['dtype']
+
+def compare(baseline_rows, rows, latency_tolerance=0.2, accuracy_tolerance=0.01):
+    '''
+    changes of every COMPARED_METRICS value between two runs, for the rows both
+    have. latency, throughput and memory regress past a relative tolerance,
+    accuracy past an absolute one.
+    '''
+    baseline = {_row_key(row): row for row in baseline_rows}
+    changes = []
+
+    for row in rows:
+        old_row = baseline.get(_row_key(row))
+        if old_row is None:
+            continue
+
+        for metric, (higher_is_better, kind) in COMPARED_METRICS.items():
+            old, new = old_row.get(metric), row.get(metric)
+            if old is None or new is None:
+                continue
+
+            worse = old - new if higher_is_better else new - old
+            if kind == 'accuracy':
+                regression = worse > accuracy_tolerance
+            else:
+                regression = worse > abs(old) * latency_tolerance
+                if metric.endswith('_ms'):
+                    regression = regression and worse > LATENCY_NOISE_MS
+
+            changes.append({
+                'faqs': row['faqs'], 'backend': row['backend'], 'dtype': row['dtype'], 'metric': metric,
+                'baseline': old, 'current': new,
+                'change': f'{(new - old) / old:+.1%}' if old else None,
+                'regression': regression,
+            })
+
+    return changes
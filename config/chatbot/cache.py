@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django_tenants.utils import schema_context
+import threading
+import time
+import uuid
+
+# version tokens read by this process: (namespace, schema_name) -> token
+_versions = None
+
+def _local_versions():
+    global _versions
+
+    if _versions is None:
+        _versions = LRUCache(maxsize=settings.TENANT_CACHE_SIZE * 4)
+
+    return _versions
+
+def get_version(namespace: str, schema_name: str):
+    '''
+    returns the current version token of a per-tenant cached structure.
+    the token is a CacheVersion row in the tenant's schema, so a bump made by
+    any process (web workers, the embedding worker, management commands) is
+    seen by all of them: each process re-reads it at the latest after
+    CHATBOT_VERSION_TTL seconds, the process that bumped it right away.
+    '''
+    from .models import CacheVersion
+
+    versions = _local_versions()
+    version = versions.get((namespace, schema_name))
+    if version is not None:
+        return version
+
+    with schema_context(schema_name):
+        version = CacheVersion.objects.filter(namespace=namespace).values_list('version', flat=True).first()
+        if version is None:
+            # get_or_create so that concurrent workers agree on a single token
+            version = CacheVersion.objects.get_or_create(
+                namespace=namespace, defaults={'version': uuid.uuid4().hex},
+            )[0].version
+
+    if settings.CHATBOT_VERSION_TTL > 0:
+        versions.set((namespace, schema_name), version, ttl=settings.CHATBOT_VERSION_TTL)
+    return version
+
+def bump_version(namespace: str, schema_name: str):
+    '''marks every process' copy of the structure as stale, returns the new token'''
+    from .models import CacheVersion
+
+    version = uuid.uuid4().hex
+    with schema_context(schema_name):
+        CacheVersion.objects.update_or_create(namespace=namespace, defaults={'version': version})
+
+    # readers in this process go to the database until the new token is committed
+    key = (namespace, schema_name)
+    _local_versions().delete(key)
+    transaction.on_commit(lambda: _local_versions().delete(key))
+    return version
+
+
+class LRUCache:
+    '''
+    Small thread-safe, process-local LRU cache with an optional TTL (seconds).
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    '''
+    Process-local LRUCache in front of an optional shared django cache
+    (`shared_alias` names an entry of settings.CACHES, e.g. a redis cache),
+    so that all workers benefit from a value computed by one of them.
+    '''
+
+    def __init__(self, prefix, maxsize=1024, ttl=None, shared_alias=None):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, ttl)
+        self.shared = caches[shared_alias] if shared_alias else None
+
+    def _shared_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(self._shared_key(key), _MISSING)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                return value
+
+        return default
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value, timeout=self.ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        '''clears the local layer only, shared entries expire through their ttl'''
+        self.local.clear()
+
+
+_MISSING = object()
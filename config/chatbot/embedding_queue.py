@@ -0,0 +1,66 @@
+"""
+DB-backed embedding queue.
+
+FAQs saved with NLP_ASYNC_EMBEDDING (or while the model was unavailable)
+are flagged `embedding_pending`. The worker (`manage.py embedding_worker`)
+claims them with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can
+run side by side, and embeds each claimed batch with one encode call.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_context
+from .nlp import generate_vectors, encode_vector, hash_question, get_search_backend
+
+
+def embed_pending_faqs(batch_size=None):
+    '''embeds one batch of queued FAQs of the active schema, returns how many were done'''
+    from .models import FAQ
+
+    batch_size = batch_size or settings.NLP_EMBEDDING_BATCH_SIZE
+    schema_name = connection.schema_name
+
+    with transaction.atomic():
+        faqs = list(
+            FAQ.objects.filter(embedding_pending=True)
+            .select_for_update(skip_locked=True)
+            .only('id', 'question')
+            .order_by('id')[:batch_size]
+        )
+        if not faqs:
+            return 0
+
+        vectors = generate_vectors([faq.question for faq in faqs])
+        if vectors is None:
+            # model unavailable, the rows stay queued
+            return 0
+
+        for faq, vector in zip(faqs, vectors):
+            faq.question_vector = encode_vector(vector)
+            faq.question_hash = hash_question(faq.question)
+            faq.embedding_pending = False
+
+        FAQ.objects.bulk_update(faqs, ['question_vector', 'question_hash', 'embedding_pending'])
+
+        # bulk_update sends no signals, so the search index is told directly
+        items = [(faq.pk, vector) for faq, vector in zip(faqs, vectors)]
+        transaction.on_commit(lambda: get_search_backend().add_many(schema_name, items))
+
+    return len(faqs)
+
+
+def embed_pending_for_all_tenants(batch_size=None):
+    '''one pass over every tenant schema, returns the number of FAQs embedded'''
+    total = 0
+    schema_names = get_tenant_model().objects.exclude(
+        schema_name=get_public_schema_name()
+    ).values_list('schema_name', flat=True)
+
+    for schema_name in schema_names:
+        with schema_context(schema_name):
+            while True:
+                done = embed_pending_faqs(batch_size)
+                total += done
+                if not done:
+                    break
+
+    return total
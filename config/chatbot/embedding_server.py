@@ -0,0 +1,137 @@
+"""
+Standalone embedding service used by `manage.py run_embedding_server`.
+
+Django workers send their texts to it over HTTP (see nlp.EmbeddingClient).
+Requests arriving at the same time are merged into one `model.encode`
+call, so concurrent widget traffic is embedded in batches by a single
+model copy instead of every worker thread running its own inference.
+"""
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+import time
+
+from .nlp import pack_matrix
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    '''
+    Collects texts from many threads and encodes them together.
+    A batch is flushed as soon as it holds `max_batch_size` texts or the
+    oldest text has waited `max_wait_ms`.
+    '''
+
+    def __init__(self, encode, max_batch_size=32, max_wait_ms=5):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        '''queues the texts, returns one Future per text resolving to its vector'''
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return futures
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                vectors = self.encode([text for text, _ in batch])
+            except Exception as e:
+                logger.exception('Batch encode failed')
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'texts': self.texts,
+            'avg_batch_size': self.texts / self.batches if self.batches else 0,
+            'queued': self._queue.qsize(),
+        }
+
+
+def make_handler(batcher, timeout):
+
+    class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, the client reuses its connection
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self._send_json({'error': 'Not found.'}, 404)
+            self._send_json({'status': 'ok', **batcher.stats()})
+
+        def do_POST(self):
+            if self.path != '/encode':
+                return self._send_json({'error': 'Not found.'}, 404)
+
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                texts = json.loads(self.rfile.read(length))['texts']
+            except (ValueError, KeyError, TypeError):
+                return self._send_json({'error': "Expected a JSON body {'texts': [...]}."}, 400)
+
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                return self._send_json({'error': "'texts' must be a list of strings."}, 400)
+
+            try:
+                vectors = [future.result(timeout) for future in batcher.submit(texts)]
+            except Exception as e:
+                return self._send_json({'error': str(e)}, 503)
+
+            dim = len(vectors[0]) if vectors else 0
+            self._send_json({'dim': dim, 'vectors': pack_matrix(vectors) if vectors else ''})
+
+        def _send_json(self, data, status=200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return EmbeddingRequestHandler
+
+
+def serve(host, port, encode, max_batch_size, max_wait_ms, timeout=30):
+    batcher = MicroBatcher(encode, max_batch_size, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, timeout))
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,209 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from tenants.instrumentation import stage
+from .cache import get_version, bump_version
+import hashlib
+import json
+import threading
+
+FLOW_GRAPH_NAMESPACE = 'flow_graph'
+
+# the node the widget opens with
+ENTRY_NODE = 'welcome_node'
+
+# targets handled by the server without a ChatRule row
+VIRTUAL_NODES = {
+    'show_form': {
+        "type": "show_form",
+        "message": "Please fill out the form below and our team will get back to you.",
+    },
+}
+
+
+def option_targets(rule_data):
+    '''payloads of the options of a rule node, in order, skipping malformed entries'''
+    if not isinstance(rule_data, dict):
+        return []
+
+    options = rule_data.get('options')
+    if not isinstance(options, list):
+        return []
+
+    return [
+        option['payload'] for option in options
+        if isinstance(option, dict) and isinstance(option.get('payload'), str) and option['payload']
+    ]
+
+def find_cycles(edges):
+    '''
+    strongly connected components of the graph that contain a loop
+    (tarjan, iterative so deep flows can't hit the recursion limit).
+    '''
+    index_of, lowlink = {}, {}
+    stack, on_stack = [], set()
+    cycles = []
+    counter = 0
+
+    for root in edges:
+        if root in index_of:
+            continue
+
+        work = [(root, iter(edges.get(root, ())))]
+        index_of[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            advanced = False
+
+            for child in children:
+                if child not in edges:
+                    continue
+                if child not in index_of:
+                    index_of[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges.get(child, ()))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index_of[child])
+
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            if lowlink[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in edges.get(node, ()):
+                    cycles.append(sorted(component))
+
+    return sorted(cycles)
+
+
+class FlowGraph:
+    '''
+    Compiled, validated rule flow of one tenant.
+
+    `nodes` maps node_id -> rule_data, `edges` maps node_id -> the option
+    targets. Broken references are reported rather than raised so the
+    dashboard can show them, navigation to a missing node simply 404s.
+    '''
+
+    def __init__(self, nodes, version=None, entry=ENTRY_NODE):
+        self.nodes = nodes
+        self.version = version
+        self.entry = entry
+        self.edges = {node_id: option_targets(rule_data) for node_id, rule_data in nodes.items()}
+
+        self.invalid = sorted(
+            node_id for node_id, rule_data in nodes.items() if not isinstance(rule_data, dict)
+        )
+        self.dangling = [
+            {"source": source, "target": target}
+            for source, targets in sorted(self.edges.items())
+            for target in targets
+            if target not in nodes and target not in VIRTUAL_NODES
+        ]
+        self.cycles = find_cycles(self.edges)
+        self.unreachable = sorted(set(nodes) - self.reachable_from(entry))
+        self._bootstrap = None
+
+    @classmethod
+    def build(cls, version=None):
+        '''loads every ChatRule of the active tenant schema'''
+        from .models import ChatRule
+
+        nodes = dict(ChatRule.objects.values_list('node_id', 'rule_data'))
+        return cls(nodes, version)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def reachable_from(self, start):
+        seen = set()
+        pending = [start]
+        while pending:
+            node = pending.pop()
+            if node in seen or node not in self.nodes:
+                continue
+            seen.add(node)
+            pending.extend(self.edges[node])
+        return seen
+
+    def response(self, node_id):
+        '''the payload returned for a rule click, None for unknown nodes'''
+        if node_id in VIRTUAL_NODES:
+            return VIRTUAL_NODES[node_id]
+        return self.nodes.get(node_id)
+
+    def bootstrap(self):
+        '''
+        (payload, etag) for the widget: the entry node, every rule reachable
+        from it and the virtual nodes. computed once per graph version.
+        '''
+        if self._bootstrap is None:
+            nodes = {node_id: self.nodes[node_id] for node_id in sorted(self.reachable_from(self.entry))}
+            nodes.update(VIRTUAL_NODES)
+            payload = {"entry": self.entry, "nodes": nodes}
+            body = json.dumps(payload, sort_keys=True, cls=DjangoJSONEncoder)
+            self._bootstrap = (payload, '"%s"' % hashlib.md5(body.encode()).hexdigest())
+        return self._bootstrap
+
+    @property
+    def is_valid(self):
+        return not (self.invalid or self.dangling)
+
+    def as_dict(self):
+        return {
+            "entry": self.entry,
+            "nodes": self.nodes,
+            "edges": self.edges,
+            "virtual_nodes": sorted(VIRTUAL_NODES),
+            "dangling": self.dangling,
+            "cycles": self.cycles,
+            "unreachable": self.unreachable,
+            "invalid": self.invalid,
+            "is_valid": self.is_valid,
+        }
+
+
+_flow_graphs = {}
+_flow_graph_lock = threading.Lock()
+
+@stage('flow')
+def get_flow_graph():
+    '''returns the cached flow graph of the active tenant schema, rebuilding it when stale'''
+    schema_name = connection.schema_name
+    version = get_version(FLOW_GRAPH_NAMESPACE, schema_name)
+
+    graph = _flow_graphs.get(schema_name)
+    if graph is not None and graph.version == version:
+        return graph
+
+    with _flow_graph_lock:
+        graph = _flow_graphs.get(schema_name)
+        if graph is None or graph.version != version:
+            graph = FlowGraph.build(version)
+            _flow_graphs[schema_name] = graph
+
+    return graph
+
+def invalidate_flow_graph(schema_name=None):
+    '''called whenever a ChatRule of the tenant is saved or deleted'''
+    schema_name = schema_name or connection.schema_name
+    _flow_graphs.pop(schema_name, None)
+    bump_version(FLOW_GRAPH_NAMESPACE, schema_name)
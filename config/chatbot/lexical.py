@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.db import connection
+from .cache import get_version
+import math
+import threading
+import numpy as np
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(normalized_text):
+    '''words of an already normalize_query()-ed text'''
+    return normalized_text.split()
+
+
+class LexicalIndex:
+    '''
+    BM25 inverted index over the FAQ questions (and, with
+    NLP_LEXICAL_INCLUDE_ANSWERS, the answers at a lower weight) of one tenant.
+
+    Besides the ranked search it keeps the normalized questions, so a user
+    question that is an exact (normalized) match is answered without running
+    the encoder at all.
+    '''
+
+    def __init__(self, docs, version=None, answer_weight=0.0):
+        '''docs: (faq_id, normalized question, normalized answer) tuples'''
+        self.version = version
+        self.faq_ids = np.array([faq_id for faq_id, _, _ in docs], dtype=np.int64)
+        self.exact = {}
+
+        term_freqs = []
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        for i, (faq_id, question, answer) in enumerate(docs):
+            self.exact.setdefault(question, faq_id)
+
+            freqs = {}
+            question_tokens = tokenize(question)
+            for token in question_tokens:
+                freqs[token] = freqs.get(token, 0.0) + 1.0
+            length = len(question_tokens)
+
+            if answer_weight and answer:
+                answer_tokens = tokenize(answer)
+                for token in answer_tokens:
+                    freqs[token] = freqs.get(token, 0.0) + answer_weight
+                length += answer_weight * len(answer_tokens)
+
+            term_freqs.append(freqs)
+            lengths[i] = length
+
+        n = len(docs)
+        average_length = float(lengths.mean()) if n else 0.0
+        # idf of a word found in a single question, the most a query word can be worth.
+        # scores are scaled by it so questions made of common words ("what is")
+        # or of words no FAQ uses never look like strong lexical matches
+        self.rare_idf = math.log(1 + (n - 0.5) / 1.5) if n else 0.0
+
+        postings = {}
+        for i, freqs in enumerate(term_freqs):
+            for token, tf in freqs.items():
+                postings.setdefault(token, []).append((i, tf))
+
+        # per term: the documents and their precomputed BM25 contributions
+        self.postings = {}
+        for token, entries in postings.items():
+            docs_idx = np.array([i for i, _ in entries], dtype=np.int32)
+            tf = np.array([tf for _, tf in entries], dtype=np.float32)
+            idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = K1 * (1 - B + B * lengths[docs_idx] / (average_length or 1.0))
+            self.postings[token] = (docs_idx, (idf * tf * (K1 + 1) / (tf + norm)).astype(np.float32))
+
+    @classmethod
+    def build(cls, version=None):
+        '''loads the FAQs of the current schema from the database'''
+        from .models import FAQ
+        from .nlp import normalize_query
+
+        include_answers = settings.NLP_LEXICAL_INCLUDE_ANSWERS
+        docs = [
+            (faq_id, normalize_query(question), normalize_query(answer) if include_answers else '')
+            for faq_id, question, answer in FAQ.objects.order_by('id').values_list('id', 'question', 'answer')
+        ]
+        return cls(docs, version, answer_weight=settings.NLP_LEXICAL_ANSWER_WEIGHT if include_answers else 0.0)
+
+    def __len__(self):
+        return len(self.faq_ids)
+
+    def exact_match(self, normalized_text):
+        return self.exact.get(normalized_text)
+
+    def search(self, normalized_text, k=5):
+        '''
+        up to k (faq_id, score) pairs, best first. scores are scaled to 0..1:
+        1 means every query word is specific to the question it matched.
+        '''
+        terms = set(tokenize(normalized_text))
+        if not len(self) or not terms:
+            return []
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                docs_idx, contributions = posting
+                scores[docs_idx] += contributions
+
+        ideal = self.rare_idf * len(terms)
+        if not ideal:
+            return []
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (int(self.faq_ids[i]), min(1.0, float(scores[i]) / ideal))
+            for i in best if scores[i] > 0
+        ]
+
+
+_lexical_indexes = {}
+_lexical_index_lock = threading.Lock()
+
+def get_lexical_index():
+    '''
+    cached index of the active tenant schema. it follows the FAQ index version,
+    which every FAQ save or delete bumps (whatever the search backend).
+    '''
+    from .nlp import FAQ_INDEX_NAMESPACE
+
+    schema_name = connection.schema_name
+    version = get_version(FAQ_INDEX_NAMESPACE, schema_name)
+
+    index = _lexical_indexes.get(schema_name)
+    if index is not None and index.version == version:
+        return index
+
+    with _lexical_index_lock:
+        index = _lexical_indexes.get(schema_name)
+        if index is None or index.version != version:
+            index = LexicalIndex.build(version)
+            _lexical_indexes[schema_name] = index
+
+    return index
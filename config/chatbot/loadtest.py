@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import time
+
+
+def percentile(sorted_values, pct):
+    '''nearest-rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class LoadResult:
+    '''latencies (ms) and status codes of one load run'''
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms, status):
+        with self._lock:
+            self.latencies.append(latency_ms)
+            if status is None:
+                self.errors += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        ok = sum(count for status, count in self.statuses.items() if status < 400)
+        return {
+            "name": self.name,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "ok": ok,
+            "errors": self.errors,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "throughput": round(self.requests / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        }
+
+
+def run_load(name, send, concurrency, total=None, duration=None):
+    '''
+    calls `send(session, i)` from `concurrency` threads, each with its own
+    requests.Session, until `total` requests were sent or `duration`
+    seconds passed. send returns the response; exceptions count as errors.
+    '''
+    import requests
+
+    result = LoadResult(name, concurrency)
+    counter = iter(range(total if total is not None else 10 ** 12))
+    counter_lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+
+    def next_index():
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        with counter_lock:
+            return next(counter, None)
+
+    def worker():
+        session = requests.Session()
+        while (i := next_index()) is not None:
+            started = time.perf_counter()
+            try:
+                status = send(session, i).status_code
+            except Exception:
+                status = None
+            result.add((time.perf_counter() - started) * 1000, status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+class DatabaseStats:
+    '''
+    Counters of the current postgres database, read before and after a load
+    run: statements executed (pg_stat_statements, when the extension is
+    installed), transactions and rows (pg_stat_database), and the
+    connections the server holds meanwhile (pg_stat_activity, sampled from
+    a thread). The figures cover every client of the database, so nothing
+    else should be running against it.
+    '''
+
+    # pg_stat_database is only updated when a backend flushes its pending stats (about once a second)
+    FLUSH_DELAY = 1.5
+
+    COUNTERS = ['xact_commit', 'xact_rollback', 'tup_returned', 'tup_fetched',
+                'tup_inserted', 'tup_updated', 'tup_deleted', 'blks_read', 'blks_hit']
+
+    def __init__(self, sample_interval=0.2):
+        self.sample_interval = sample_interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._before = None
+
+    def snapshot(self):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_stat_clear_snapshot()')
+            cursor.execute(
+                f"SELECT {', '.join(self.COUNTERS)} FROM pg_stat_database WHERE datname = current_database()"
+            )
+            counters = dict(zip(self.COUNTERS, cursor.fetchone()))
+
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+            if cursor.fetchone():
+                cursor.execute(
+                    "SELECT coalesce(sum(calls), 0) FROM pg_stat_statements "
+                    "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())"
+                )
+                counters['statements'] = int(cursor.fetchone()[0])
+            else:
+                counters['statements'] = None
+
+        return counters
+
+    def _sample(self):
+        from django.db import connection
+
+        try:
+            with connection.cursor() as cursor:
+                while not self._stop.wait(self.sample_interval):
+                    cursor.execute(
+                        "SELECT count(*), count(*) FILTER (WHERE state = 'active') FROM pg_stat_activity "
+                        "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+                    )
+                    self.samples.append(cursor.fetchone())
+        finally:
+            connection.close()
+
+    def start(self):
+        self.samples = []
+        self._stop.clear()
+        self._before = self.snapshot()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self, requests):
+        '''deltas since start(), per request where it makes sense'''
+        self._stop.set()
+        self._thread.join()
+        time.sleep(self.FLUSH_DELAY)
+        after = self.snapshot()
+
+        delta = {
+            key: after[key] - self._before[key]
+            for key in after if after[key] is not None and self._before[key] is not None
+        }
+        if 'statements' in delta:
+            # the sampler's own queries
+            delta['statements'] -= len(self.samples)
+
+        requests = requests or 1
+        totals = [total for total, _ in self.samples] or [0]
+        return {
+            "queries_per_req": round(delta['statements'] / requests, 1) if 'statements' in delta else None,
+            "xacts_per_req": round((delta['xact_commit'] + delta['xact_rollback']) / requests, 1),
+            "rows_written": delta['tup_inserted'] + delta['tup_updated'] + delta['tup_deleted'],
+            "blks_read": delta['blks_read'],
+            "conns_peak": max(totals),
+            "conns_mean": round(sum(totals) / len(totals), 1),
+            "conns_active_peak": max([active for _, active in self.samples] or [0]),
+        }
+
+
+SUMMARY_COLUMNS = ['name', 'concurrency', 'requests', 'ok', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+
+def format_table(summaries, columns=SUMMARY_COLUMNS):
+    '''plain text table of LoadResult.summary() (or any dict) rows'''
+    rows = [['-' if summary.get(column) is None else str(summary[column]) for column in columns] for summary in summaries]
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ['  '.join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
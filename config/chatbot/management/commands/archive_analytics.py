@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_context
+from chatbot.analytics import retention_cutoff
+from chatbot.models import AnalyticsLog
+
+class Command(BaseCommand):
+    help = (
+        "Applies the analytics retention policy: AnalyticsLog rows of whole months older than the "
+        "retention period are written to <archive dir>/<schema>/analytics-YYYY-MM.ndjson.gz and deleted. "
+        "Dashboard totals are unaffected, they are served from AnalyticsRollup (backfill_analytics_rollups "
+        "only rebuilds the days from the retention cutoff on)."
+    )
+
+    fields = ['id', 'event_type', 'details', 'timestamp']
+    delete_batch_size = 5000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ANALYTICS_RETENTION_DAYS,
+                            help="Keep at least this many days of raw events.")
+        parser.add_argument('--archive-dir', default=settings.ANALYTICS_ARCHIVE_DIR)
+        parser.add_argument('--schema', help="Only archive this tenant schema.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be archived.")
+
+    def handle(self, *args, **options):
+        # only whole calendar months are archived, the month the cutoff falls in is kept
+        cutoff = retention_cutoff(options['days'])
+        archive_dir = Path(options['archive_dir'])
+
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema']:
+            tenants = tenants.filter(schema_name=options['schema'])
+
+        for schema_name in tenants.values_list('schema_name', flat=True):
+            with schema_context(schema_name):
+                months = (
+                    AnalyticsLog.objects.filter(timestamp__lt=cutoff)
+                    .annotate(month=TruncMonth('timestamp'))
+                    .values_list('month', flat=True).distinct().order_by('month')
+                )
+                for month in list(months):
+                    self.archive_month(schema_name, month, archive_dir / schema_name, options['dry_run'])
+
+        self.stdout.write(self.style.SUCCESS(f"Analytics before {cutoff:%Y-%m-%d} archived."))
+
+    def archive_month(self, schema_name, month, directory, dry_run):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        rows = AnalyticsLog.objects.filter(timestamp__gte=month, timestamp__lt=next_month)
+
+        if dry_run:
+            self.stdout.write(f"{schema_name} {month:%Y-%m}: {rows.count()} events would be archived")
+            return
+
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"analytics-{month:%Y-%m}.ndjson.gz"
+        if path.exists():
+            # a previous run already archived part of this month, never overwrite it
+            path = directory / f"analytics-{month:%Y-%m}.{timezone.now():%Y%m%d%H%M%S}.ndjson.gz"
+
+        tmp_path = path.with_name(path.name + '.tmp')
+        written, max_id = 0, None
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+            for row in rows.order_by('id').values_list(*self.fields).iterator(chunk_size=2000):
+                archive.write(json.dumps(dict(zip(self.fields, row)), cls=DjangoJSONEncoder) + '\n')
+                written, max_id = written + 1, row[0]
+            archive.flush()
+            os.fsync(archive.fileobj.fileno())
+        os.replace(tmp_path, path)
+
+        # only delete what made it into the file (late buffered events stay for the next run)
+        deleted = 0
+        if max_id is not None:
+            to_delete = rows.filter(id__lte=max_id)
+            while True:
+                ids = list(to_delete.values_list('id', flat=True)[:self.delete_batch_size])
+                if not ids:
+                    break
+                deleted += AnalyticsLog.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(f"{schema_name} {month:%Y-%m}: {written} events -> {path} ({deleted} deleted)")
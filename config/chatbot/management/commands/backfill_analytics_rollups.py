@@ -0,0 +1,78 @@
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_context
+from chatbot.analytics import EVENT_LEAD, EVENT_RULE, retention_cutoff
+from chatbot.models import AnalyticsLog, AnalyticsRollup, FormSubmission
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the AnalyticsRollup day counters of every tenant from AnalyticsLog and FormSubmission "
+        "for the days from --since to --until. By default that is the retention period: older raw events "
+        "may have been archived (manage.py archive_analytics), so the rollups of those days are kept as "
+        "they are. Events flushed while a tenant is being rebuilt may be counted twice, so run it off-peak."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help="Only rebuild this tenant schema.")
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help="First day to rebuild (YYYY-MM-DD), default: the retention cutoff.")
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day to rebuild, default: today.")
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff().date()
+        since = options['since'] or cutoff
+        until = options['until'] or timezone.localdate()
+        if since > until:
+            raise CommandError("--since must not be after --until.")
+        if since < cutoff:
+            self.stdout.write(self.style.WARNING(
+                f"Rebuilding from {since}: rollups of days whose events were archived will lose them."
+            ))
+
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema']:
+            tenants = tenants.filter(schema_name=options['schema'])
+
+        for schema_name in tenants.values_list('schema_name', flat=True):
+            with schema_context(schema_name), transaction.atomic():
+                rollups = self.rebuild(since, until)
+            self.stdout.write(f"{schema_name}: {len(rollups)} rollup rows")
+
+        self.stdout.write(self.style.SUCCESS("Analytics rollups rebuilt."))
+
+    def rebuild(self, since, until):
+        tracked = settings.ANALYTICS_ROLLUP_RULE_KEYS
+        tz = timezone.get_current_timezone()
+        start = datetime.combine(since, time.min, tzinfo=tz)
+        end = datetime.combine(until + timedelta(days=1), time.min, tzinfo=tz)
+
+        events = AnalyticsLog.objects.filter(timestamp__gte=start, timestamp__lt=end).annotate(
+            day=TruncDate('timestamp'),
+            key=Case(
+                When(event_type=EVENT_RULE, details__message__in=tracked, then=KeyTextTransform('message', 'details')),
+                default=Value(''),
+                output_field=CharField(),
+            ),
+        ).values('day', 'event_type', 'key').annotate(total=Count('id')).order_by()
+
+        leads = FormSubmission.objects.filter(submitted_at__gte=start, submitted_at__lt=end).annotate(
+            day=TruncDate('submitted_at'),
+        ).values('day').annotate(total=Count('id')).order_by()
+
+        rollups = [
+            AnalyticsRollup(day=row['day'], event_type=row['event_type'], key=row['key'], count=row['total'])
+            for row in events
+        ] + [
+            AnalyticsRollup(day=row['day'], event_type=EVENT_LEAD, count=row['total'])
+            for row in leads
+        ]
+
+        AnalyticsRollup.objects.filter(day__gte=since, day__lte=until).delete()
+        AnalyticsRollup.objects.bulk_create(rollups, batch_size=1000)
+        return rollups
@@ -0,0 +1,128 @@
+import json
+import os
+import platform
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from chatbot.benchmark import BACKENDS, HashingEncoder, ModelEncoder, MAX_FAQS, run_benchmark, compare
+from chatbot.loadtest import format_table
+from chatbot.nlp import VECTOR_DTYPES, generate_vectors
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the FAQ retrieval backends on synthetic tenants (10 to 100k FAQs with paraphrased "
+        "questions): latency percentiles, throughput, index memory, top-1/top-k accuracy and answers per "
+        "confidence threshold. Results can be written as JSON and compared against an earlier run:\n"
+        "  manage.py benchmark_nlp --json before.json\n"
+        "  manage.py benchmark_nlp --compare before.json --fail-on-regression"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                            help="FAQ count of each synthetic tenant.")
+        parser.add_argument('--queries', type=int, default=500, help="Paraphrased questions per tenant.")
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+        parser.add_argument('--dtypes', nargs='+', choices=list(VECTOR_DTYPES), default=list(VECTOR_DTYPES),
+                            help="Storage dtypes of FAQ.question_vector to compare.")
+        parser.add_argument('--thresholds', type=float, nargs='+',
+                            default=[settings.NLP_SUGGESTION_THRESHOLD, settings.NLP_CONFIDENCE_THRESHOLD, 0.7])
+        parser.add_argument('--encoder', choices=['synthetic', 'model'], default='synthetic',
+                            help="'model' embeds the texts with the configured sentence model (slow, "
+                                 "but gives meaningful accuracy figures).")
+        parser.add_argument('--dim', type=int, default=384, help="Vector size of the synthetic encoder.")
+        parser.add_argument('--noise', type=float, default=0.5,
+                            help="How far the synthetic encoder moves paraphrases apart (0 = only the wording).")
+        parser.add_argument('--nprobe', type=int, default=settings.NLP_IVF_NPROBE)
+        parser.add_argument('--lexical-weight', type=float, default=settings.NLP_LEXICAL_WEIGHT)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help="Write the results to this file.")
+        parser.add_argument('--compare', help="Results file of an earlier run to compare against.")
+        parser.add_argument('--latency-tolerance', type=float, default=0.2,
+                            help="Relative latency/throughput/memory change that counts as a regression.")
+        parser.add_argument('--accuracy-tolerance', type=float, default=0.01,
+                            help="Absolute accuracy drop that counts as a regression.")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error when --compare finds a regression.")
+
+    def handle(self, *args, **options):
+        if max(options['sizes']) > MAX_FAQS:
+            raise CommandError(f"--sizes can be at most {MAX_FAQS}")
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+
+        if options['encoder'] == 'model':
+            if generate_vectors(['warm up']) is None:
+                raise CommandError("The embedding model is not available.")
+            encoder = ModelEncoder()
+        else:
+            encoder = HashingEncoder(dim=options['dim'], noise=options['noise'], seed=options['seed'])
+
+        rows = run_benchmark(
+            options['sizes'], options['backends'], options['dtypes'], encoder,
+            queries=options['queries'], k=options['k'], thresholds=options['thresholds'],
+            nprobe=options['nprobe'], lexical_weight=options['lexical_weight'], seed=options['seed'],
+            log=self.stdout.write,
+        )
+
+        columns = ['faqs', 'backend', 'dtype', 'p50_ms', 'p95_ms', 'p99_ms', 'qps', 'batch_qps',
+                   'top1', 'topk', 'index_mb', 'build_s']
+        self.stdout.write('\n' + format_table(rows, columns))
+
+        threshold_columns = [f'{name}@{threshold:g}' for threshold in options['thresholds']
+                             for name in ('answered', 'precision')]
+        self.stdout.write('\n' + format_table(rows, ['faqs', 'backend', 'dtype'] + threshold_columns))
+
+        results = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'encoder': options['encoder'],
+                'options': {key: options[key] for key in (
+                    'sizes', 'queries', 'k', 'backends', 'dtypes', 'thresholds', 'dim', 'noise', 'nprobe',
+                    'lexical_weight', 'seed')},
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            'results': rows,
+        }
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json']}"))
+
+        if baseline is not None:
+            self._compare(baseline, rows, options)
+
+    def _compare(self, baseline, rows, options):
+        changes = compare(baseline.get('results', []), rows,
+                          options['latency_tolerance'], options['accuracy_tolerance'])
+        if baseline.get('meta', {}).get('encoder') not in (None, options['encoder']):
+            self.stdout.write(self.style.WARNING("The baseline was run with another encoder."))
+
+        if not changes:
+            self.stdout.write(self.style.WARNING("No result of this run matches the baseline."))
+            return
+
+        regressions = [change for change in changes if change['regression']]
+        self.stdout.write('\n' + format_table(
+            changes, ['faqs', 'backend', 'dtype', 'metric', 'baseline', 'current', 'change', 'regression']
+        ))
+
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f"\nNo regressions against {options['compare']}."))
+            return
+
+        message = f"{len(regressions)} regression(s) against {options['compare']}."
+        if options['fail_on_regression']:
+            raise CommandError(message)
+        self.stdout.write(self.style.ERROR('\n' + message))
@@ -0,0 +1,104 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django_tenants.utils import get_tenant_model, get_public_schema_name
+from chatbot.loadtest import percentile, format_table
+from chatbot.models import FAQ
+
+CONNECTION_MODES = ['persistent', 'new']
+PATTERNS = ['same', 'rotating']
+
+class Command(BaseCommand):
+    help = (
+        "Measures what switching tenants costs per request on the configured database: the tenant "
+        "switches of HeaderTenantMiddleware around one tenant query, with a kept or a new connection "
+        "per request, one tenant for every request or a different one each time, and the search_path "
+        "sent only when it changes (config.tenants.postgresql_backend) or with every cursor like the "
+        "stock django-tenants backend.\n"
+        "  manage.py benchmark_schema_switch --cycles 2000 --json switch.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cycles', type=int, default=1000, help="Requests simulated per combination.")
+        parser.add_argument('--tenants', type=int, default=20, help="Tenants the 'rotating' pattern goes through.")
+        parser.add_argument('--connection', nargs='+', choices=CONNECTION_MODES, default=CONNECTION_MODES)
+        parser.add_argument('--pattern', nargs='+', choices=PATTERNS, default=PATTERNS)
+        parser.add_argument('--json', help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        if options['cycles'] < 1:
+            raise CommandError("--cycles must be at least 1")
+        if not hasattr(connection, 'reuse_search_path'):
+            raise CommandError("The default database doesn't use config.tenants.postgresql_backend.")
+
+        tenants = list(get_tenant_model().objects.exclude(
+            schema_name=get_public_schema_name()
+        ).order_by('schema_name')[:options['tenants']])
+        if not tenants:
+            raise CommandError("There are no tenants to switch between.")
+
+        rows = []
+        reuse = connection.reuse_search_path
+        try:
+            for mode in options['connection']:
+                for pattern in options['pattern']:
+                    for reuse_search_path in (True, False):
+                        connection.reuse_search_path = reuse_search_path
+                        row = {
+                            'connection': mode, 'pattern': pattern,
+                            'search_path': 'on change' if reuse_search_path else 'every cursor',
+                            **self.measure(tenants if pattern == 'rotating' else tenants[:1],
+                                           options['cycles'], new_connection=mode == 'new'),
+                        }
+                        rows.append(row)
+                        self.stdout.write(format_table([row], list(row)).splitlines()[-1])
+        finally:
+            connection.reuse_search_path = reuse
+            connection.set_schema_to_public()
+
+        columns = ['connection', 'pattern', 'search_path', 'tenants', 'cycles', 'mean_ms', 'p50_ms', 'p95_ms',
+                   'search_path_per_cycle', 'skipped_per_cycle', 'connects_per_cycle']
+        self.stdout.write('\n' + format_table(rows, columns))
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(rows, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json']}"))
+
+    def measure(self, tenants, cycles, new_connection):
+        """
+        One cycle is what HeaderTenantMiddleware does for a widget request whose tenant
+        comes from its cache: back to public, the tenant, one query, back to public.
+        With new_connection the connection is closed afterwards like CONN_MAX_AGE = 0 does.
+        """
+        # the first connection and the tenant tables' plans are not measured
+        connection.set_tenant(tenants[0])
+        FAQ.objects.exists()
+
+        before = connection.search_path_stats.snapshot()
+        latencies = []
+        for i in range(cycles):
+            started = time.perf_counter()
+
+            connection.set_schema_to_public()
+            connection.set_tenant(tenants[i % len(tenants)])
+            FAQ.objects.exists()
+            connection.set_schema_to_public()
+            if new_connection:
+                connection.close()
+
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        after = connection.search_path_stats.snapshot()
+        latencies.sort()
+        return {
+            'tenants': len(tenants),
+            'cycles': cycles,
+            'mean_ms': round(sum(latencies) / cycles, 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'search_path_per_cycle': round((after['sent'] - before['sent']) / cycles, 2),
+            'skipped_per_cycle': round((after['skipped'] - before['skipped']) / cycles, 2),
+            'connects_per_cycle': round((after['connections'] - before['connections']) / cycles, 2),
+        }
@@ -0,0 +1,64 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from chatbot.nlp import FAQIndex, IVFIndex, normalize_rows
+
+class Command(BaseCommand):
+    help = "Compares recall and latency of the IVF search backend against the exact scan on synthetic vectors."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--faqs', type=int, default=20000, help="Number of synthetic FAQ vectors.")
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--dim', type=int, default=384, help="Embedding size (MiniLM = 384).")
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+        parser.add_argument('--nlist', type=int, default=None, help="Defaults to sqrt(faqs).")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        n, dim, k = options['faqs'], options['dim'], options['k']
+
+        # FAQs are grouped around topics, queries are noisy "paraphrases" of random FAQs
+        topics = rng.standard_normal((max(1, n // 50), dim))
+        matrix = topics[rng.integers(len(topics), size=n)] + 0.6 * rng.standard_normal((n, dim))
+        matrix = normalize_rows(matrix.astype(np.float32))
+        faq_ids = np.arange(1, n + 1, dtype=np.int64)
+
+        queries = matrix[rng.integers(n, size=options['queries'])]
+        queries = normalize_rows(queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32))
+
+        exact = FAQIndex(faq_ids, matrix)
+        exact_results, exact_times = self._run(lambda q: exact.search(q, k), queries)
+
+        started = time.perf_counter()
+        ivf = IVFIndex.train(faq_ids, matrix, nlist=options['nlist'])
+        build_time = time.perf_counter() - started
+
+        self.stdout.write(f"{n} faqs, dim {dim}, {len(queries)} queries, top-{k}")
+        self.stdout.write(f"ivf: {len(ivf.centroids)} lists, trained in {build_time:.2f}s\n")
+        self._report('exact', exact_times, 1.0, 1.0)
+
+        for nprobe in options['nprobe']:
+            results, times = self._run(lambda q: ivf.search(q, k, nprobe), queries)
+
+            recall_1 = np.mean([r[0][0] == e[0][0] for r, e in zip(results, exact_results)])
+            recall_k = np.mean([
+                len({i for i, _ in r} & {i for i, _ in e}) / len(e)
+                for r, e in zip(results, exact_results)
+            ])
+            self._report(f'ivf nprobe={nprobe}', times, recall_1, recall_k)
+
+    def _run(self, search, queries):
+        results, times = [], []
+        for query in queries:
+            started = time.perf_counter()
+            results.append(search(query))
+            times.append(time.perf_counter() - started)
+        return results, np.array(times) * 1000
+
+    def _report(self, label, times, recall_1, recall_k):
+        self.stdout.write(
+            f"{label:<18} p50 {np.percentile(times, 50):7.3f}ms  p95 {np.percentile(times, 95):7.3f}ms  "
+            f"recall@1 {recall_1:.3f}  recall@k {recall_k:.3f}"
+        )
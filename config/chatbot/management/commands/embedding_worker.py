@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from chatbot.embedding_queue import embed_pending_for_all_tenants
+
+class Command(BaseCommand):
+    help = "Embeds FAQs queued by NLP_ASYNC_EMBEDDING / bulk import, for every tenant."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process the queue once and exit.")
+        parser.add_argument('--batch-size', type=int, default=None, help="FAQs per encode call.")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds between polls when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            done = embed_pending_for_all_tenants(options['batch_size'])
+            if done:
+                self.stdout.write(f"Embedded {done} FAQs.")
+
+            if options['once']:
+                break
+            if not done:
+                time.sleep(options['sleep'])
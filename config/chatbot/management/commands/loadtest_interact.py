@@ -0,0 +1,76 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.loadtest import run_load, format_table
+
+DEFAULT_QUESTIONS = [
+    "What are your opening hours?",
+    "How much does it cost?",
+    "Do you offer support after launch?",
+    "Where are you located?",
+    "How can I contact you?",
+    "Can I get a refund?",
+]
+
+class Command(BaseCommand):
+    help = (
+        "Sends concurrent /api/v1/interact/ requests to one or more running servers and compares "
+        "throughput and latency, e.g. gunicorn (WSGI) on :8000 against uvicorn (ASGI) on :8001:\n"
+        "  manage.py loadtest_interact --client acme --target wsgi=http://127.0.0.1:8000 "
+        "--target asgi=http://127.0.0.1:8001"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True,
+                            help="name=base_url of a running server, repeatable.")
+        parser.add_argument('--client', required=True, help="X-Client-ID (schema name) of the tenant to use.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument('--requests', type=int, default=500, help="Requests per target and concurrency level.")
+        parser.add_argument('--type', choices=['text', 'rule'], default='text')
+        parser.add_argument('--questions', help="File with one question (or rule node id) per line.")
+        parser.add_argument('--unique', action='store_true',
+                            help="Make every question unique so the query cache can't answer it.")
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--json', help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url:
+                raise CommandError(f"--target must look like name=http://host:port, got {target!r}")
+            targets.append((name, url.rstrip('/') + '/api/v1/interact/'))
+
+        if options['questions']:
+            with open(options['questions']) as f:
+                payloads = [line.strip() for line in f if line.strip()]
+        elif options['type'] == 'rule':
+            payloads = ['welcome_node']
+        else:
+            payloads = DEFAULT_QUESTIONS
+
+        headers = {'Content-Type': 'application/json', 'X-Client-ID': options['client']}
+
+        def make_sender(url):
+            def send(session, i):
+                payload = payloads[i % len(payloads)]
+                if options['unique']:
+                    payload = f'{payload} #{i}'
+                body = json.dumps({'type': options['type'], 'payload': payload})
+                return session.post(url, data=body, headers=headers, timeout=options['timeout'])
+            return send
+
+        summaries = []
+        for concurrency in options['concurrency']:
+            for name, url in targets:
+                # a few requests first so model loading / connections are not measured
+                run_load(name, make_sender(url), min(concurrency, 4), total=min(concurrency, 4) * 2)
+                result = run_load(name, make_sender(url), concurrency, total=options['requests'])
+                summaries.append(result.summary())
+                self.stdout.write(format_table([summaries[-1]]).splitlines()[-1])
+
+        self.stdout.write('\n' + format_table(summaries))
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(summaries, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json']}"))
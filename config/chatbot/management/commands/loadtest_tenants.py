@@ -0,0 +1,217 @@
+import json
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django_tenants.utils import get_tenant_model, tenant_context
+from rest_framework.authtoken.models import Token
+from tenants.models import Domain, Plan, Subscription
+from chatbot.benchmark import SyntheticTenant
+from chatbot.loadtest import DatabaseStats, run_load, format_table
+from chatbot.models import FAQ, ChatRule
+from chatbot.nlp import encode_vector, generate_vectors, hash_question
+
+LOADTEST_PLAN = 'Load test'
+LOADTEST_USER = 'loadtest'
+
+RULES = {
+    'welcome_node': {
+        "type": "options", "message": "Hi! How can we help?",
+        "options": [{"text": "Pricing", "payload": "pricing_node"},
+                    {"text": "Support", "payload": "support_node"},
+                    {"text": "Talk to us", "payload": "show_form"}],
+    },
+    'pricing_node': {
+        "type": "options", "message": "Plans start at $10 a month.",
+        "options": [{"text": "Back", "payload": "welcome_node"}, {"text": "Talk to us", "payload": "show_form"}],
+    },
+    'support_node': {
+        "type": "options", "message": "Our support team answers within a day.",
+        "options": [{"text": "Back", "payload": "welcome_node"}],
+    },
+}
+RULE_CLICKS = ['welcome_node', 'pricing_node', 'welcome_node', 'support_node', 'show_form']
+
+SCENARIOS = ['text', 'rule', 'form', 'summary']
+
+# spreads consecutive requests over the tenants in a fixed, shuffled looking order
+TENANT_STRIDE = 7919
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end load test of the multi-tenant request path (tenant middleware, views, NLP, "
+        "analytics) against a running server and its local postgres database.\n"
+        "  manage.py loadtest_tenants setup --tenants 300\n"
+        "  manage.py loadtest_tenants run --url http://127.0.0.1:8000 --concurrency 32 --json run.json\n"
+        "  manage.py loadtest_tenants teardown\n"
+        "Each scenario (widget text questions, rule clicks, form submissions, dashboard summary "
+        "loads) spreads its requests over every load test tenant and reports throughput, tail latency, "
+        "DB statements and transactions per request and the connections the server held. Statement "
+        "counts need the pg_stat_statements extension and cover the whole database, so run it "
+        "against an otherwise idle one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['setup', 'run', 'teardown'])
+        parser.add_argument('--prefix', default='loadtest_', help="Schema name prefix of the load test tenants.")
+        parser.add_argument('--tenants', type=int, default=300,
+                            help="setup: tenants to create. run: use at most this many of them.")
+        parser.add_argument('--faqs', type=int, default=50, help="setup: FAQs per tenant.")
+        parser.add_argument('--questions', type=int, default=500,
+                            help="run: paraphrased questions about the tenants' FAQs for the text scenario.")
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="run: base URL of the server.")
+        parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000, help="run: requests per scenario.")
+        parser.add_argument('--duration', type=float, help="run: seconds per scenario instead of --requests.")
+        parser.add_argument('--unique', action='store_true',
+                            help="run: make every text question unique so the query cache can't answer it.")
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--json', help="run: also write the results to this file.")
+
+    def handle(self, *args, **options):
+        if not options['prefix'] or not options['prefix'].endswith('_'):
+            raise CommandError("--prefix must end with '_' (e.g. loadtest_), it selects the tenants to drop.")
+
+        getattr(self, options['action'])(options)
+
+    def load_test_tenants(self, prefix):
+        return get_tenant_model().objects.filter(schema_name__startswith=prefix).order_by('schema_name')
+
+    def setup(self, options):
+        """
+        Creates the tenants with a subscription that never runs into the lead limit,
+        the same FAQs (embedded once for all of them) and a small rule flow each,
+        plus the dashboard user whose token the summary scenario uses.
+        """
+        plan, _ = Plan.objects.get_or_create(
+            name=LOADTEST_PLAN, defaults={'price': 0, 'max_faqs': 10 ** 6, 'max_leads': 10 ** 9},
+        )
+
+        faqs = SyntheticTenant(options['faqs'], queries=0)
+        vectors = generate_vectors(faqs.questions)
+        if vectors is None:
+            self.stdout.write(self.style.WARNING(
+                "The embedding model is not available, the FAQs are left to the embedding worker."
+            ))
+
+        existing = set(self.load_test_tenants(options['prefix']).values_list('schema_name', flat=True))
+        for i in range(options['tenants']):
+            schema_name = f"{options['prefix']}{i:04d}"
+            if schema_name in existing:
+                continue
+
+            started = time.perf_counter()
+            tenant = get_tenant_model().objects.create(
+                name=f'Load test {i}', schema_name=schema_name,
+                subscription=Subscription.objects.create(plan=plan, active=True),
+            )
+            Domain.objects.create(tenant=tenant, domain=f'{schema_name}.loadtest.localhost', is_primary=True)
+
+            with tenant_context(tenant):
+                for j, (question, answer) in enumerate(zip(faqs.questions, faqs.answers)):
+                    faq = FAQ(question=question, answer=answer)
+                    if vectors is not None:
+                        # precomputed, save() does not embed it again
+                        faq.question_vector = encode_vector(vectors[j])
+                        faq.question_hash = hash_question(question)
+                    faq.save()
+
+                for node_id, rule_data in RULES.items():
+                    ChatRule.objects.create(node_id=node_id, rule_data=rule_data)
+
+            self.stdout.write(f"{schema_name} created in {time.perf_counter() - started:.1f}s")
+
+        user, created = get_user_model().objects.get_or_create(username=LOADTEST_USER)
+        if created:
+            user.set_unusable_password()
+            user.save()
+        Token.objects.get_or_create(user=user)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.load_test_tenants(options['prefix']).count()} load test tenants ready."
+        ))
+
+    def teardown(self, options):
+        """Drops the load test schemas, their subscriptions, the plan and the dashboard user."""
+        for tenant in self.load_test_tenants(options['prefix']):
+            subscription = tenant.subscription
+            tenant.delete(force_drop=True)
+            if subscription is not None:
+                subscription.delete()
+            self.stdout.write(f"{tenant.schema_name} dropped")
+
+        Plan.objects.filter(name=LOADTEST_PLAN).delete()
+        get_user_model().objects.filter(username=LOADTEST_USER).delete()
+        self.stdout.write(self.style.SUCCESS("Load test tenants removed."))
+
+    def run(self, options):
+        schemas = list(self.load_test_tenants(options['prefix']).values_list('schema_name', flat=True))
+        schemas = schemas[:options['tenants']]
+        if not schemas:
+            raise CommandError("No load test tenants, run `loadtest_tenants setup` first.")
+
+        token = Token.objects.filter(user__username=LOADTEST_USER).values_list('key', flat=True).first()
+        if token is None and 'summary' in options['scenario']:
+            raise CommandError("No load test user, run `loadtest_tenants setup` first.")
+
+        # the questions paraphrase the FAQs every tenant was set up with
+        with tenant_context(get_tenant_model().objects.get(schema_name=schemas[0])):
+            faq_count = FAQ.objects.count()
+        questions = SyntheticTenant(faq_count, queries=options['questions']).queries
+
+        base_url = options['url'].rstrip('/')
+        timeout = options['timeout']
+
+        def request(session, i, method, path, body=None, auth=False):
+            headers = {'X-Client-ID': schemas[i * TENANT_STRIDE % len(schemas)]}
+            if auth:
+                headers['Authorization'] = f'Token {token}'
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+                body = json.dumps(body)
+            return session.request(method, base_url + path, data=body, headers=headers, timeout=timeout)
+
+        def text(session, i):
+            question = questions[i % len(questions)]
+            if options['unique']:
+                question = f'{question} #{i}'
+            return request(session, i, 'POST', '/api/v1/interact/', {'type': 'text', 'payload': question})
+
+        def rule(session, i):
+            return request(session, i, 'POST', '/api/v1/interact/',
+                           {'type': 'rule', 'payload': RULE_CLICKS[i % len(RULE_CLICKS)]})
+
+        def form(session, i):
+            return request(session, i, 'POST', '/api/v1/submissions/', {
+                'name': f'Load test {i}', 'email': f'loadtest{i}@example.com',
+                'phone': '5550100', 'message': 'Please call me back.',
+            })
+
+        def summary(session, i):
+            return request(session, i, 'GET', '/api/v1/analytics/summary/', auth=True)
+
+        senders = {'text': text, 'rule': rule, 'form': form, 'summary': summary}
+        concurrency = options['concurrency']
+        self.stdout.write(f"{len(schemas)} tenants, concurrency {concurrency}, {base_url}")
+
+        stats = DatabaseStats()
+        summaries = []
+        for scenario in options['scenario']:
+            # every tenant once first, so cold caches and new connections are not measured
+            run_load(scenario, senders[scenario], concurrency, total=len(schemas))
+
+            stats.start()
+            result = run_load(scenario, senders[scenario], concurrency,
+                              total=None if options['duration'] else options['requests'],
+                              duration=options['duration'])
+            summaries.append({**result.summary(), "tenants": len(schemas), **stats.stop(result.requests)})
+            self.stdout.write(format_table([summaries[-1]]).splitlines()[-1])
+
+        columns = ['name', 'tenants', 'requests', 'ok', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms',
+                   'max_ms', 'queries_per_req', 'xacts_per_req', 'rows_written', 'conns_peak', 'conns_active_peak']
+        self.stdout.write('\n' + format_table(summaries, columns))
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(summaries, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json']}"))
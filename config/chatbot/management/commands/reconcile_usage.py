@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django_tenants.utils import get_tenant_model, get_public_schema_name, schema_context
+from chatbot import usage
+
+class Command(BaseCommand):
+    help = "Recounts FAQs and this month's leads for every tenant and corrects drifted usage counters (run periodically, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help="Only reconcile this tenant schema.")
+
+    def handle(self, *args, **options):
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema']:
+            tenants = tenants.filter(schema_name=options['schema'])
+
+        for schema_name in tenants.values_list('schema_name', flat=True):
+            with schema_context(schema_name):
+                changes = usage.reconcile()
+
+            for metric, (old, new) in changes.items():
+                self.stdout.write(self.style.WARNING(f"{schema_name}: {metric} {old} -> {new}"))
+
+        self.stdout.write(self.style.SUCCESS("Usage counters reconciled."))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.embedding_server import serve
+from chatbot.nlp import embedding_model
+import numpy as np
+
+class Command(BaseCommand):
+    help = "Runs the micro-batching embedding server that Django workers reach through NLP_EMBEDDING_SERVER_URL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-batch-size', type=int, default=settings.NLP_EMBEDDING_MAX_BATCH_SIZE,
+                            help="Largest number of texts encoded in one model call.")
+        parser.add_argument('--max-wait-ms', type=float, default=settings.NLP_EMBEDDING_MAX_WAIT_MS,
+                            help="How long the first text of a batch waits for others to join it.")
+
+    def handle(self, *args, **options):
+        if not embedding_model.warm_up():
+            raise CommandError(f"Could not load the embedding model: {embedding_model.error}")
+
+        model = embedding_model.get()
+
+        def encode(texts):
+            return model.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32)
+
+        server = serve(options['host'], options['port'], encode,
+                       options['max_batch_size'], options['max_wait_ms'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedding server listening on http://{options['host']}:{options['port']} "
+            f"(max batch {options['max_batch_size']}, max wait {options['max_wait_ms']}ms)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,75 @@
+# Converts FAQ.question_vector from a JSON float list to the packed float32
+# format of chatbot.nlp.encode_vector (header byte 0x01 + little-endian values).
+
+from django.db import migrations, models
+import numpy as np
+
+FLOAT32_CODE = b'\x01'
+BATCH_SIZE = 500
+
+
+def json_to_binary(apps, schema_editor):
+    FAQ = apps.get_model('chatbot', 'FAQ')
+    batch = []
+
+    # exclude(question_vector=None) would only skip JSON null on a JSONField, not SQL NULL
+    for faq in FAQ.objects.filter(question_vector__isnull=False).only('id', 'question_vector').iterator(chunk_size=BATCH_SIZE):
+        if faq.question_vector is None:  # JSON null
+            continue
+        faq.question_embedding = FLOAT32_CODE + np.asarray(faq.question_vector, dtype='<f4').tobytes()
+        batch.append(faq)
+
+        if len(batch) >= BATCH_SIZE:
+            FAQ.objects.bulk_update(batch, ['question_embedding'])
+            batch = []
+
+    if batch:
+        FAQ.objects.bulk_update(batch, ['question_embedding'])
+
+
+def binary_to_json(apps, schema_editor):
+    FAQ = apps.get_model('chatbot', 'FAQ')
+    batch = []
+
+    for faq in FAQ.objects.filter(question_embedding__isnull=False).only('id', 'question_embedding').iterator(chunk_size=BATCH_SIZE):
+        # float16/int8 rows written later cannot be reversed, they are re-embedded on the next save
+        data = bytes(faq.question_embedding)
+        faq.question_vector = np.frombuffer(data, dtype='<f4', offset=1).tolist() if data[:1] == FLOAT32_CODE else None
+        batch.append(faq)
+
+        if len(batch) >= BATCH_SIZE:
+            FAQ.objects.bulk_update(batch, ['question_vector'])
+            batch = []
+
+    if batch:
+        FAQ.objects.bulk_update(batch, ['question_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_chatrule_faq_response_type_faq_rich_response_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faq',
+            name='question_embedding',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='faq',
+            name='question_vector',
+        ),
+        migrations.RenameField(
+            model_name='faq',
+            old_name='question_embedding',
+            new_name='question_vector',
+        ),
+        migrations.AlterField(
+            model_name='faq',
+            name='question_vector',
+            field=models.BinaryField(blank=True, editable=False, help_text='Auto-generated vector for search', null=True),
+        ),
+    ]
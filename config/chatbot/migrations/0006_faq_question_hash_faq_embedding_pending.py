@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7
+
+import hashlib
+from django.db import migrations, models
+
+
+def fill_question_hash(apps, schema_editor):
+    FAQ = apps.get_model('chatbot', 'FAQ')
+    batch = []
+
+    for faq in FAQ.objects.only('id', 'question', 'question_vector').iterator(chunk_size=500):
+        if faq.question_vector is None:
+            faq.embedding_pending = True
+        else:
+            faq.question_hash = hashlib.sha1((faq.question or '').encode()).hexdigest()
+        batch.append(faq)
+
+        if len(batch) >= 500:
+            FAQ.objects.bulk_update(batch, ['question_hash', 'embedding_pending'])
+            batch = []
+
+    if batch:
+        FAQ.objects.bulk_update(batch, ['question_hash', 'embedding_pending'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_faq_question_vector_binary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faq',
+            name='question_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='faq',
+            name='embedding_pending',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(fill_question_hash, migrations.RunPython.noop),
+    ]
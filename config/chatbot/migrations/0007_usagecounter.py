@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_counters(apps, schema_editor):
+    UsageCounter = apps.get_model('chatbot', 'UsageCounter')
+    FAQ = apps.get_model('chatbot', 'FAQ')
+    FormSubmission = apps.get_model('chatbot', 'FormSubmission')
+
+    now = timezone.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    UsageCounter.objects.create(metric='faqs', period='', value=FAQ.objects.count())
+    UsageCounter.objects.create(
+        metric='leads',
+        period=now.strftime('%Y-%m'),
+        value=FormSubmission.objects.filter(submitted_at__gte=month_start).count(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_faq_question_hash_faq_embedding_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('period', models.CharField(blank=True, default='', max_length=7)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'period'), name='unique_usage_counter')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
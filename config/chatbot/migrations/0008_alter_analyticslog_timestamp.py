@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_usagecounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analyticslog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import TruncDate
+
+
+def seed_rollups(apps, schema_editor):
+    # the whole history, the dashboard totals are read from the rollups from now on
+    AnalyticsRollup = apps.get_model('chatbot', 'AnalyticsRollup')
+    AnalyticsLog = apps.get_model('chatbot', 'AnalyticsLog')
+    FormSubmission = apps.get_model('chatbot', 'FormSubmission')
+
+    events = AnalyticsLog.objects.annotate(
+        day=TruncDate('timestamp'),
+        key=Case(
+            When(event_type='interaction_rule', details__message__in=settings.ANALYTICS_ROLLUP_RULE_KEYS,
+                 then=KeyTextTransform('message', 'details')),
+            default=Value(''),
+            output_field=CharField(),
+        ),
+    ).values('day', 'event_type', 'key').annotate(total=Count('id')).order_by()
+
+    leads = FormSubmission.objects.annotate(
+        day=TruncDate('submitted_at'),
+    ).values('day').annotate(total=Count('id')).order_by()
+
+    AnalyticsRollup.objects.bulk_create([
+        AnalyticsRollup(day=row['day'], event_type=row['event_type'], key=row['key'], count=row['total'])
+        for row in events
+    ] + [
+        AnalyticsRollup(day=row['day'], event_type='lead_submitted', count=row['total'])
+        for row in leads
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_alter_analyticslog_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(max_length=100)),
+                ('key', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'event_type', 'key'), name='unique_analytics_rollup')],
+            },
+        ),
+        migrations.RunPython(seed_rollups, migrations.RunPython.noop),
+    ]
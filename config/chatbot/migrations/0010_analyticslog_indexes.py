@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7
+
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_analyticsrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['timestamp'], name='analyticslog_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['event_type', 'timestamp'], name='analyticslog_type_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(django.db.models.fields.json.KeyTransform('message', 'details'), models.F('timestamp'), condition=models.Q(('event_type', 'interaction_rule')), name='analyticslog_rule_msg_idx'),
+        ),
+    ]
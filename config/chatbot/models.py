@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.db import models
-from .nlp import generate_vector
-import json
+from django.db.models.fields.json import KeyTransform
+from django.utils import timezone
+from .nlp import generate_vector, encode_vector, hash_question
 
 class FAQ(models.Model):
 
@@ -21,20 +23,43 @@ class FAQ(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    #this will save the vector embeddings in database
-    question_vector = models.JSONField(
+    #this will save the vector embeddings in database (packed binary, see nlp.encode_vector)
+    question_vector = models.BinaryField(
         blank=True,
         null=True,
         editable=False,
         help_text="Auto-generated vector for search"
     )
 
+    # sha1 of the question text the current vector was generated from
+    question_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    # queued for the embedding worker (manage.py embedding_worker)
+    embedding_pending = models.BooleanField(default=False, db_index=True, editable=False)
+
     def __str__(self):
         return self.question
     
     #overriding the existing the save method, to implement the custom logic
     def save(self, *args, **kwargs):
-        self.question_vector = generate_vector(self.question)
+        question_hash = hash_question(self.question)
+
+        # only the question is embedded, edits to the answer keep the vector
+        if question_hash != self.question_hash or self.question_vector is None:
+            if settings.NLP_ASYNC_EMBEDDING:
+                # the old vector (if any) keeps serving until the worker replaces it
+                self.embedding_pending = True
+            else:
+                self.question_vector = encode_vector(generate_vector(self.question))
+                # model unavailable -> leave it to the worker
+                self.embedding_pending = self.question_vector is None
+                if not self.embedding_pending:
+                    self.question_hash = question_hash
+
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'question_vector', 'question_hash', 'embedding_pending'}
+
         super().save(*args, **kwargs)
 
 class ChatRule(models.Model):
@@ -62,7 +87,85 @@ class FormSubmission(models.Model):
 class AnalyticsLog(models.Model):
     event_type = models.CharField(max_length=100)
     details = models.JSONField(blank=True,null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the event happens, the row itself is written later in a batch (see analytics.py)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # hourly time series, cursor pagination and the retention cutoff
+            models.Index(fields=['timestamp'], name='analyticslog_timestamp_idx'),
+            # per event type counts over a time range
+            models.Index(fields=['event_type', 'timestamp'], name='analyticslog_type_time_idx'),
+            # rule events by node (details__message='welcome_node' / 'show_form'),
+            # used when the rollups are rebuilt from the raw log
+            models.Index(
+                KeyTransform('message', 'details'), 'timestamp',
+                name='analyticslog_rule_msg_idx',
+                condition=models.Q(event_type='interaction_rule'),
+            ),
+        ]
 
     def __str__(self):
         return self.event_type
+
+
+class UsageCounter(models.Model):
+    """
+    Running per-tenant usage totals used for plan quota checks, so a check
+    is a single-row lookup instead of a COUNT(*) over the tenant's data.
+    `period` is '' for all-time counters and 'YYYY-MM' for monthly buckets.
+    Kept up to date by signals and chatbot.usage, re-synced by
+    `manage.py reconcile_usage`.
+    """
+    METRIC_FAQS = 'faqs'
+    METRIC_LEADS = 'leads'
+
+    metric = models.CharField(max_length=50)
+    period = models.CharField(max_length=7, blank=True, default='')
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'period'], name='unique_usage_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} {self.period or 'all-time'}: {self.value}"
+
+
+class AnalyticsRollup(models.Model):
+    """
+    Pre-aggregated event counts per day and event type, maintained while
+    events are ingested (analytics.py) and rebuilt by
+    `manage.py backfill_analytics_rollups`. Dashboard queries read these
+    few rows instead of counting AnalyticsLog.
+    `key` splits selected event types further, e.g. rule events by node id.
+    """
+    day = models.DateField()
+    event_type = models.CharField(max_length=100)
+    key = models.CharField(max_length=100, blank=True, default='')
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'event_type', 'key'], name='unique_analytics_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.event_type} {self.key}: {self.count}"
+
+
+
+class CacheVersion(models.Model):
+    """
+    Version token of a per-tenant structure the worker processes keep in
+    memory (FAQ search index, flow graph), see chatbot.cache.get_version.
+    Whichever process changes the underlying rows writes a new token, the
+    others rebuild their copy once they read it.
+    """
+    namespace = models.CharField(max_length=50, unique=True)
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.namespace}: {self.version}"
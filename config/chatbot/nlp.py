@@ -1,48 +1,1001 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+from django_tenants.utils import schema_context
+from pathlib import Path
+from .cache import get_version, bump_version, TieredCache
+from .lexical import get_lexical_index
+from tenants.instrumentation import stage
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
 import numpy as np
 
 try:
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-except Exception as e:
-    print(f'Error loading model: {e}')
+    import fcntl
+except ImportError:  # windows, the index file is then written without a cross-process lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FAQ_INDEX_NAMESPACE = 'faq_index'
+
+
+class EmbeddingModel:
+    '''
+    Process wide, lazily loaded SentenceTransformer.
+
+    Nothing is imported until the first `get()`, so manage.py commands and
+    migrations never pay for torch. A failed load puts the provider in the
+    UNAVAILABLE state (retried after NLP_MODEL_RETRY_SECONDS) instead of
+    leaving the module half initialised.
+    '''
+
+    UNLOADED = 'unloaded'
+    READY = 'ready'
+    UNAVAILABLE = 'unavailable'
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self.state = self.UNLOADED
+        self.error = None
+        self.load_seconds = None
+        self._model = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.state == self.READY
+
+    def get(self):
+        '''returns the loaded model, or None while NLP is unavailable'''
+        if self._model is not None:
+            return self._model
+
+        if self.state == self.UNAVAILABLE and time.monotonic() - self._failed_at < settings.NLP_MODEL_RETRY_SECONDS:
+            return None
+
+        return self.load()
+
+    def load(self):
+        with self._lock:
+            if self._model is not None:
+                return self._model
+
+            model_name = self.model_name or settings.NLP_MODEL_NAME
+            started = time.perf_counter()
+            try:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(model_name, device='cpu')
+            except Exception as e:
+                self.state, self.error, self._failed_at = self.UNAVAILABLE, str(e), time.monotonic()
+                logger.error('NLP unavailable, could not load %s: %s', model_name, e)
+                return None
+
+            self.state, self.error = self.READY, None
+            self.load_seconds = time.perf_counter() - started
+            logger.info('Loaded embedding model %s in %.2fs', model_name, self.load_seconds)
+            return self._model
+
+    def warm_up(self):
+        '''loads the weights and runs one encode so the first user request is not the slow one'''
+        model = self.get()
+        if model is not None:
+            model.encode('warm up')
+        return model is not None
+
+    def stats(self):
+        '''cold start and memory figures of this process, used to compare worker setups'''
+        return {
+            'pid': os.getpid(),
+            'state': self.state,
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+            **_memory_usage(),
+        }
+
+
+def _memory_usage():
+    '''rss and pss (rss with shared copy-on-write pages split between processes) in MB'''
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('Rss', 'Pss'):
+                    usage[f'{key.lower()}_mb'] = int(value.split()[0]) / 1024
+    except OSError:  # not linux
+        import resource
+        usage['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+embedding_model = EmbeddingModel()
+
+
+class InferenceUnavailable(Exception):
+    '''a question needed the encoder and neither the embedding server nor the model could run it'''
+
+
+class EmbeddingClient:
+    '''
+    Thin HTTP client of the embedding server (manage.py run_embedding_server).
+    After a failed call the server is skipped for NLP_EMBEDDING_SERVER_RETRY_SECONDS
+    and callers fall back to the in-process model.
+    '''
+
+    def __init__(self, url, timeout=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout or settings.NLP_EMBEDDING_SERVER_TIMEOUT
+        self._local = threading.local()
+        self._down_until = 0
+
+    def _session(self):
+        # one keep-alive session per thread, requests.Session is not thread safe
+        if not hasattr(self._local, 'session'):
+            import requests
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def encode(self, texts):
+        '''returns a float32 (len(texts), dim) matrix, or None when the server cannot be reached'''
+        if time.monotonic() < self._down_until:
+            return None
+
+        try:
+            response = self._session().post(f'{self.url}/encode', json={'texts': list(texts)}, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            logger.warning('Embedding server %s unavailable, using in-process model: %s', self.url, e)
+            self._down_until = time.monotonic() + settings.NLP_EMBEDDING_SERVER_RETRY_SECONDS
+            return None
+
+        return unpack_matrix(data['vectors'], data['dim'])
+
+
+def pack_matrix(matrix):
+    '''float32 matrix -> base64 text, the wire format of the embedding server'''
+    return base64.b64encode(np.ascontiguousarray(matrix, dtype='<f4').tobytes()).decode('ascii')
+
+def unpack_matrix(data, dim):
+    return np.frombuffer(base64.b64decode(data), dtype='<f4').reshape(-1, dim)
+
+
+_embedding_client = None
+
+def get_embedding_client():
+    '''the configured embedding server client, or None when running in-process only'''
+    global _embedding_client
+
+    if _embedding_client is None and settings.NLP_EMBEDDING_SERVER_URL:
+        _embedding_client = EmbeddingClient(settings.NLP_EMBEDDING_SERVER_URL)
+
+    return _embedding_client
+
+@stage('embed')
+def generate_vectors(texts):
+    '''embeds a list of strings in one batch, returns a float32 matrix (one row per text) or None'''
+    texts = list(texts)
+    if not texts:
+        return None
+
+    client = get_embedding_client()
+    if client is not None:
+        vectors = client.encode(texts)
+        if vectors is not None:
+            return vectors
+        if not settings.NLP_EMBEDDING_SERVER_FALLBACK:
+            return None
+
+    model = embedding_model.get()
+    if model is None:
+        return None
+
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32)
+
+def hash_question(question: str):
+    '''fingerprint of the text an FAQ vector was embedded from'''
+    return hashlib.sha1((question or '').encode()).hexdigest()
 
 def generate_vector(text: str):
     '''takes a string returns its vector embedding as python list'''
-    if not model or not text:
+    if not text:
         return None
-    
-    embedding = model.encode(text)
-    return embedding.tolist()
 
-def find_best_faq(user_question: str):
-    '''finds most relevant faq for user's question from the client's database'''
-    from .models import FAQ
+    vectors = generate_vectors([text])
+    if vectors is None:
+        return None
+
+    return vectors[0].tolist()
 
-    if not model:
+# FAQ.question_vector is stored as one header byte naming the dtype followed by
+# the raw little-endian values; int8 rows also carry their float32 scale factor
+VECTOR_DTYPES = {
+    'float32': (1, np.dtype('<f4')),
+    'float16': (2, np.dtype('<f2')),
+    'int8': (3, np.dtype('i1')),
+}
+_VECTOR_DTYPE_CODES = {code: (name, dtype) for name, (code, dtype) in VECTOR_DTYPES.items()}
+_INT8_SCALE = np.dtype('<f4')
+
+def encode_vector(vector, dtype=None):
+    '''packs an embedding into the compact binary format used by FAQ.question_vector'''
+    if vector is None:
         return None
-    
-    user_vector = np.array(generate_vector(user_question))
 
-    all_faqs = FAQ.objects.exclude(question_vector = None)
+    name = dtype or settings.NLP_VECTOR_DTYPE
+    code, np_dtype = VECTOR_DTYPES[name]
+    vector = np.asarray(vector, dtype=np.float32)
+
+    if name == 'int8':
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        payload = np.array(scale, dtype=_INT8_SCALE).tobytes() + np.round(vector / scale).astype(np_dtype).tobytes()
+    else:
+        payload = vector.astype(np_dtype).tobytes()
+
+    return bytes([code]) + payload
 
-    if not all_faqs.exists():
+def decode_vector(data):
+    '''unpacks a stored vector back into a float32 numpy array'''
+    if data is None:
         return None
-    
-    faq_vectors = np.array([faq.question_vector for faq in all_faqs])
 
-    user_vector_2d = user_vector.reshape(1, -1)
-    similarities = cosine_similarity(user_vector_2d, faq_vectors)
+    data = bytes(data)
+    name, np_dtype = _VECTOR_DTYPE_CODES[data[0]]
 
-    best_match_index = np.argmax(similarities)
-    best_match_score = similarities[0][best_match_index]
+    if name == 'int8':
+        scale = np.frombuffer(data, dtype=_INT8_SCALE, count=1, offset=1)[0]
+        return np.frombuffer(data, dtype=np_dtype, offset=1 + _INT8_SCALE.itemsize).astype(np.float32) * scale
 
-    CONFIDENCE_THRESHOLD = 0.5
+    return np.frombuffer(data, dtype=np_dtype, offset=1).astype(np.float32)
 
-    if best_match_score >= CONFIDENCE_THRESHOLD:
-        best_faq = all_faqs[int(best_match_index)]
-        return best_faq
+def normalize_rows(matrix):
+    '''scales every row to unit length so a dot product equals cosine similarity'''
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k(scores, k):
+    '''indices of the k highest scores, best first, without sorting the whole array'''
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
     else:
-        return None
-    
+        candidates = np.arange(len(scores))
+
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class FAQIndex:
+    '''
+    In-memory search index of one tenant's FAQs.
+    Holds the question vectors as a single pre-normalized float32 matrix
+    and the FAQ primary key of every row.
+    '''
+
+    def __init__(self, faq_ids, matrix, version=None):
+        self.faq_ids = faq_ids
+        self.matrix = matrix
+        self.version = version
+        self._rows = None
+
+    def __len__(self):
+        return len(self.faq_ids)
+
+    @classmethod
+    def build(cls, version=None):
+        '''loads the vectors of the current schema from the database'''
+        from .models import FAQ
+
+        rows = FAQ.objects.filter(question_vector__isnull=False).values_list('id', 'question_vector')
+
+        faq_ids = np.array([faq_id for faq_id, _ in rows], dtype=np.int64)
+        if not len(faq_ids):
+            return cls(faq_ids, np.empty((0, 0), dtype=np.float32), version)
+
+        matrix = np.vstack([decode_vector(vector) for _, vector in rows])
+        return cls(faq_ids, normalize_rows(matrix), version)
+
+    def scores(self, user_vector):
+        '''cosine similarity of the (normalized) user vector against every FAQ'''
+        return self.matrix @ user_vector
+
+    def search(self, user_vector, k=1):
+        if not len(self):
+            return []
+
+        similarities = self.scores(user_vector)
+        return [(int(self.faq_ids[i]), float(similarities[i])) for i in top_k(similarities, k)]
+
+    def search_many(self, user_vectors, k=1):
+        '''search for a batch of (normalized) vectors with a single matrix multiply'''
+        if not len(self):
+            return [[] for _ in range(len(user_vectors))]
+
+        similarities = user_vectors @ self.matrix.T
+        return [[(int(self.faq_ids[i]), float(row[i])) for i in top_k(row, k)] for row in similarities]
+
+    def score_ids(self, user_vector, faq_ids):
+        '''{faq_id: cosine similarity} of the user vector against the given FAQs, those in the index'''
+        if self._rows is None:
+            self._rows = {int(faq_id): i for i, faq_id in enumerate(self.faq_ids)}
+
+        found = [faq_id for faq_id in faq_ids if faq_id in self._rows]
+        if not found:
+            return {}
+
+        similarities = self.matrix[[self._rows[faq_id] for faq_id in found]] @ user_vector
+        return {faq_id: float(similarity) for faq_id, similarity in zip(found, similarities)}
+
+
+_faq_indexes = {}
+_faq_index_lock = threading.Lock()
+
+def get_faq_index():
+    '''returns the cached index of the active tenant schema, rebuilding it when stale'''
+    schema_name = connection.schema_name
+    version = get_version(FAQ_INDEX_NAMESPACE, schema_name)
+
+    index = _faq_indexes.get(schema_name)
+    if index is not None and index.version == version:
+        return index
+
+    with _faq_index_lock:
+        index = _faq_indexes.get(schema_name)
+        if index is None or index.version != version:
+            index = FAQIndex.build(version)
+            _faq_indexes[schema_name] = index
+
+    return index
+
+def invalidate_faq_index(schema_name=None):
+    '''called whenever an FAQ of the tenant is saved or deleted'''
+    schema_name = schema_name or connection.schema_name
+    _faq_indexes.pop(schema_name, None)
+    bump_version(FAQ_INDEX_NAMESPACE, schema_name)
+
+
+class IVFIndex:
+    '''
+    Inverted-file approximate nearest-neighbour index.
+
+    The vectors are clustered around `nlist` centroids (spherical k-means) and
+    a query only scores the members of the `nprobe` closest clusters. New FAQs
+    are appended to their nearest cluster; once the corpus has outgrown the
+    clustering (needs_retrain) the index is trained again.
+    '''
+
+    # below this many vectors a single list (= exact scan) is used
+    MIN_TRAIN_SIZE = 1024
+
+    def __init__(self, centroids, version=None):
+        self.centroids = centroids
+        self.lists = [(np.empty(0, dtype=np.int64), np.empty((0, centroids.shape[1]), dtype=np.float32))
+                      for _ in range(len(centroids))]
+        self.locations = {}
+        self.version = version
+
+    def __len__(self):
+        return len(self.locations)
+
+    def vectors(self):
+        '''(faq_ids, matrix, assignments) of every indexed FAQ, list by list'''
+        dim = self.centroids.shape[1] if self.centroids.ndim == 2 else 0
+        if not self.lists:
+            return np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        faq_ids = np.concatenate([ids for ids, _ in self.lists])
+        matrix = np.vstack([m for _, m in self.lists])
+        assignments = np.concatenate([np.full(len(ids), list_no, dtype=np.int64)
+                                      for list_no, (ids, _) in enumerate(self.lists)])
+        return faq_ids, matrix, assignments
+
+    def needs_retrain(self):
+        '''
+        True once there are far more vectors than the lists were trained for,
+        e.g. an index started below MIN_TRAIN_SIZE (a single list) and grown by
+        inserts: more than (2 * nlist)^2 vectors.
+        '''
+        n = len(self)
+        return n >= self.MIN_TRAIN_SIZE and np.sqrt(n) > 2 * len(self.centroids)
+
+    @classmethod
+    def train(cls, faq_ids, matrix, nlist=None, iterations=10, seed=0, version=None):
+        '''clusters the (normalized) matrix and fills the inverted lists'''
+        n = len(faq_ids)
+        if not n:
+            return cls(np.empty((0, 0), dtype=np.float32), version)
+
+        if nlist is None:
+            nlist = int(np.sqrt(n)) if n >= cls.MIN_TRAIN_SIZE else 1
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample = matrix if n <= nlist * 256 else matrix[rng.choice(n, nlist * 256, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations if nlist > 1 else 0):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            # an empty cluster keeps its previous centroid
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums).astype(np.float32)
+
+        index = cls(centroids, version)
+        index._fill(faq_ids, matrix, np.argmax(matrix @ centroids.T, axis=1))
+        return index
+
+    def _fill(self, faq_ids, matrix, assignments):
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+
+        for list_no in range(len(self.centroids)):
+            members = order[bounds[list_no]:bounds[list_no + 1]]
+            self.lists[list_no] = (faq_ids[members], matrix[members])
+
+        self.locations = {int(faq_id): int(list_no) for faq_id, list_no in zip(faq_ids, assignments)}
+
+    def search(self, user_vector, k=1, nprobe=8):
+        if not len(self):
+            return []
+
+        probes = top_k(self.centroids @ user_vector, nprobe)
+        faq_ids = np.concatenate([self.lists[p][0] for p in probes])
+        similarities = np.concatenate([self.lists[p][1] @ user_vector for p in probes])
+
+        return [(int(faq_ids[i]), float(similarities[i])) for i in top_k(similarities, k)]
+
+    def score_ids(self, user_vector, faq_ids):
+        '''{faq_id: cosine similarity} of the user vector against the given FAQs, those in the index'''
+        scores = {}
+        for faq_id in faq_ids:
+            list_no = self.locations.get(faq_id)
+            if list_no is None:
+                continue
+            ids, matrix = self.lists[list_no]
+            row = np.flatnonzero(ids == faq_id)
+            if len(row):
+                scores[faq_id] = float(matrix[row[0]] @ user_vector)
+        return scores
+
+    def add(self, faq_id, vector):
+        self.remove(faq_id)
+        vector = np.asarray(vector, dtype=np.float32)
+
+        if not len(self.centroids):
+            # first vector of an empty index becomes its only centroid
+            self.centroids = vector[None, :].copy()
+            self.lists = [(np.empty(0, dtype=np.int64), np.empty((0, len(vector)), dtype=np.float32))]
+
+        list_no = int(np.argmax(self.centroids @ vector))
+        ids, matrix = self.lists[list_no]
+        self.lists[list_no] = (np.append(ids, faq_id), np.vstack([matrix, vector]))
+        self.locations[faq_id] = list_no
+
+    def remove(self, faq_id):
+        list_no = self.locations.pop(faq_id, None)
+        if list_no is None:
+            return
+
+        ids, matrix = self.lists[list_no]
+        keep = ids != faq_id
+        self.lists[list_no] = (ids[keep], matrix[keep])
+
+    def save(self, path):
+        '''
+        writes the index atomically so readers never see a half written file.
+        the version token is stored with it, a reader only trusts a file written
+        for the version it expects.
+        '''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        faq_ids, matrix, assignments = self.vectors()
+
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, faq_ids=faq_ids, matrix=matrix, assignments=assignments,
+                     version=np.array(self.version or ''))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version = str(data['version']) if 'version' in data.files else ''
+            index = cls(data['centroids'], version or None)
+            if len(data['faq_ids']):
+                index._fill(data['faq_ids'], data['matrix'], data['assignments'])
+        return index
+
+
+class SearchBackend:
+    '''
+    Interface of the FAQ retrieval backends.
+    `search` runs against the active tenant schema, the mutation hooks are
+    called (after commit) whenever an FAQ of `schema_name` changes.
+    '''
 
+    def search(self, user_vector, k=1):
+        '''returns up to k (faq_id, score) pairs, best first'''
+        raise NotImplementedError
+
+    def search_many(self, user_vectors, k=1):
+        '''search() for every row of a matrix, backends override it when they can batch'''
+        return [self.search(user_vector, k) for user_vector in user_vectors]
+
+    def score_ids(self, user_vector, faq_ids):
+        '''{faq_id: score} for FAQs found by other means (the lexical index), {} if not supported'''
+        return {}
+
+    def add(self, schema_name, faq_id, vector):
+        raise NotImplementedError
+
+    def remove(self, schema_name, faq_id):
+        raise NotImplementedError
+
+    def add_many(self, schema_name, items):
+        '''adds (faq_id, vector) pairs, e.g. after a batch of queued FAQs was embedded'''
+        for faq_id, vector in items:
+            self.add(schema_name, faq_id, vector)
+
+    def invalidate(self, schema_name):
+        '''forgets everything known about the tenant, next search rebuilds from the DB'''
+        raise NotImplementedError
+
+
+class ExactSearchBackend(SearchBackend):
+    '''brute force scan of the cached FAQIndex matrix, the default'''
+
+    def search(self, user_vector, k=1):
+        return get_faq_index().search(user_vector, k)
+
+    def search_many(self, user_vectors, k=1):
+        return get_faq_index().search_many(user_vectors, k)
+
+    def score_ids(self, user_vector, faq_ids):
+        return get_faq_index().score_ids(user_vector, faq_ids)
+
+    def add(self, schema_name, faq_id, vector):
+        invalidate_faq_index(schema_name)
+
+    def remove(self, schema_name, faq_id):
+        invalidate_faq_index(schema_name)
+
+    def add_many(self, schema_name, items):
+        invalidate_faq_index(schema_name)
+
+    def invalidate(self, schema_name):
+        invalidate_faq_index(schema_name)
+
+
+class IVFSearchBackend(SearchBackend):
+    '''
+    Approximate search for large FAQ corpora.
+    Each tenant's IVFIndex is persisted to NLP_INDEX_DIR/<schema>.npz, so
+    workers load it from disk instead of re-clustering, and updated
+    incrementally as FAQs are saved or deleted.
+    '''
+
+    def __init__(self, index_dir=None, nprobe=None):
+        self.index_dir = Path(index_dir or settings.NLP_INDEX_DIR)
+        self.nprobe = nprobe or settings.NLP_IVF_NPROBE
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def _path(self, schema_name):
+        return self.index_dir / f'{schema_name}.npz'
+
+    def _file_lock(self, schema_name):
+        return _FileLock(self.index_dir / f'{schema_name}.lock')
+
+    def get_index(self, schema_name):
+        version = get_version(FAQ_INDEX_NAMESPACE, schema_name)
+
+        index = self._indexes.get(schema_name)
+        if index is not None and index.version == version:
+            return index
+
+        with self._lock, self._file_lock(schema_name):
+            return self._get_locked(schema_name, version)
+
+    def _get_locked(self, schema_name, version):
+        '''get_index for a caller holding both locks'''
+        index = self._indexes.get(schema_name)
+        if index is None or index.version != version:
+            index = self._load(schema_name, version)
+            self._indexes[schema_name] = index
+        return index
+
+    def _load(self, schema_name, version):
+        path = self._path(schema_name)
+        if path.exists():
+            index = IVFIndex.load(path)
+            # written for an older FAQ set (or another backend, a restored database): rebuilt
+            if index.version == version:
+                return index
+
+        with schema_context(schema_name):
+            faq_index = FAQIndex.build()
+
+        index = IVFIndex.train(faq_index.faq_ids, faq_index.matrix, version=version)
+        index.save(path)
+        return index
+
+    def search(self, user_vector, k=1):
+        return self.get_index(connection.schema_name).search(user_vector, k, self.nprobe)
+
+    def score_ids(self, user_vector, faq_ids):
+        return self.get_index(connection.schema_name).score_ids(user_vector, faq_ids)
+
+    def _update(self, schema_name, mutate):
+        with self._lock, self._file_lock(schema_name):
+            index = self._get_locked(schema_name, get_version(FAQ_INDEX_NAMESPACE, schema_name))
+            mutate(index)
+            if index.needs_retrain():
+                faq_ids, matrix, _ = index.vectors()
+                index = IVFIndex.train(faq_ids, matrix)
+                self._indexes[schema_name] = index
+            # the file carries the new token, other workers load it once they see the bump
+            index.version = bump_version(FAQ_INDEX_NAMESPACE, schema_name)
+            index.save(self._path(schema_name))
+
+    def add(self, schema_name, faq_id, vector):
+        vector = normalize_rows(np.asarray(vector, dtype=np.float32))
+        self._update(schema_name, lambda index: index.add(faq_id, vector))
+
+    def remove(self, schema_name, faq_id):
+        self._update(schema_name, lambda index: index.remove(faq_id))
+
+    def add_many(self, schema_name, items):
+        items = [(faq_id, normalize_rows(np.asarray(vector, dtype=np.float32))) for faq_id, vector in items]
+
+        def mutate(index):
+            for faq_id, vector in items:
+                index.add(faq_id, vector)
+
+        self._update(schema_name, mutate)
+
+    def invalidate(self, schema_name):
+        with self._lock, self._file_lock(schema_name):
+            self._indexes.pop(schema_name, None)
+            self._path(schema_name).unlink(missing_ok=True)
+            bump_version(FAQ_INDEX_NAMESPACE, schema_name)
+
+
+class _FileLock:
+    '''exclusive advisory lock so two workers never rewrite the same index file at once'''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+SEARCH_BACKENDS = {
+    'exact': ExactSearchBackend,
+    'ivf': IVFSearchBackend,
+}
+
+_search_backend = None
+
+def get_search_backend():
+    '''returns the backend configured by NLP_SEARCH_BACKEND (an alias or a dotted path)'''
+    global _search_backend
+
+    if _search_backend is None:
+        name = settings.NLP_SEARCH_BACKEND
+        backend_class = SEARCH_BACKENDS.get(name) or import_string(name)
+        _search_backend = backend_class()
+
+    return _search_backend
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_query(text: str):
+    '''"  Pricing?? " and "pricing" share one cache entry'''
+    text = _PUNCTUATION.sub(' ', text or '').lower()
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class QueryCache:
+    '''
+    Caches in front of the encoder for repeated widget questions.
+
+    - vectors: normalized question text -> embedding (shared by every tenant)
+    - answers: (tenant, FAQ index version, match settings, normalized text)
+      -> match decision, the answering FAQ id or a tuple of FAQ ids to suggest
+      (see decide()). The index version changes on every FAQ save/delete,
+      so edited FAQs never serve a stale answer, and changing the tenant's
+      threshold or lexical weight starts from a clean slate.
+    '''
+
+    def __init__(self, maxsize=None, ttl=None, shared_alias=None):
+        maxsize = maxsize or settings.NLP_QUERY_CACHE_SIZE
+        ttl = ttl or settings.NLP_QUERY_CACHE_TTL
+        shared_alias = shared_alias or settings.NLP_QUERY_CACHE_BACKEND or None
+
+        self.vectors = TieredCache('nlp:vector', maxsize, ttl, shared_alias)
+        self.answers = TieredCache('nlp:answer', maxsize, ttl, shared_alias)
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _vector_key(self, text):
+        return f'{embedding_model.model_name or settings.NLP_MODEL_NAME}:{self._digest(text)}'
+
+    def _answer_key(self, schema_name, text):
+        version = get_version(FAQ_INDEX_NAMESPACE, schema_name)
+        threshold, weight = match_settings()
+        return f'{schema_name}:{version}:{threshold}:{weight}:{self._digest(text)}'
+
+    def get_vector(self, text):
+        return self.vectors.get(self._vector_key(text))
+
+    def set_vector(self, text, vector):
+        self.vectors.set(self._vector_key(text), vector)
+
+    def get_answer(self, schema_name, text):
+        '''the match decision, or None when the question has not been seen'''
+        return self.answers.get(self._answer_key(schema_name, text))
+
+    def set_answer(self, schema_name, text, decision):
+        self.answers.set(self._answer_key(schema_name, text), decision)
+
+
+_query_cache = None
+
+def get_query_cache():
+    global _query_cache
+
+    if _query_cache is None:
+        _query_cache = QueryCache()
+
+    return _query_cache
+
+def embed_query(text: str):
+    '''normalized, unit length float32 embedding of a user question (cached), None if inference failed'''
+    cache = get_query_cache()
+    user_vector = cache.get_vector(text)
+
+    if user_vector is None:
+        user_vector = generate_vector(text)
+        if user_vector is None:
+            return None
+
+        user_vector = normalize_rows(np.asarray(user_vector, dtype=np.float32))
+        cache.set_vector(text, user_vector)
+
+    return user_vector
+
+def embed_queries(texts):
+    '''embed_query for many texts: every uncached one in a single encoder call. matrix or None'''
+    cache = get_query_cache()
+    vectors = [cache.get_vector(text) for text in texts]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+    if missing:
+        encoded = generate_vectors([texts[i] for i in missing])
+        if encoded is None:
+            return None
+
+        encoded = normalize_rows(np.asarray(encoded, dtype=np.float32))
+        for i, vector in zip(missing, encoded):
+            vectors[i] = vector
+            cache.set_vector(texts[i], vector)
+
+    return np.vstack(vectors)
+
+def match_settings():
+    '''(confidence threshold, lexical weight) of the active tenant'''
+    tenant = getattr(connection, 'tenant', None)
+    threshold = getattr(tenant, 'match_threshold', None)
+    weight = getattr(tenant, 'lexical_weight', None)
+    return (
+        settings.NLP_CONFIDENCE_THRESHOLD if threshold is None else threshold,
+        settings.NLP_LEXICAL_WEIGHT if weight is None else weight,
+    )
+
+@stage('cache')
+def lookup_answer(schema_name: str, text: str):
+    '''
+    the match decision for a question that needs no inference: already
+    answered, or an exact match of an FAQ question. None otherwise.
+    '''
+    cache = get_query_cache()
+    decision = cache.get_answer(schema_name, text)
+
+    if decision is None:
+        decision = get_lexical_index().exact_match(text)
+        if decision is not None:
+            cache.set_answer(schema_name, text, decision)
+
+    return decision
+
+def _hybrid_candidates(k, weight):
+    return max(k, settings.NLP_HYBRID_CANDIDATES) if weight else k
+
+def fuse(text: str, vector_matches, k, weight, lexical_index=None, vector_scores=None):
+    '''
+    re-scores vector (faq_id, score) candidates with the tenant's BM25 index
+    (or the given one): fused = max(vector, (1-w)*vector + w*lexical), so word
+    overlap can lift an ambiguous semantic match over the threshold but never
+    pulls a confident one down. FAQs only the lexical index found get their
+    actual similarity from `vector_scores(faq_ids)`, 0 without it, so word
+    overlap alone can't make a semantically unrelated FAQ the answer.
+    '''
+    if not weight:
+        return vector_matches[:k]
+
+    if lexical_index is None:
+        lexical_index = get_lexical_index()
+
+    lexical = dict(lexical_index.search(text, _hybrid_candidates(k, weight)))
+    vector = dict(vector_matches)
+    lexical_only = lexical.keys() - vector.keys()
+    if lexical_only and vector_scores is not None:
+        vector.update(vector_scores(lexical_only))
+
+    fused = []
+    for faq_id in vector.keys() | lexical.keys():
+        vector_score = vector.get(faq_id, 0.0)
+        hybrid = (1 - weight) * vector_score + weight * lexical.get(faq_id, 0.0)
+        fused.append((faq_id, max(vector_score, hybrid)))
+
+    fused.sort(key=lambda match: match[1], reverse=True)
+    return fused[:k]
+
+@stage('search')
+def rank_faqs(text: str, user_vector, k=1):
+    '''(faq_id, score) matches of the active tenant, best first (vector search + fuse)'''
+    weight = match_settings()[1]
+    backend = get_search_backend()
+    vector_matches = backend.search(user_vector, k=_hybrid_candidates(k, weight))
+    return fuse(text, vector_matches, k, weight,
+                vector_scores=lambda faq_ids: backend.score_ids(user_vector, faq_ids))
+
+@stage('search')
+def rank_many(texts, user_vectors, k=1):
+    '''rank_faqs for a batch, with one search_many call (a single matrix multiply for the exact backend)'''
+    weight = match_settings()[1]
+    backend = get_search_backend()
+    results = backend.search_many(user_vectors, k=_hybrid_candidates(k, weight))
+    return [
+        fuse(text, matches, k, weight, vector_scores=lambda faq_ids, vector=vector: backend.score_ids(vector, faq_ids))
+        for text, matches, vector in zip(texts, results, user_vectors)
+    ]
+
+def decide(matches):
+    '''
+    match decision for ranked (faq_id, score) matches: the id of the top match
+    if it clears the tenant's threshold, else a tuple with the ids of the
+    next-best FAQs worth suggesting ("did you mean"), possibly empty.
+    '''
+    if matches and matches[0][1] >= match_settings()[0]:
+        return matches[0][0]
+
+    return tuple(
+        faq_id for faq_id, score in matches[:settings.NLP_SUGGESTIONS]
+        if score >= settings.NLP_SUGGESTION_THRESHOLD
+    )
+
+def match_faq(schema_name: str, text: str, user_vector):
+    '''searches the tenant's indexes (top-k, one pass) and caches the decision'''
+    decision = decide(rank_faqs(text, user_vector, k=max(1, settings.NLP_SUGGESTIONS)))
+    get_query_cache().set_answer(schema_name, text, decision)
+    return decision
+
+def get_faq(faq_id):
+    '''the row may have been deleted since the index was built'''
+    from .models import FAQ
+    return FAQ.objects.filter(pk=faq_id).first() if faq_id else None
+
+@stage('faq')
+def resolve(decision):
+    '''(answering FAQ or None, suggested FAQs) for a match decision'''
+    from .models import FAQ
+
+    if not isinstance(decision, tuple):
+        return get_faq(decision), []
+    if not decision:
+        return None, []
+
+    faqs = FAQ.objects.only('id', 'question').in_bulk(decision)
+    return None, [faqs[faq_id] for faq_id in decision if faq_id in faqs]
+
+def match_question(user_question: str):
+    '''
+    (best FAQ or None, "did you mean" FAQs) for a user's question. raises
+    InferenceUnavailable when it had to be embedded and that failed.
+    '''
+    text = normalize_query(user_question)
+    if not text:
+        return None, []
+
+    schema_name = connection.schema_name
+
+    decision = lookup_answer(schema_name, text)
+    if decision is None:
+        user_vector = embed_query(text)
+        if user_vector is None:
+            raise InferenceUnavailable()
+        decision = match_faq(schema_name, text, user_vector)
+
+    return resolve(decision)
+
+def match_questions(user_questions):
+    '''
+    match_question for a batch of questions of the active tenant: one encoder
+    call for all questions the cache can't answer, one search_many and one
+    FAQ query. Returns (best FAQ or None, suggested FAQs, top score or None)
+    per question, in order. Questions are not counted in the analytics.
+    Raises InferenceUnavailable when the questions to embed could not be.
+    '''
+    from .models import FAQ
+
+    schema_name = connection.schema_name
+    texts = [normalize_query(question) for question in user_questions]
+    unique_texts = list(dict.fromkeys(text for text in texts if text))
+
+    decisions, scores = {}, {}
+    for text in unique_texts:
+        decision = lookup_answer(schema_name, text)
+        if decision is not None:
+            decisions[text] = decision
+
+    pending = [text for text in unique_texts if text not in decisions]
+    if pending:
+        user_vectors = embed_queries(pending)
+        if user_vectors is None:
+            raise InferenceUnavailable()
+
+        k = max(1, settings.NLP_SUGGESTIONS)
+        for text, matches in zip(pending, rank_many(pending, user_vectors, k)):
+            decisions[text] = decide(matches)
+            scores[text] = matches[0][1] if matches else None
+            get_query_cache().set_answer(schema_name, text, decisions[text])
+
+    faq_ids = set()
+    for decision in decisions.values():
+        faq_ids.update(decision if isinstance(decision, tuple) else [decision])
+    faqs = FAQ.objects.in_bulk(faq_ids)
+
+    results = []
+    for text in texts:
+        decision = decisions.get(text)
+        if isinstance(decision, tuple):
+            results.append((None, [faqs[i] for i in decision if i in faqs], scores.get(text)))
+        else:
+            results.append((faqs.get(decision), [], scores.get(text)))
+    return results
+
+def find_best_faq(user_question: str):
+    '''finds most relevant faq for user's question from the client's database'''
+    try:
+        return match_question(user_question)[0]
+    except InferenceUnavailable:
+        return None
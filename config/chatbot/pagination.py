@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+class NewestFirstCursorPagination(CursorPagination):
+    """
+    Keyset ("cursor") pagination for the large, append-only lists
+    (submissions, analytics logs). Unlike offset paging the cost of a page
+    does not grow with how far the client has scrolled.
+    The ordering field is taken from the view's `cursor_ordering`.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        return (getattr(view, 'cursor_ordering', '-id'), '-id')
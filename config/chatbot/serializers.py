@@ -4,8 +4,8 @@ from .models import FAQ, FormSubmission, AnalyticsLog, ChatRule
 class FAQSerializer(serializers.ModelSerializer):
     class Meta:
         model = FAQ
-        fields = ['id','question','response_type','answer','rich_response','created_at']
-        read_only_fields = ['created_at']
+        fields = ['id','question','response_type','answer','rich_response','created_at','embedding_pending']
+        read_only_fields = ['created_at','embedding_pending']
 
 class ChatRuleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,5 +21,5 @@ class FormSubmissionSerializer(serializers.ModelSerializer):
 class AnalyticsLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnalyticsLog
-        field = ['id','event_type','details','timestamp']
+        fields = ['id','event_type','details','timestamp']
         read_only_fields = ['timestamp']
\ No newline at end of file
@@ -0,0 +1,49 @@
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import FAQ, FormSubmission, UsageCounter, ChatRule
+from .nlp import get_search_backend, decode_vector
+from . import usage
+from .analytics import update_rollups, EVENT_LEAD
+from .flows import invalidate_flow_graph
+
+@receiver(post_save, sender=FAQ)
+def faq_saved(sender, instance, **kwargs):
+    '''pushes the new vector into the tenant's search index once the change is committed'''
+    schema_name = connection.schema_name
+    faq_id, vector = instance.pk, decode_vector(instance.question_vector)
+
+    def update_index():
+        if vector is None:
+            get_search_backend().remove(schema_name, faq_id)
+        else:
+            get_search_backend().add(schema_name, faq_id, vector)
+
+    transaction.on_commit(update_index)
+
+@receiver(post_delete, sender=FAQ)
+def faq_deleted(sender, instance, **kwargs):
+    schema_name = connection.schema_name
+    faq_id = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove(schema_name, faq_id))
+
+@receiver(post_save, sender=FAQ)
+def count_faq_created(sender, instance, created, **kwargs):
+    if created:
+        usage.increment(UsageCounter.METRIC_FAQS)
+
+@receiver(post_delete, sender=FAQ)
+def count_faq_deleted(sender, instance, **kwargs):
+    usage.increment(UsageCounter.METRIC_FAQS, -1)
+
+@receiver(post_save, sender=FormSubmission)
+def count_lead(sender, instance, created, **kwargs):
+    if created:
+        usage.increment(UsageCounter.METRIC_LEADS, period=usage.current_period(instance.submitted_at))
+        update_rollups([(EVENT_LEAD, None, instance.submitted_at)])
+
+@receiver(post_save, sender=ChatRule)
+@receiver(post_delete, sender=ChatRule)
+def rule_changed(sender, instance, **kwargs):
+    schema_name = connection.schema_name
+    transaction.on_commit(lambda: invalidate_flow_graph(schema_name))
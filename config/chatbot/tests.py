@@ -136,3 +136,999 @@ class ChatbotNLPTestCase(TestCase):
 
         print("\n--- NLP Engine Test Complete ---")
 
+    def test_faq_index_invalidated_on_save(self):
+        """
+        The per-tenant vector index is built once and rebuilt after an FAQ changes.
+        """
+        from chatbot.nlp import get_faq_index
+
+        connection.set_tenant(self.client_a)
+        index = get_faq_index()
+        self.assertEqual(len(index), len(self.metascifor_faqs))
+        self.assertIs(get_faq_index(), index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQ.objects.create(question="Do you sign NDAs?", answer="Yes, on request.")
+
+        rebuilt = get_faq_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(len(rebuilt), len(self.metascifor_faqs) + 1)
+
+        # the other tenant's index is untouched
+        connection.set_tenant(self.client_b)
+        self.assertEqual(len(get_faq_index()), len(self.globalgoods_faqs))
+        connection.set_schema_to_public()
+
+    def test_index_version_is_shared_between_processes(self):
+        """
+        A version bump written by another process (here straight to the table)
+        makes this worker rebuild its index once its cached token expires.
+        """
+        from chatbot import cache
+        from chatbot.models import CacheVersion
+        from chatbot.nlp import get_faq_index, FAQ_INDEX_NAMESPACE
+
+        connection.set_tenant(self.client_a)
+        index = get_faq_index()
+        CacheVersion.objects.filter(namespace=FAQ_INDEX_NAMESPACE).update(version='bumped-elsewhere')
+        self.assertIs(get_faq_index(), index)
+
+        # CHATBOT_VERSION_TTL ran out
+        cache._local_versions().clear()
+        rebuilt = get_faq_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.version, 'bumped-elsewhere')
+        connection.set_schema_to_public()
+
+    def test_embedding_worker_reaches_web_workers(self):
+        """
+        FAQs embedded by the embedding worker (a process of its own) become
+        searchable in the web workers without a restart.
+        """
+        from unittest import mock
+        from django.test import override_settings
+        import numpy as np
+        from chatbot import cache
+        from chatbot.embedding_queue import embed_pending_faqs
+        from chatbot.nlp import get_faq_index
+
+        connection.set_tenant(self.client_a)
+        with override_settings(NLP_ASYNC_EMBEDDING=True), self.captureOnCommitCallbacks(execute=True):
+            faq = FAQ.objects.create(question="Do you sign NDAs?", answer="Yes, on request.")
+        self.assertTrue(faq.embedding_pending)
+        self.assertNotIn(faq.pk, get_faq_index().faq_ids)
+
+        # the worker's process-local state is its own
+        with mock.patch('chatbot.cache._versions', cache.LRUCache()), \
+                mock.patch('chatbot.embedding_queue.generate_vectors',
+                           side_effect=lambda texts: np.ones((len(texts), 384), dtype=np.float32)), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(embed_pending_faqs(), 1)
+
+        # this worker's CHATBOT_VERSION_TTL ran out
+        cache._local_versions().clear()
+        self.assertIn(faq.pk, get_faq_index().faq_ids)
+        connection.set_schema_to_public()
+
+    def test_ivf_index_search_updates_and_retrain(self):
+        """
+        Probing every list finds what an exact scan finds, inserts and deletes
+        land in the lists, a saved index loads back the same, and an index
+        that started as a single list asks for a retrain once it has grown.
+        """
+        import tempfile
+        from pathlib import Path
+        import numpy as np
+        from chatbot.nlp import FAQIndex, IVFIndex, normalize_rows
+
+        rng = np.random.default_rng(1)
+        matrix = normalize_rows(rng.standard_normal((2000, 16)).astype(np.float32))
+        faq_ids = np.arange(1, 2001, dtype=np.int64)
+        queries = normalize_rows(rng.standard_normal((20, 16)).astype(np.float32))
+
+        index = IVFIndex.train(faq_ids, matrix)
+        self.assertEqual(len(index), 2000)
+        self.assertEqual(len(index.centroids), int(np.sqrt(2000)))
+        self.assertFalse(index.needs_retrain())
+
+        exact = FAQIndex(faq_ids, matrix)
+        for query in queries:
+            self.assertEqual([faq_id for faq_id, _ in index.search(query, 5, nprobe=len(index.centroids))],
+                             [faq_id for faq_id, _ in exact.search(query, 5)])
+        self.assertAlmostEqual(index.score_ids(queries[0], [7])[7], float(matrix[6] @ queries[0]), places=5)
+
+        index.add(5000, queries[0])
+        self.assertEqual(index.search(queries[0], 1, nprobe=1)[0][0], 5000)
+        index.remove(5000)
+        index.remove(1)
+        self.assertEqual(len(index), 1999)
+        self.assertNotIn(5000, [faq_id for faq_id, _ in index.search(queries[0], 5, nprobe=len(index.centroids))])
+
+        index.version = 'v1'
+        with tempfile.TemporaryDirectory() as index_dir:
+            index.save(Path(index_dir) / 'tenant.npz')
+            loaded = IVFIndex.load(Path(index_dir) / 'tenant.npz')
+        self.assertEqual(loaded.version, 'v1')
+        self.assertEqual(loaded.locations, index.locations)
+        self.assertEqual(loaded.search(queries[1], 5), index.search(queries[1], 5))
+
+        # trained below MIN_TRAIN_SIZE: one list, an exact scan
+        small = IVFIndex.train(faq_ids[:10], matrix[:10])
+        self.assertEqual(len(small.centroids), 1)
+        for faq_id, vector in zip(faq_ids[10:IVFIndex.MIN_TRAIN_SIZE], matrix[10:IVFIndex.MIN_TRAIN_SIZE]):
+            small.add(int(faq_id), vector)
+        self.assertTrue(small.needs_retrain())
+
+    def test_ivf_backend_persists_and_retrains(self):
+        """
+        The IVF backend saves the tenant's index for the other workers, keeps
+        it current as FAQs change, rebuilds files written for another version
+        and re-clusters the index once it has outgrown its lists.
+        """
+        import tempfile
+        from unittest import mock
+        import numpy as np
+        from chatbot.nlp import FAQIndex, IVFIndex, IVFSearchBackend, normalize_rows
+
+        schema = self.client_b.schema_name
+        connection.set_tenant(self.client_b)
+        faq_index = FAQIndex.build()
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            backend = IVFSearchBackend(index_dir=index_dir, nprobe=4)
+            top = backend.search(faq_index.matrix[2], k=1)
+            self.assertEqual(top[0][0], int(faq_index.faq_ids[2]))
+            self.assertTrue(backend._path(schema).exists())
+
+            # another worker loads the file instead of clustering again
+            with mock.patch.object(IVFIndex, 'train', side_effect=AssertionError("retrained")):
+                other = IVFSearchBackend(index_dir=index_dir, nprobe=4)
+                self.assertEqual(len(other.get_index(schema)), len(self.globalgoods_faqs))
+
+            backend.remove(schema, int(faq_index.faq_ids[2]))
+            self.assertNotIn(int(faq_index.faq_ids[2]), backend.get_index(schema).locations)
+            self.assertNotIn(int(faq_index.faq_ids[2]), IVFIndex.load(backend._path(schema)).locations)
+
+            # a file written for another FAQ set is rebuilt, although its row count may match
+            stale = IVFIndex.load(backend._path(schema))
+            stale.version = 'older-faq-set'
+            stale.save(backend._path(schema))
+            rebuilt = IVFSearchBackend(index_dir=index_dir, nprobe=4).get_index(schema)
+            self.assertIn(int(faq_index.faq_ids[2]), rebuilt.locations)
+            self.assertEqual(IVFIndex.load(backend._path(schema)).version, rebuilt.version)
+
+            # the index started as one list, the inserts make it worth clustering
+            rng = np.random.default_rng(2)
+            vectors = normalize_rows(rng.standard_normal((60, faq_index.matrix.shape[1])).astype(np.float32))
+            with mock.patch.object(IVFIndex, 'MIN_TRAIN_SIZE', 16):
+                backend.add_many(schema, [(10_000 + i, vector) for i, vector in enumerate(vectors)])
+
+            index = backend.get_index(schema)
+            self.assertEqual(len(index), len(self.globalgoods_faqs) - 1 + 60)
+            self.assertEqual(len(index.centroids), int(np.sqrt(len(index))))
+            self.assertEqual(index.search(vectors[5], 1, nprobe=len(index.centroids))[0][0], 10_005)
+            self.assertEqual(len(IVFIndex.load(backend._path(schema)).centroids), len(index.centroids))
+        connection.set_schema_to_public()
+
+    def test_vector_migration_packs_only_stored_vectors(self):
+        """
+        Migration 0005 packs the JSON vectors into the binary format and leaves
+        FAQs without one (SQL NULL or JSON null) without one.
+        """
+        import importlib
+        import numpy as np
+        from django.db import models
+        from django.db.migrations.executor import MigrationExecutor
+        from django.db.migrations.operations import AlterModelTable
+        from chatbot.nlp import decode_vector
+
+        migration = importlib.import_module('chatbot.migrations.0005_faq_question_vector_binary')
+
+        connection.set_tenant(self.client_a)
+        # the FAQ model as the migration sees it (after its AddField), on a table of its own
+        state = MigrationExecutor(connection).loader.project_state(
+            ('chatbot', '0004_chatrule_faq_response_type_faq_rich_response_and_more')
+        )
+        migration.Migration.operations[0].state_forwards('chatbot', state)
+        AlterModelTable('faq', 'chatbot_faq_0005').state_forwards('chatbot', state)
+        OldFAQ = state.apps.get_model('chatbot', 'FAQ')
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(OldFAQ)
+
+        with_vector = OldFAQ.objects.create(question="Packed", answer="a", question_vector=[0.5, -1.0, 2.0])
+        sql_null = OldFAQ.objects.create(question="No vector", answer="a", question_vector=None)
+        json_null = OldFAQ.objects.create(question="Null vector", answer="a",
+                                          question_vector=models.Value(None, models.JSONField()))
+
+        migration.json_to_binary(state.apps, None)
+
+        embeddings = dict(OldFAQ.objects.values_list('id', 'question_embedding'))
+        np.testing.assert_array_equal(decode_vector(bytes(embeddings[with_vector.pk])), [0.5, -1.0, 2.0])
+        self.assertIsNone(embeddings[sql_null.pk])
+        self.assertIsNone(embeddings[json_null.pk])
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(OldFAQ)
+        connection.set_schema_to_public()
+
+    def test_answer_edit_does_not_reembed(self):
+        """
+        Saving an FAQ whose question text did not change keeps its vector.
+        """
+        from unittest import mock
+
+        connection.set_tenant(self.client_a)
+        faq = FAQ.objects.get(question=self.metascifor_faqs[0]["q"])
+        vector = bytes(faq.question_vector)
+
+        with mock.patch('chatbot.models.generate_vector') as generate_vector:
+            faq.answer = "We build web, mobile and AI/ML software."
+            faq.save()
+            generate_vector.assert_not_called()
+
+        faq.refresh_from_db()
+        self.assertEqual(bytes(faq.question_vector), vector)
+        self.assertFalse(faq.embedding_pending)
+        connection.set_schema_to_public()
+
+    def test_flow_graph_reports_and_cache(self):
+        """
+        Rule clicks are served from the compiled flow graph, which reports
+        broken targets and is rebuilt when a rule changes.
+        """
+        from chatbot.flows import get_flow_graph
+        from chatbot.models import ChatRule
+
+        connection.set_tenant(self.client_a)
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatRule.objects.create(node_id='welcome_node', rule_data={
+                "type": "options", "message": "Hi!",
+                "options": [{"text": "Pricing", "payload": "pricing_node"},
+                            {"text": "Talk to us", "payload": "show_form"}],
+            })
+            ChatRule.objects.create(node_id='pricing_node', rule_data={
+                "type": "options", "message": "Plans start at $10.",
+                "options": [{"text": "Back", "payload": "welcome_node"},
+                            {"text": "Enterprise", "payload": "enterprise_node"}],
+            })
+
+        graph = get_flow_graph()
+        self.assertEqual(graph.dangling, [{"source": "pricing_node", "target": "enterprise_node"}])
+        self.assertEqual(graph.cycles, [['pricing_node', 'welcome_node']])
+        self.assertEqual(graph.unreachable, [])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_flow_graph().response('pricing_node')["message"], "Plans start at $10.")
+            self.assertEqual(get_flow_graph().response('show_form')["type"], "show_form")
+            self.assertIsNone(get_flow_graph().response('enterprise_node'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatRule.objects.create(node_id='enterprise_node', rule_data={"type": "options", "message": "Call us."})
+        self.assertTrue(get_flow_graph().is_valid)
+        connection.set_schema_to_public()
+
+    def test_widget_bootstrap_follows_rule_edits_of_other_workers(self):
+        """
+        The bootstrap ETag changes once a rule edit saved by another worker
+        reaches this one, so revalidating widgets get the new flow.
+        """
+        from unittest import mock
+        from django.test import RequestFactory
+        from chatbot import cache
+        from chatbot.models import ChatRule
+        from chatbot.views import WidgetBootstrapView
+
+        connection.set_tenant(self.client_a)
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = ChatRule.objects.create(node_id='welcome_node', rule_data={"type": "options", "message": "Hi!"})
+
+        def bootstrap(etag=''):
+            request = RequestFactory().get('/api/v1/widget/bootstrap/', HTTP_IF_NONE_MATCH=etag)
+            request.tenant = self.client_a
+            return WidgetBootstrapView.as_view()(request)
+
+        etag = bootstrap()['ETag']
+        self.assertEqual(bootstrap(etag).status_code, 304)
+
+        # saved in another worker: its graphs and version tokens are its own
+        with mock.patch('chatbot.cache._versions', cache.LRUCache()), \
+                mock.patch('chatbot.flows._flow_graphs', {}), \
+                self.captureOnCommitCallbacks(execute=True):
+            rule.rule_data = {"type": "options", "message": "Hello!"}
+            rule.save()
+
+        # this worker's CHATBOT_VERSION_TTL ran out
+        cache._local_versions().clear()
+        response = bootstrap(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data["nodes"]["welcome_node"]["message"], "Hello!")
+        connection.set_schema_to_public()
+
+    async def test_async_interact_view(self):
+        """
+        The ASGI interact view answers rule clicks and rejects bad input like the sync one.
+        """
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory
+        from chatbot.models import ChatRule
+        from chatbot.views import AsyncChatbotInteractView
+
+        def create_rule():
+            connection.set_tenant(self.client_a)
+            with self.captureOnCommitCallbacks(execute=True):
+                ChatRule.objects.create(node_id='welcome_node', rule_data={"type": "options", "message": "Hi!"})
+            connection.set_schema_to_public()
+        await sync_to_async(create_rule)()
+
+        view = AsyncChatbotInteractView.as_view()
+        factory = AsyncRequestFactory()
+
+        def post(body):
+            request = factory.post('/api/v1/interact/', data=json.dumps(body), content_type='application/json')
+            request.tenant = self.client_a
+            return view(request)
+
+        response = await post({"type": "rule", "payload": "welcome_node"})
+        self.assertEqual(json.loads(response.content)["message"], "Hi!")
+        self.assertEqual((await post({"type": "rule", "payload": "missing_node"})).status_code, 404)
+        self.assertEqual((await post({"type": "text"})).status_code, 400)
+
+    async def test_chat_websocket_protocol(self):
+        """
+        The chat WebSocket acknowledges each message, streams the candidates of
+        a text question before its answer, reports bad messages without ending
+        the session, turns away unknown or unsubscribed clients with 4404/4402
+        close codes and ends a session whose subscription lapses.
+        """
+        import asyncio
+        import contextlib
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from django.test import override_settings
+        from chatbot.nlp import FAQIndex
+        from chatbot.websocket import chat_websocket
+        from tenants.models import Subscription
+
+        def prepare():
+            self.client_b.subscription = Subscription.objects.create()
+            self.client_b.save()
+            connection.set_tenant(self.client_b)
+            returns = FAQ.objects.get(question="What is your return policy?")
+            index = FAQIndex.build()
+            vector = index.matrix[list(index.faq_ids).index(returns.pk)]
+            connection.set_schema_to_public()
+            return returns, vector
+        returns, vector = await sync_to_async(prepare)()
+
+        async def chat(client_id, *messages):
+            # messages are sent in order, callables run in between (sync, in the ORM's thread)
+            queue = asyncio.Queue()
+            await queue.put({'type': 'websocket.connect'})
+            for message in messages:
+                await queue.put(message if callable(message) else {'type': 'websocket.receive', 'text': message})
+            await queue.put({'type': 'websocket.disconnect'})
+
+            async def receive():
+                event = await queue.get()
+                while callable(event):
+                    await sync_to_async(event)()
+                    event = await queue.get()
+                return event
+
+            sent = []
+            async def send(event):
+                sent.append(event)
+
+            scope = {'type': 'websocket', 'path': '/ws/chat/', 'query_string': f'client={client_id}'.encode()}
+            # the test transaction's connection: no thread of its own, not closed afterwards
+            with mock.patch('chatbot.websocket.ThreadSensitiveContext', contextlib.nullcontext), \
+                    mock.patch('chatbot.websocket.close_old_connections'), \
+                    mock.patch('chatbot.async_interact.embed_query', return_value=vector), \
+                    override_settings(ANALYTICS_BUFFER_ENABLED=False):
+                await chat_websocket(scope, receive, send)
+
+            self.assertEqual(sent[0], {'type': 'websocket.accept'})
+            events = [json.loads(event['text']) for event in sent if event['type'] == 'websocket.send']
+            closes = [event['code'] for event in sent if event['type'] == 'websocket.close']
+            return events, closes
+
+        events, closes = await chat(
+            self.client_b_schema,
+            json.dumps({"id": 1, "type": "text", "payload": "tell me about sending items back"}),
+            "not json",
+            json.dumps({"id": 2, "type": "rule", "payload": "missing_node"}),
+            json.dumps({"id": 3, "type": "faq", "payload": str(returns.pk)}),
+            json.dumps({"id": 4, "type": "text"}),
+        )
+        self.assertEqual(closes, [])
+        self.assertEqual([(event['event'], event['id']) for event in events], [
+            ('ack', 1), ('candidates', 1), ('answer', 1),
+            ('error', None),
+            ('ack', 2), ('error', 2),
+            ('ack', 3), ('answer', 3),
+            ('error', 4),
+        ])
+        self.assertEqual(events[1]['data'][0]['id'], returns.pk)
+        self.assertEqual((events[2]['status'], events[2]['data']['answer']), (200, returns.answer))
+        self.assertEqual(events[3]['status'], 400)
+        self.assertEqual(events[5]['status'], 404)
+        self.assertEqual(events[7]['data']['answer'], returns.answer)
+        self.assertEqual(events[8]['status'], 400)
+
+        events, closes = await chat('no_such_client', json.dumps({"id": 1, "payload": "hello"}))
+        self.assertEqual(closes, [4404])
+        self.assertEqual([(event['event'], event['status']) for event in events], [('error', 404)])
+
+        # client A has no subscription
+        events, closes = await chat(self.client_a_schema, json.dumps({"id": 1, "payload": "hello"}))
+        self.assertEqual(closes, [4402])
+        self.assertEqual([(event['event'], event['status']) for event in events], [('error', 402)])
+
+        def deactivate():
+            self.client_b.subscription.active = False
+            self.client_b.subscription.save()
+
+        # the subscription lapses during the session: the next message ends it
+        events, closes = await chat(
+            self.client_b_schema,
+            json.dumps({"id": 1, "type": "faq", "payload": str(returns.pk)}),
+            deactivate,
+            json.dumps({"id": 2, "type": "faq", "payload": str(returns.pk)}),
+        )
+        self.assertEqual(closes, [4402])
+        self.assertEqual([(event['event'], event['id'], event.get('status')) for event in events], [
+            ('ack', 1, None), ('answer', 1, 200), ('error', None, 402),
+        ])
+
+    def test_exact_question_skips_inference(self):
+        """
+        A question matching an FAQ word for word is answered from the lexical
+        index without running the encoder.
+        """
+        from unittest import mock
+        from chatbot.nlp import find_best_faq
+
+        connection.set_tenant(self.client_b)
+        with mock.patch('chatbot.nlp.generate_vector') as generate_vector:
+            faq = find_best_faq("  how do I TRACK my order?? ")
+            generate_vector.assert_not_called()
+
+        self.assertEqual(faq.question, "How do I track my order?")
+        connection.set_schema_to_public()
+
+    def test_low_confidence_offers_suggestions(self):
+        """
+        Below the threshold the next-best FAQs come back as "did you mean" suggestions.
+        """
+        from unittest import mock
+        import numpy as np
+        from chatbot.nlp import match_question
+        from chatbot.views import faq_reply
+
+        connection.set_tenant(self.client_b)
+        faqs = list(FAQ.objects.order_by('id'))
+        matches = [(faqs[0].pk, 0.45), (faqs[1].pk, 0.35), (faqs[2].pk, 0.1)]
+
+        with mock.patch('chatbot.nlp.embed_query', return_value=np.ones(384, dtype=np.float32)), \
+                mock.patch('chatbot.nlp.rank_faqs', return_value=matches):
+            best_faq, suggestions = match_question("something about goods and orders")
+
+        self.assertIsNone(best_faq)
+        self.assertEqual(suggestions, faqs[:2])
+
+        body, status = faq_reply(best_faq, suggestions)
+        self.assertEqual(body["type"], "suggestions")
+        self.assertEqual([option["payload"] for option in body["options"]], [str(faqs[0].pk), str(faqs[1].pk)])
+        connection.set_schema_to_public()
+
+    def test_word_overlap_alone_is_no_match(self):
+        """
+        An FAQ only the lexical index finds is fused with its real vector
+        similarity: sharing the question's words doesn't make a semantically
+        unrelated FAQ the answer.
+        """
+        from django.test import override_settings
+        import numpy as np
+        from chatbot.lexical import LexicalIndex
+        from chatbot.nlp import FAQIndex, decide, fuse, normalize_query
+
+        # FAQs 1-12 are near misses (cosine 0.48 down to 0.37), FAQ 13 only shares the words
+        similarities = np.append(np.linspace(0.48, 0.37, 12), 0.05)
+        matrix = np.zeros((13, 16), dtype=np.float32)
+        matrix[:, 0] = similarities
+        matrix[np.arange(13), np.arange(1, 14)] = np.sqrt(1 - similarities ** 2)
+        user_vector = np.eye(16, dtype=np.float32)[0]
+
+        index = FAQIndex(np.arange(1, 14, dtype=np.int64), matrix)
+        text = normalize_query("Cancel my subscription renewal")
+        lexical = LexicalIndex(
+            [(faq_id, f"topic number {faq_id}", "") for faq_id in range(1, 13)]
+            + [(13, normalize_query("Cancel my subscription renewal?"), "")]
+        )
+        lexical_score = dict(lexical.search(text))[13]
+
+        with override_settings(NLP_CONFIDENCE_THRESHOLD=0.5, NLP_LEXICAL_WEIGHT=0.3, NLP_HYBRID_CANDIDATES=10):
+            connection.set_schema_to_public()
+            candidates = index.search(user_vector, k=10)
+            self.assertNotIn(13, dict(candidates))
+
+            matches = fuse(text, candidates, 3, 0.3, lexical,
+                           lambda ids: index.score_ids(user_vector, ids))
+            fused = dict(matches)
+            self.assertIn(13, fused)
+            self.assertAlmostEqual(fused[13], 0.7 * 0.05 + 0.3 * lexical_score, places=4)
+            self.assertNotEqual(decide(matches), 13)
+
+            # without vector scores the lexical-only FAQ gets none
+            matches = fuse(text, candidates, 3, 0.3, lexical)
+            self.assertLess(dict(matches).get(13, 0.0), 0.5)
+            self.assertNotEqual(decide(matches), 13)
+
+    def test_only_failed_inference_is_an_outage(self):
+        """
+        A miss scored through the embedding server, or answered from the query
+        cache, is a normal "no confident answer" although this worker never
+        loaded the model. Only a failed encoder call answers 503.
+        """
+        from unittest import mock
+        from django.test import override_settings
+        import numpy as np
+        from chatbot import nlp
+        from chatbot.views import faq_reply
+
+        connection.set_tenant(self.client_b)
+        with override_settings(NLP_EMBEDDING_SERVER_URL='http://embedding.test', NLP_EMBEDDING_SERVER_FALLBACK=False), \
+                mock.patch.object(nlp, '_embedding_client', None), \
+                mock.patch.object(nlp.embedding_model, 'state', nlp.EmbeddingModel.UNLOADED), \
+                mock.patch.object(nlp.EmbeddingClient, 'encode',
+                                  return_value=np.zeros((1, 384), dtype=np.float32)) as encode:
+            self.assertEqual(faq_reply(*nlp.match_question("can I pay in bitcoin"))[1], 200)
+            # the cached decision
+            self.assertEqual(faq_reply(*nlp.match_question("can I pay in bitcoin"))[1], 200)
+            encode.assert_called_once()
+
+            # the server is down and there is no fallback
+            encode.return_value = None
+            with self.assertRaises(nlp.InferenceUnavailable):
+                nlp.match_question("do you accept cheques")
+
+        self.assertEqual(faq_reply(None, unavailable=True)[1], 503)
+        connection.set_schema_to_public()
+
+    def test_query_embeddings_are_cached(self):
+        """
+        A repeated question is encoded once, through the embedding server when
+        one is configured; while the server is down the in-process model takes
+        over, and a failed encode is not cached.
+        """
+        from unittest import mock
+        from django.test import override_settings
+        import numpy as np
+        from chatbot import nlp
+
+        session = mock.Mock()
+        session.post.return_value.json.return_value = {
+            'vectors': nlp.pack_matrix(np.array([[3.0, 4.0, 0.0, 0.0]], dtype=np.float32)), 'dim': 4,
+        }
+        client = nlp.EmbeddingClient('http://embedding.test/', timeout=1)
+        client._local.session = session
+        model = mock.Mock()
+        model.encode.return_value = np.array([[0.0, 0.0, 2.0, 0.0]], dtype=np.float32)
+
+        with override_settings(NLP_EMBEDDING_SERVER_URL='http://embedding.test/'), \
+                mock.patch.object(nlp, '_embedding_client', client), \
+                mock.patch.object(nlp, '_query_cache', nlp.QueryCache(maxsize=10, ttl=60)), \
+                mock.patch.object(nlp.embedding_model, 'get', return_value=model):
+            vector = nlp.embed_query("pricing")
+            np.testing.assert_allclose(vector, [0.6, 0.8, 0.0, 0.0])
+            np.testing.assert_array_equal(nlp.embed_query("pricing"), vector)
+            session.post.assert_called_once_with('http://embedding.test/encode', json={'texts': ["pricing"]}, timeout=1)
+            model.encode.assert_not_called()
+
+            # the server fails: the model answers, and the server is skipped for a while
+            session.post.side_effect = ConnectionError("refused")
+            with self.assertLogs('chatbot.nlp', level='WARNING'):
+                np.testing.assert_allclose(nlp.embed_query("contact"), [0.0, 0.0, 1.0, 0.0])
+            np.testing.assert_allclose(nlp.embed_query("opening hours"), [0.0, 0.0, 1.0, 0.0])
+            self.assertEqual(session.post.call_count, 2)
+            self.assertEqual(model.encode.call_count, 2)
+
+            # no fallback: nothing to cache, the next attempt encodes again
+            with override_settings(NLP_EMBEDDING_SERVER_FALLBACK=False):
+                self.assertIsNone(nlp.embed_query("refunds"))
+                client._down_until = 0
+                session.post.side_effect = None
+                np.testing.assert_allclose(nlp.embed_query("refunds"), [0.6, 0.8, 0.0, 0.0])
+
+    def test_embedding_model_states(self):
+        """
+        The model is only loaded on first use; a failed load makes NLP
+        unavailable until NLP_MODEL_RETRY_SECONDS have passed, then it is
+        tried again.
+        """
+        import sys
+        from unittest import mock
+        from django.test import override_settings
+        from chatbot.nlp import EmbeddingModel
+
+        sentence_transformers = mock.Mock()
+        sentence_transformers.SentenceTransformer.side_effect = OSError("no such model")
+        provider = EmbeddingModel('test-model')
+
+        with mock.patch.dict(sys.modules, {'sentence_transformers': sentence_transformers}):
+            self.assertEqual(provider.state, EmbeddingModel.UNLOADED)
+            sentence_transformers.SentenceTransformer.assert_not_called()
+
+            with override_settings(NLP_MODEL_RETRY_SECONDS=60), self.assertLogs('chatbot.nlp', level='ERROR'):
+                self.assertIsNone(provider.get())
+                self.assertIsNone(provider.get())
+            self.assertEqual((provider.state, provider.error), (EmbeddingModel.UNAVAILABLE, "no such model"))
+            self.assertFalse(provider.available)
+            self.assertFalse(provider.warm_up())
+            sentence_transformers.SentenceTransformer.assert_called_once()
+
+            # the retry delay has passed and the model loads now
+            loaded = mock.Mock()
+            sentence_transformers.SentenceTransformer.side_effect = None
+            sentence_transformers.SentenceTransformer.return_value = loaded
+            with override_settings(NLP_MODEL_RETRY_SECONDS=0):
+                self.assertIs(provider.get(), loaded)
+            self.assertTrue(provider.available)
+            self.assertIsNone(provider.error)
+            self.assertIsNotNone(provider.load_seconds)
+            sentence_transformers.SentenceTransformer.assert_called_with('test-model', device='cpu')
+
+            self.assertTrue(provider.warm_up())
+            loaded.encode.assert_called_once_with('warm up')
+            self.assertIs(provider.get(), loaded)
+            self.assertEqual(sentence_transformers.SentenceTransformer.call_count, 2)
+            self.assertEqual(provider.stats()['state'], EmbeddingModel.READY)
+
+    def test_batch_matching_encodes_once(self):
+        """
+        A batch of questions needs a single encoder call, repeated and exact questions none.
+        """
+        from unittest import mock
+        import numpy as np
+        from chatbot.nlp import match_questions
+
+        connection.set_tenant(self.client_b)
+        questions = ["Where are you located?", "what do you sell", "what do you sell!", "shipping to canada"]
+
+        with mock.patch('chatbot.nlp.generate_vectors',
+                        side_effect=lambda texts: np.ones((len(texts), 384), dtype=np.float32)) as generate_vectors:
+            results = match_questions(questions)
+
+        generate_vectors.assert_called_once()
+        self.assertEqual(generate_vectors.call_args[0][0], ["what do you sell", "shipping to canada"])
+        self.assertEqual(len(results), len(questions))
+        self.assertEqual(results[0][0].question, "Where are you located?")
+        self.assertEqual(results[1][:2], results[2][:2])
+        connection.set_schema_to_public()
+
+    def test_benchmark_reports_and_compares(self):
+        """
+        The synthetic benchmark finds the paraphrased FAQs and flags an accuracy drop between runs.
+        """
+        from chatbot.benchmark import run_benchmark, compare
+
+        rows = run_benchmark([200], backends=['exact', 'hybrid'], dtypes=['float32', 'int8'], queries=50)
+        self.assertEqual([(row['backend'], row['dtype']) for row in rows],
+                         [('exact', 'float32'), ('hybrid', 'float32'), ('exact', 'int8'), ('hybrid', 'int8')])
+        for row in rows:
+            self.assertGreater(row['topk'], 0.8)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+        worse = [dict(row, top1=row['top1'] - 0.1) for row in rows]
+        regressions = [change for change in compare(rows, worse) if change['regression']]
+        self.assertEqual({change['metric'] for change in regressions}, {'top1'})
+
+
+def create_client(name, schema_name, domain, faqs=()):
+    '''a tenant with its domain and FAQs, leaves the connection on the public schema'''
+    client = Client.objects.create(name=name, schema_name=schema_name)
+    Domain.objects.create(tenant=client, domain=domain, is_primary=True)
+    connection.set_tenant(client)
+    for faq_data in faqs:
+        FAQ.objects.create(question=faq_data["q"], answer=faq_data["a"])
+    connection.set_schema_to_public()
+    return client
+
+
+class UsageCounterTestCase(TestCase):
+    """
+    The per-tenant usage counters behind the plan limits.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.faqs = [
+            {"q": "What products do you sell?", "a": "We sell sustainable home goods and organic foods."},
+            {"q": "Where are you located?", "a": "We are an online-only store based out of Seattle."},
+            {"q": "Do you ship internationally?", "a": "Yes, we ship to most countries worldwide."},
+        ]
+        cls.tenant = create_client('Global Goods', 'globalgoods', 'globalgoods.test', cls.faqs)
+
+    def test_usage_counters_follow_faqs(self):
+        """
+        The FAQ usage counter used for plan limits tracks creates and deletes.
+        """
+        from chatbot import usage
+
+        connection.set_tenant(self.tenant)
+        self.assertEqual(usage.faq_count(), len(self.faqs))
+
+        FAQ.objects.filter(question=self.faqs[0]["q"]).first().delete()
+        self.assertEqual(usage.faq_count(), len(self.faqs) - 1)
+        self.assertEqual(usage.reconcile(), {})
+        connection.set_schema_to_public()
+
+
+class AnalyticsTestCase(TestCase):
+    """
+    Event ingestion (buffered or direct), the daily rollups behind the
+    dashboard, archiving and the time series endpoint.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_a_schema = 'meta_scifor_a'
+        cls.client_a = create_client('Meta Scifor', cls.client_a_schema, 'chatbot.metascifor.com')
+        cls.client_b_schema = 'globalgoods'
+        cls.client_b = create_client('Global Goods', cls.client_b_schema, 'globalgoods.test')
+
+    def test_events_update_daily_rollups(self):
+        """
+        Ingested events and new leads are added to the per-day rollup counters.
+        """
+        from django.test import override_settings
+        from chatbot.analytics import record_event
+        from chatbot.models import AnalyticsRollup, FormSubmission
+
+        connection.set_tenant(self.client_a)
+        with override_settings(ANALYTICS_BUFFER_ENABLED=False):
+            record_event('interaction_rule', {"message": "welcome_node"})
+            record_event('interaction_rule', {"message": "welcome_node"})
+            record_event('interaction_rule', {"message": "pricing_node"})
+        FormSubmission.objects.create(name="Ada", email="ada@example.test", message="Hi")
+
+        counts = {(r.event_type, r.key): r.count for r in AnalyticsRollup.objects.all()}
+        self.assertEqual(counts[('interaction_rule', 'welcome_node')], 2)
+        self.assertEqual(counts[('interaction_rule', '')], 1)
+        self.assertEqual(counts[('lead_submitted', '')], 1)
+        connection.set_schema_to_public()
+
+    def test_analytics_buffer_flushes_and_counts_drops(self):
+        """
+        Buffered events are written per tenant in one flush; events beyond the
+        buffer size are dropped and counted, as are events that fail to write.
+        """
+        from unittest import mock
+        from chatbot.analytics import AnalyticsBuffer
+        from chatbot.models import AnalyticsLog, AnalyticsRollup
+
+        buffer = AnalyticsBuffer(max_size=4, flush_size=100, flush_interval=60)
+        # no background thread, and the test transaction's connection stays open
+        with mock.patch.object(AnalyticsBuffer, '_ensure_thread'), \
+                mock.patch('chatbot.analytics.close_old_connections'):
+            for message in ("a", "b", "c"):
+                self.assertTrue(buffer.record(self.client_a_schema, 'interaction_text', {"message": message}))
+            self.assertTrue(buffer.record(self.client_b_schema, 'interaction_text', {"message": "d"}))
+            self.assertFalse(buffer.record(self.client_b_schema, 'interaction_text', {"message": "e"}))
+            self.assertEqual(buffer.stats(), {'buffered': 4, 'recorded': 4, 'flushed': 0, 'dropped': 1, 'failed': 0})
+
+            self.assertEqual(buffer.flush(), 4)
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(buffer.stats(), {'buffered': 0, 'recorded': 4, 'flushed': 4, 'dropped': 1, 'failed': 0})
+
+            # a schema without the tables: the batch fails, the others are unaffected
+            buffer.record('missing_schema', 'interaction_text', {"message": "f"})
+            buffer.record(self.client_b_schema, 'interaction_text', {"message": "g"})
+            with self.assertLogs(level='ERROR'):
+                self.assertEqual(buffer.flush(), 1)
+            self.assertEqual(buffer.stats()['failed'], 1)
+            self.assertEqual(buffer.stats()['flushed'], 5)
+
+        for client, expected in ((self.client_a, ["a", "b", "c"]), (self.client_b, ["d", "g"])):
+            connection.set_tenant(client)
+            messages = AnalyticsLog.objects.order_by('id').values_list('details__message', flat=True)
+            self.assertEqual(list(messages), expected)
+            self.assertEqual(AnalyticsRollup.objects.get(event_type='interaction_text', key='').count, len(expected))
+        connection.set_schema_to_public()
+
+    def test_timeseries_etag_skips_unchanged_ranges(self):
+        """
+        A repeated time series request with the ETag answers 304 without
+        running the aggregation, a new event in the range answers 200 again.
+        """
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from chatbot.analytics import record_event
+        from chatbot.views import AnalyticsTimeSeriesView
+
+        user = User.objects.create_user('analyst', password='secret')
+        connection.set_tenant(self.client_a)
+        with override_settings(ANALYTICS_BUFFER_ENABLED=False):
+            record_event('interaction_text', {"message": "hello"})
+
+        def timeseries(bucket, etag=''):
+            request = APIRequestFactory().get('/api/v1/analytics/timeseries/', {'bucket': bucket},
+                                              HTTP_IF_NONE_MATCH=etag)
+            request.tenant = self.client_a
+            force_authenticate(request, user=user)
+            return AnalyticsTimeSeriesView.as_view()(request)
+
+        for bucket in ('day', 'hour'):
+            response = timeseries(bucket)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sum(response.data['series']['interaction_text']), 1)
+            etag = response['ETag']
+
+            with mock.patch('chatbot.views.timeseries') as aggregate:
+                self.assertEqual(timeseries(bucket, etag).status_code, 304)
+                aggregate.assert_not_called()
+
+            with override_settings(ANALYTICS_BUFFER_ENABLED=False):
+                record_event('interaction_text', {"message": "hello again"})
+
+            response = timeseries(bucket, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+        self.assertEqual(sum(timeseries('day').data['series']['interaction_text']), 3)
+        connection.set_schema_to_public()
+
+    def test_archive_then_backfill_keeps_history(self):
+        """
+        Events older than the retention period are archived to a file and
+        deleted, and a later rollup backfill leaves the counts of those days alone.
+        """
+        from datetime import timedelta
+        from pathlib import Path
+        from django.core.management import call_command
+        from django.utils import timezone
+        import gzip
+        import io
+        import tempfile
+        from chatbot.analytics import update_rollups
+        from chatbot.models import AnalyticsLog, AnalyticsRollup
+
+        old, recent = timezone.now() - timedelta(days=800), timezone.now() - timedelta(days=1)
+        events = [('interaction_text', {"message": "hi"}, old)] * 2 + [('interaction_text', {"message": "hi"}, recent)]
+
+        connection.set_tenant(self.client_b)
+        for event_type, details, timestamp in events:
+            AnalyticsLog.objects.create(event_type=event_type, details=details, timestamp=timestamp)
+        update_rollups(events)
+        connection.set_schema_to_public()
+
+        def daily_counts():
+            connection.set_tenant(self.client_b)
+            counts = dict(AnalyticsRollup.objects.filter(event_type='interaction_text').values_list('day', 'count'))
+            connection.set_schema_to_public()
+            return counts
+
+        counts = daily_counts()
+        self.assertEqual(counts[timezone.localdate(old)], 2)
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('archive_analytics', days=365, schema=self.client_b_schema,
+                         archive_dir=archive_dir, stdout=io.StringIO())
+
+            path = Path(archive_dir) / self.client_b_schema / f"analytics-{timezone.localtime(old):%Y-%m}.ndjson.gz"
+            with gzip.open(path, 'rt') as archive:
+                archived = [json.loads(line) for line in archive]
+            self.assertEqual([row['event_type'] for row in archived], ['interaction_text'] * 2)
+
+        connection.set_tenant(self.client_b)
+        self.assertEqual(AnalyticsLog.objects.count(), 1)
+        connection.set_schema_to_public()
+
+        call_command('backfill_analytics_rollups', schema=self.client_b_schema, stdout=io.StringIO())
+        self.assertEqual(daily_counts(), counts)
+
+    def test_rollup_migration_seeds_whole_history(self):
+        """
+        Migration 0009 counts every existing event and lead into the rollups,
+        however old, so the all-time dashboard totals survive the switch.
+        """
+        from datetime import timedelta
+        import importlib
+        from django.db.migrations.executor import MigrationExecutor
+        from django.utils import timezone
+        from chatbot.models import AnalyticsLog, AnalyticsRollup, FormSubmission
+
+        migration = importlib.import_module('chatbot.migrations.0009_analyticsrollup')
+        old = timezone.now() - timedelta(days=3000)
+
+        connection.set_tenant(self.client_a)
+        AnalyticsLog.objects.bulk_create([
+            AnalyticsLog(event_type='interaction_rule', details={"message": "welcome_node"}, timestamp=old),
+            AnalyticsLog(event_type='interaction_rule', details={"message": "pricing_node"}, timestamp=old),
+            AnalyticsLog(event_type='interaction_text', details={"message": "hi"}, timestamp=old),
+        ])
+        lead = FormSubmission.objects.create(name="Ada", email="ada@example.test", message="Hi")
+        FormSubmission.objects.filter(pk=lead.pk).update(submitted_at=old)
+        # the table as 0009 creates it
+        AnalyticsRollup.objects.all().delete()
+
+        state = MigrationExecutor(connection).loader.project_state(('chatbot', '0009_analyticsrollup'))
+        migration.seed_rollups(state.apps, None)
+
+        counts = {(row.day, row.event_type, row.key): row.count for row in AnalyticsRollup.objects.all()}
+        day = timezone.localdate(old)
+        self.assertEqual(counts, {
+            (day, 'interaction_rule', 'welcome_node'): 1,
+            (day, 'interaction_rule', ''): 1,
+            (day, 'interaction_text', ''): 1,
+            (day, 'lead_submitted', ''): 1,
+        })
+        connection.set_schema_to_public()
+
+
+class FormSubmissionExportTestCase(TestCase):
+    """
+    Listing and exporting a tenant's form submissions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_a_schema = 'meta_scifor_a'
+        cls.client_a = create_client('Meta Scifor', cls.client_a_schema, 'chatbot.metascifor.com')
+        cls.client_b_schema = 'globalgoods'
+        cls.client_b = create_client('Global Goods', cls.client_b_schema, 'globalgoods.test')
+
+    def test_submissions_paginate_and_stream_exports(self):
+        """
+        Submissions are listed newest first a page at a time, following the
+        next cursor, and exported as CSV or NDJSON after the connection is
+        back on the public schema (as it is when the body is streamed).
+        """
+        from urllib.parse import parse_qs, urlparse
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from chatbot.models import FormSubmission
+        from chatbot.views import FormSubmissionViewSet
+
+        user = User.objects.create_user('analyst', password='secret')
+        connection.set_tenant(self.client_a)
+        names = [f"Lead {i}" for i in range(5)]
+        for name in names:
+            FormSubmission.objects.create(name=name, email="lead@example.test", message="Hi")
+        connection.set_tenant(self.client_b)
+        FormSubmission.objects.create(name="Other tenant", email="other@example.test", message="Hi")
+        connection.set_tenant(self.client_a)
+
+        def get(action, **params):
+            request = APIRequestFactory().get('/api/v1/submissions/', params)
+            request.tenant = self.client_a
+            force_authenticate(request, user=user)
+            return FormSubmissionViewSet.as_view({'get': action})(request)
+
+        listed, params = [], {'page_size': 2}
+        while True:
+            page = get('list', **params).data
+            self.assertLessEqual(len(page['results']), 2)
+            listed += [row['name'] for row in page['results']]
+            if not page['next']:
+                break
+            params = {key: values[0] for key, values in parse_qs(urlparse(page['next']).query).items()}
+        self.assertEqual(listed, names[::-1])
+
+        csv_response = get('export', file_format='csv')
+        ndjson_response = get('export', file_format='ndjson')
+        self.assertEqual(get('export', file_format='xml').status_code, 400)
+        connection.set_schema_to_public()
+
+        self.assertEqual(csv_response['Content-Disposition'], 'attachment; filename="formsubmission-export.csv"')
+        lines = b''.join(csv_response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,name,email,phone,message,submitted_at')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], names)
+
+        rows = [json.loads(line) for line in b''.join(ndjson_response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['name'] for row in rows], names)
+        self.assertEqual(set(rows[0]), {'id', 'name', 'email', 'phone', 'message', 'submitted_at'})
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -8,8 +9,19 @@ router.register(r'submissions',views.FormSubmissionViewSet)
 router.register(r'analytics',views.AnalyticsLogViewSet)
 router.register(r'rules',views.ChatRuleViewSet,basename='rule')
 
+# the ASGI app (asgi.py) serves the async view, gunicorn/WSGI the DRF one
+if settings.CHATBOT_ASYNC_INTERACT:
+    interact_view = views.AsyncChatbotInteractView.as_view()
+else:
+    interact_view = views.ChatbotInteractView.as_view()
+
 urlpatterns = [
-    path('interact/',views.ChatbotInteractView.as_view(),name='chatbot-interact'),
+    path('interact/',interact_view,name='chatbot-interact'),
+    path('interact/batch/',views.ChatbotBatchInteractView.as_view(),name='chatbot-interact-batch'),
+    path('widget/bootstrap/',views.WidgetBootstrapView.as_view(),name='widget-bootstrap'),
+    path('widget/events/',views.WidgetEventsView.as_view(),name='widget-events'),
     path('analytics/summary/',views.AnalyticsSummaryView.as_view(),name='analytics-summary'),
+    path('analytics/timeseries/',views.AnalyticsTimeSeriesView.as_view(),name='analytics-timeseries'),
+    path('analytics/pipeline/',views.AnalyticsPipelineView.as_view(),name='analytics-pipeline'),
     path('',include(router.urls)),
 ]
\ No newline at end of file
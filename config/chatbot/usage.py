@@ -0,0 +1,66 @@
+"""
+Per-tenant usage counters (see models.UsageCounter).
+
+All functions work on the active tenant schema.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import UsageCounter, FAQ, FormSubmission
+
+ALL_TIME = ''
+
+
+def current_period(when=None):
+    '''monthly bucket name, e.g. "2025-11"'''
+    return (when or timezone.now()).strftime('%Y-%m')
+
+def month_start(when=None):
+    return (when or timezone.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def increment(metric, amount=1, period=ALL_TIME):
+    '''atomically adds `amount` (may be negative) to a counter, creating it on first use'''
+    updated = UsageCounter.objects.filter(metric=metric, period=period).update(
+        value=F('value') + amount, updated_at=timezone.now()
+    )
+    if updated:
+        return
+
+    try:
+        with transaction.atomic():
+            UsageCounter.objects.create(metric=metric, period=period, value=amount)
+    except IntegrityError:
+        # another request created the row first
+        UsageCounter.objects.filter(metric=metric, period=period).update(
+            value=F('value') + amount, updated_at=timezone.now()
+        )
+
+def get_usage(metric, period=ALL_TIME):
+    value = UsageCounter.objects.filter(metric=metric, period=period).values_list('value', flat=True).first()
+    return value or 0
+
+def set_usage(metric, value, period=ALL_TIME):
+    UsageCounter.objects.update_or_create(metric=metric, period=period, defaults={'value': value})
+
+def faq_count():
+    return get_usage(UsageCounter.METRIC_FAQS)
+
+def leads_this_month():
+    return get_usage(UsageCounter.METRIC_LEADS, current_period())
+
+def reconcile():
+    '''recounts the real rows and overwrites the counters, returns {metric: (old, new)}'''
+    changes = {}
+    period = current_period()
+
+    real = {
+        (UsageCounter.METRIC_FAQS, ALL_TIME): FAQ.objects.count(),
+        (UsageCounter.METRIC_LEADS, period): FormSubmission.objects.filter(submitted_at__gte=month_start()).count(),
+    }
+    for (metric, bucket), value in real.items():
+        old = get_usage(metric, bucket)
+        if old != value:
+            set_usage(metric, value, bucket)
+            changes[metric] = (old, value)
+
+    return changes
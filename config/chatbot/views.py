@@ -2,55 +2,247 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import viewsets, permissions, serializers
 from rest_framework.authentication import TokenAuthentication
-from .models import FAQ, FormSubmission, AnalyticsLog, ChatRule
+from rest_framework.decorators import action
+from .models import FAQ, FormSubmission, AnalyticsLog, ChatRule, UsageCounter, AnalyticsRollup
 from .serializers import FAQSerializer, FormSubmissionSerializer, AnalyticsLogSerializer, ChatRuleSerializer
-from .nlp import find_best_faq
+from .nlp import match_question, match_questions, get_faq, InferenceUnavailable, generate_vectors, encode_vector, hash_question, get_search_backend
+from datetime import date, timedelta
+import csv
+import hashlib
+import io
 import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.http import StreamingHttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_vary_headers
 from django.utils import timezone
+from django_tenants.utils import schema_context
+from .analytics import record_event, get_buffer, timeseries, timeseries_marker, BUCKETS, EVENT_LEAD, EVENT_TEXT, EVENT_RULE
+from .flows import get_flow_graph
+from .async_interact import amatch_question, afaq_response, arule_response, InferenceBusy
+from .pagination import NewestFirstCursorPagination
 from .permissions import IsAuthenticatedOrWriteOnly
+from tenants.instrumentation import stage
+from . import usage
 
 class FAQViewSet(viewsets.ModelViewSet):
     queryset = FAQ.objects.all()
     serializer_class = FAQSerializer
     permission_classes = [permissions.IsAuthenticated]
-    
-    def perform_create(self, serializer):
+
+    def check_faq_limit(self, adding=1):
         """
-        Custom logic that runs when a new FAQ is created (POST).
-        We check the plan limits here.
+        Raises a ValidationError if adding `adding` FAQs would exceed the plan limit.
         """
         tenant = self.request.tenant
         
         if tenant.subscription and tenant.subscription.plan:
             plan = tenant.subscription.plan
             
-            current_faq_count = FAQ.objects.count()
+            current_faq_count = usage.faq_count()
             
-            if current_faq_count >= plan.max_faqs:
+            if current_faq_count + adding > plan.max_faqs:
                 # Block the request if the limit is reached
                 raise serializers.ValidationError({
                     "error": f"FAQ limit of {plan.max_faqs} reached for your plan. Please upgrade to add more."
                 })
-        
+    
+    def perform_create(self, serializer):
+        """
+        Custom logic that runs when a new FAQ is created (POST).
+        We check the plan limits here.
+        """
+        self.check_faq_limit()
         serializer.save()
 
-class FormSubmissionViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request, *args, **kwargs):
+        """
+        Creates many FAQs at once (POST /api/v1/faqs/import/).
+        Accepts a JSON list of FAQ objects (or {"faqs": [...]}) or a CSV
+        upload in the `file` field with question,answer[,response_type] columns.
+        Questions are embedded in large batches instead of one encode per FAQ.
+        """
+        rows = self._import_rows(request)
+
+        if len(rows) > settings.NLP_IMPORT_MAX_ROWS:
+            raise serializers.ValidationError({
+                "error": f"At most {settings.NLP_IMPORT_MAX_ROWS} FAQs can be imported at once."
+            })
+
+        serializer = self.get_serializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.check_faq_limit(adding=len(serializer.validated_data))
+
+        faqs = [FAQ(**data) for data in serializer.validated_data]
+        for faq in faqs:
+            faq.question_hash = hash_question(faq.question)
+            faq.embedding_pending = True
+
+        if not settings.NLP_ASYNC_EMBEDDING:
+            batch_size = settings.NLP_IMPORT_BATCH_SIZE
+            for start in range(0, len(faqs), batch_size):
+                batch = faqs[start:start + batch_size]
+                vectors = generate_vectors([faq.question for faq in batch])
+                if vectors is None:
+                    # model unavailable, the embedding worker picks the rest up
+                    break
+                for faq, vector in zip(batch, vectors):
+                    faq.question_vector = encode_vector(vector)
+                    faq.embedding_pending = False
+
+        with transaction.atomic():
+            FAQ.objects.bulk_create(faqs, batch_size=1000)
+            # bulk_create sends no signals, count the new rows here
+            usage.increment(UsageCounter.METRIC_FAQS, len(faqs))
+            # bulk_create sends no signals, rebuild the tenant's search index once
+            schema_name = connection.schema_name
+            transaction.on_commit(lambda: get_search_backend().invalidate(schema_name))
+
+        pending = sum(faq.embedding_pending for faq in faqs)
+        return Response({"created": len(faqs), "pending": pending}, status=201)
+
+    def _import_rows(self, request):
+        upload = request.FILES.get('file')
+
+        if upload is not None:
+            try:
+                reader = csv.DictReader(io.TextIOWrapper(upload, encoding='utf-8-sig'))
+                return [{key.strip(): value for key, value in row.items() if key and value not in (None, '')}
+                        for row in reader]
+            except (UnicodeDecodeError, csv.Error) as e:
+                raise serializers.ValidationError({"error": f"Invalid CSV file: {e}"})
+
+        data = request.data
+        if isinstance(data, dict):
+            data = data.get('faqs')
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                "error": "Expected a list of FAQs, {\"faqs\": [...]} or a CSV file upload."
+            })
+        return data
+
+class StreamingExportMixin:
+    """
+    Adds GET <list url>/export/?file_format=csv|ndjson, streaming every row
+    of the tenant in chunks so memory stays flat regardless of table size.
+    """
+    export_fields = []
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in ('csv', 'ndjson'):
+            return Response({"error": "file_format must be csv or ndjson."}, status=400)
+
+        rows = self._export_rows(connection.schema_name)
+        if file_format == 'csv':
+            content, content_type = self._csv_lines(rows), 'text/csv'
+        else:
+            content, content_type = self._ndjson_lines(rows), 'application/x-ndjson'
+
+        basename = self.queryset.model._meta.model_name
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{basename}-export.{file_format}"'
+        return response
+
+    def _export_rows(self, schema_name):
+        # the body is generated after HeaderTenantMiddleware has already switched
+        # the connection back to public, so the tenant schema is pinned here
+        with schema_context(schema_name):
+            queryset = self.get_queryset().order_by('id').values_list(*self.export_fields)
+            yield from queryset.iterator(chunk_size=self.export_chunk_size)
+
+    def _csv_lines(self, rows):
+        buffer = _LineBuffer()
+        writer = csv.writer(buffer)
+        yield writer.writerow(self.export_fields)
+        for row in rows:
+            yield writer.writerow(row)
+
+    def _ndjson_lines(self, rows):
+        for row in rows:
+            yield json.dumps(dict(zip(self.export_fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+class _LineBuffer:
+    """csv.writer target that hands each written line straight back."""
+    def write(self, value):
+        return value
+
+
+class FormSubmissionViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = FormSubmission.objects.all()
     serializer_class = FormSubmissionSerializer
     http_method_names = ['get','head','options','post']
     permission_classes = [IsAuthenticatedOrWriteOnly]
+    pagination_class = NewestFirstCursorPagination
+    cursor_ordering = '-submitted_at'
+    export_fields = ['id','name','email','phone','message','submitted_at']
 
-class AnalyticsLogViewSet(viewsets.ModelViewSet):
+class AnalyticsLogViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = AnalyticsLog.objects.all()
     serializer_class = AnalyticsLogSerializer
     http_method_names = ['get','head','options']
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NewestFirstCursorPagination
+    cursor_ordering = '-timestamp'
+    export_fields = ['id','event_type','details','timestamp']
 
 class ChatRuleViewSet(viewsets.ModelViewSet):
     queryset = ChatRule.objects.all()
     serializer_class = ChatRuleSerializer
     permission_classes = [permissions.IsAuthenticated]
-    
+
+    @action(detail=False, methods=['get'])
+    def graph(self, request):
+        """
+        The whole compiled flow in one call: nodes, edges and the
+        dangling-edge / cycle / unreachable-node reports.
+        """
+        return Response(get_flow_graph().as_dict())
+
+
+def faq_reply(best_faq, suggestions=(), unavailable=False):
+    """
+    (body, status) answering a free-text question, shared by the sync and async interact views.
+    Without a confident match the next-best FAQs are offered as "did you mean" buttons.
+    `unavailable` means the question could not be embedded (InferenceUnavailable).
+    """
+    if unavailable:
+        return {
+            "answer":"Our assistant is temporarily unavailable. Please try again in a moment, or contact our support team."
+        }, 503
+
+    if best_faq:
+        if best_faq.response_type == FAQ.RESPONSE_TYPE_RICH:
+            return best_faq.rich_response, 200
+        return {"question": best_faq.question, "answer": best_faq.answer}, 200
+
+    if suggestions:
+        message = "I'm not sure I understood. Did you mean:"
+        return {
+            "type": "suggestions",
+            "message": message,
+            "answer": message,
+            "options": [
+                {"text": faq.question, "payload": str(faq.pk), "type": "faq"} for faq in suggestions
+            ],
+        }, 200
+
+    return {
+        "question": "Not Found",
+        "answer":"I'm sorry, I don't have a confident answer for that. You can try rephrasing, or contact our support team."
+    }, 200
+
+INVALID_OPTION_REPLY = {"answer":"Sorry, that option is not valid."}
+BUSY_REPLY = {"answer":"Our assistant is busy right now. Please try again in a moment."}
 
 class ChatbotInteractView(APIView):
     '''Takes user's message and 
@@ -61,8 +253,10 @@ class ChatbotInteractView(APIView):
     
     def post(self,request, *args, **kwargs):
 
-        interaction_type = request.data.get('type','text')
-        payload = request.data.get('payload')
+        # request.data parses the body on first access
+        with stage('decode'):
+            interaction_type = request.data.get('type','text')
+            payload = request.data.get('payload')
         #user_message = request.data.get('message', None)
 
         if not payload:
@@ -71,47 +265,193 @@ class ChatbotInteractView(APIView):
                 status=400
             )
         
-        AnalyticsLog.objects.create(
-            event_type=f'interaction_{interaction_type}',
-            details={"message": payload}
-        )
+        # buffered, the response does not wait for the INSERT
+        record_event(f'interaction_{interaction_type}', {"message": payload})
 
         if interaction_type == 'text':
             #----NLP--PATH----
-            best_faq = find_best_faq(payload)
-
-            if best_faq:
-                if best_faq.response_type == FAQ.RESPONSE_TYPE_RICH:
-                    return Response(best_faq.rich_response)
-                else:
-                    return ResourceWarning({
-                        "question":best_faq.question,
-                        "answer": best_faq.answer
-                    })
-            else:
-                return Response({
-                    "question": "Not Found",
-                    "answer":"I'm sorry, I don't have a confident answer for that. You can try rephrasing, or contact our support team."
-                })
+            try:
+                best_faq, suggestions = match_question(payload)
+            except InferenceUnavailable:
+                return Response(*faq_reply(None, unavailable=True))
+            return Response(*faq_reply(best_faq, suggestions))
+
+        elif interaction_type == 'faq':
+            # a "did you mean" suggestion, the payload is the FAQ id
+            faq = get_faq(int(payload)) if str(payload).isdigit() else None
+            if faq is None:
+                return Response(INVALID_OPTION_REPLY,status=404)
+            return Response(*faq_reply(faq))
         
         elif interaction_type == 'rule':
             node_id = payload
 
-            if node_id == 'show_form':
-                return Response({
-                    "type":"show_form",
-                    "message":"Please fill out the form below and our team will get back to you."
-                })
-            
+            # served from the cached flow graph, no query per click
+            response = get_flow_graph().response(node_id)
+            if response is None:
+                return Response(INVALID_OPTION_REPLY,status=404)
+            return Response(response)
+
+class ChatbotBatchInteractView(APIView):
+    """
+    Answers many questions of one tenant in a single request, for offline
+    evaluation, chat-log replay and bulk FAQ testing.
+
+    Body: {"messages": ["question", ...]} or {"messages": [{"id": ..., "payload": "question"}, ...]}.
+    All questions the cache can't answer are encoded in one model call and
+    scored in one matrix multiply. Nothing is logged to the analytics.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        if not getattr(request, 'tenant', None):
+            return Response({"error": "X-Client-ID header is required."}, status=400)
+
+        messages = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        max_messages = settings.NLP_BATCH_MAX_MESSAGES
+        if not isinstance(messages, list) or not messages or len(messages) > max_messages:
+            return Response({"error": f"Send a list of 1 to {max_messages} messages."}, status=400)
+
+        ids, payloads = [], []
+        for position, message in enumerate(messages):
+            if isinstance(message, dict):
+                message_id, payload = message.get('id', position), message.get('payload')
+            else:
+                message_id, payload = position, message
+            if not isinstance(payload, str) or not payload:
+                return Response({"error": f"Message {message_id!r} has no text payload."}, status=400)
+            ids.append(message_id)
+            payloads.append(payload)
+
+        try:
+            matches = match_questions(payloads)
+        except InferenceUnavailable:
+            return Response(*faq_reply(None, unavailable=True))
+
+        results = []
+        for message_id, payload, (best_faq, suggestions, score) in zip(ids, payloads, matches):
+            body, status = faq_reply(best_faq, suggestions)
+            results.append({
+                "id": message_id,
+                "payload": payload,
+                "status": status,
+                "faq_id": best_faq.pk if best_faq else None,
+                # top fused score, null when answered from the cache or an exact match
+                "score": round(score, 4) if score is not None else None,
+                "response": body,
+            })
+
+        return Response({"results": results})
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatbotInteractView(View):
+    """
+    Async version of ChatbotInteractView for the ASGI app (CHATBOT_ASYNC_INTERACT).
+
+    Same request and response format. The event loop only awaits: DB and cache
+    steps run tenant-pinned in the request's sync thread and the encoder runs in
+    the bounded inference executor, so a slow model call holds no worker.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        tenant = getattr(request, 'tenant', None)
+        if tenant is None:
+            return JsonResponse({"error": "X-Client-ID header is required."}, status=400)
+
+        try:
+            with stage('decode'):
+                data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"answer":"Invalid JSON body."}, status=400)
+        if not isinstance(data, dict):
+            data = {}
+
+        interaction_type = data.get('type', 'text')
+        payload = data.get('payload')
+
+        if not payload or not isinstance(payload, str):
+            return JsonResponse({"answer":"No input received."}, status=400)
+
+        if interaction_type == 'text':
             try:
-                rule_node = ChatRule.objects.get(node_id=node_id)
-                return Response(rule_node.rule_data)
-            
-            except ChatRule.DoesNotExist:
-                return Response({"answer":"Sorry, that option is not valid."},status=404)
-            except json.JSONDecodeError:
-                return Response({"answer":"Error: Chatbot configuration is invalid."},status=500)
-            
+                best_faq, suggestions = await amatch_question(tenant, payload)
+            except InferenceBusy:
+                return JsonResponse(BUSY_REPLY, status=503, headers={'Retry-After': '1'})
+            except InferenceUnavailable:
+                body, status = faq_reply(None, unavailable=True)
+                return JsonResponse(body, status=status)
+            body, status = faq_reply(best_faq, suggestions)
+            return JsonResponse(body, status=status, safe=False)
+
+        if interaction_type == 'faq':
+            faq = await afaq_response(tenant, payload)
+            if faq is None:
+                return JsonResponse(INVALID_OPTION_REPLY, status=404)
+            body, status = faq_reply(faq)
+            return JsonResponse(body, status=status, safe=False)
+
+        if interaction_type == 'rule':
+            response = await arule_response(tenant, payload)
+            if response is None:
+                return JsonResponse(INVALID_OPTION_REPLY, status=404)
+            return JsonResponse(response, safe=False)
+
+        return JsonResponse({"answer":"Unknown interaction type."}, status=400)
+
+class WidgetBootstrapView(APIView):
+    """
+    Everything the widget needs before the first message: the welcome node and
+    the rule subgraph reachable from it, so option clicks are rendered client-side.
+    The payload only changes when a rule is edited, so it is cached by the browser
+    and revalidated with its ETag.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        if not getattr(request, 'tenant', None):
+            return Response({"error": "X-Client-ID header is required."}, status=400)
+
+        payload, etag = get_flow_graph().bootstrap()
+        headers = {'ETag': etag, 'Cache-Control': f'public, max-age={settings.WIDGET_BOOTSTRAP_MAX_AGE}'}
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(payload, headers=headers)
+
+        # shared caches must keep one copy per tenant
+        patch_vary_headers(response, ['X-Client-ID'])
+        return response
+
+class WidgetEventsView(APIView):
+    """
+    Fire-and-forget analytics for the rule clicks the widget rendered locally.
+    Accepts {"events": [{"type": "rule", "payload": "<node_id>"}, ...]}.
+    """
+    permission_classes = [permissions.AllowAny]
+    MAX_EVENTS = 50
+
+    def post(self, request, *args, **kwargs):
+        if not getattr(request, 'tenant', None):
+            return Response({"error": "X-Client-ID header is required."}, status=400)
+
+        events = request.data.get('events') if isinstance(request.data, dict) else request.data
+        if not isinstance(events, list) or len(events) > self.MAX_EVENTS:
+            return Response({"error": f"Send a list of at most {self.MAX_EVENTS} events."}, status=400)
+
+        graph = get_flow_graph()
+        accepted = 0
+        for event in events:
+            if not isinstance(event, dict) or event.get('type') != 'rule':
+                continue
+            node_id = event.get('payload')
+            # only known nodes, so the log can't be filled with arbitrary strings
+            if isinstance(node_id, str) and graph.response(node_id) is not None:
+                record_event(EVENT_RULE, {"message": node_id})
+                accepted += 1
+
+        return Response({"accepted": accepted}, status=202)
+
 class AnalyticsSummaryView(APIView):
     """
     Provides a high level summary of analytics for
@@ -120,41 +460,87 @@ class AnalyticsSummaryView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     def get(self,request, *args, **kwargs):
-        
-        # 1. Total Leads (all-time)
-        total_leads = FormSubmission.objects.count()
-        
-        # 2. Leads Captured Today
-        today = timezone.now().date()
-        leads_today = FormSubmission.objects.filter(
-            submitted_at__date = today
-        ).count()
-
-        # 3. Chats Started
-        chats_started = AnalyticsLog.objects.filter(
-            event_type='interaction_rule',
-            details__message='welcome_node'
-        ).count()
-
-        # 4. FAQs Clicked/Asked (NLP interactions)
-        faqs_clicked = AnalyticsLog.objects.filter(
-            event_type='interaction_text'
-        ).count()
-
-        # 5. Chat Redirects (Forms shown)
-        # 'interaction_rule' with payload 'show_form'
-        chat_redirects = AnalyticsLog.objects.filter(
-            event_type='interaction_rule',
-            details__message='show_form'
-        ).count()
+        today = timezone.localdate()
+
+        # one aggregate over the (small) rollup table gives every counter,
+        # all-time and today, see analytics.update_rollups
+        rows = AnalyticsRollup.objects.filter(
+            event_type__in=[EVENT_LEAD, EVENT_TEXT, EVENT_RULE]
+        ).values('event_type', 'key').annotate(
+            total=Sum('count'),
+            today=Sum('count', filter=Q(day=today)),
+        )
+        counts = {(row['event_type'], row['key']): row for row in rows}
 
+        def total(event_type, key=''):
+            return counts.get((event_type, key), {}).get('total') or 0
 
         summary_data = {
-            'totalLeadsCaptured': total_leads,
-            'leadsCapturedToday': leads_today,
-            'chatsStarted': chats_started,
-            'faqsClicked': faqs_clicked,
-            'chatRedirects': chat_redirects
+            # 1. Total Leads (all-time)
+            'totalLeadsCaptured': total(EVENT_LEAD),
+            # 2. Leads Captured Today
+            'leadsCapturedToday': counts.get((EVENT_LEAD, ''), {}).get('today') or 0,
+            # 3. Chats Started
+            'chatsStarted': total(EVENT_RULE, 'welcome_node'),
+            # 4. FAQs Clicked/Asked (NLP interactions)
+            'faqsClicked': total(EVENT_TEXT),
+            # 5. Chat Redirects (Forms shown)
+            'chatRedirects': total(EVENT_RULE, 'show_form'),
         }
 
         return Response(summary_data)
+
+
+class AnalyticsTimeSeriesView(APIView):
+    """
+    Bucketed event counts for dashboard charts.
+    GET /api/v1/analytics/timeseries/?start=2025-11-01&end=2025-11-30&bucket=day
+    bucket is hour, day (default) or week; start/end default to the last 30 days.
+    Supports conditional GET: the ETag is derived from a cheap marker of the
+    range's rows, so an unchanged range answers 304 without the aggregation.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    # longest range per bucket, keeps a single response bounded
+    MAX_DAYS = {'hour': 31, 'day': 366, 'week': 3660}
+
+    def get(self, request, *args, **kwargs):
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            return Response({"error": f"bucket must be one of {', '.join(BUCKETS)}."}, status=400)
+
+        today = timezone.localdate()
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params else today
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=29)
+        except ValueError:
+            return Response({"error": "start and end must be dates in YYYY-MM-DD format."}, status=400)
+
+        if start > end:
+            return Response({"error": "start must not be after end."}, status=400)
+        if (end - start).days >= self.MAX_DAYS[bucket]:
+            return Response({"error": f"At most {self.MAX_DAYS[bucket]} days can be requested with bucket={bucket}."}, status=400)
+
+        marker = [connection.schema_name, bucket, start, end, timeseries_marker(start, end, bucket)]
+        etag = '"%s"' % hashlib.md5(json.dumps(marker, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+        # ranges that ended before today cannot change any more
+        max_age = 3600 if end < today else 60
+        headers = {'ETag': etag, 'Cache-Control': f'private, max-age={max_age}'}
+
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+
+        return Response(timeseries(start, end, bucket), headers=headers)
+
+
+class AnalyticsPipelineView(APIView):
+    """
+    Health of the buffered analytics pipeline of this worker process
+    (events recorded / written / dropped because the buffer was full).
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_buffer().stats())
@@ -0,0 +1,164 @@
+"""
+Chat over a WebSocket for the widget (ASGI only, routed in config/asgi.py).
+
+    ws://<host>/ws/chat/?client=<schema_name>
+
+One connection carries the whole chat session (browsers can't set the
+X-Client-ID header on a WebSocket, hence the query parameter). The widget
+sends {"id": 1, "type": "text" | "rule" | "faq", "payload": "..."} and receives
+staged events tagged with the same id:
+
+    {"event": "ack", "id": 1}
+    {"event": "candidates", "id": 1, "data": [{"id": .., "question": .., "score": ..}]}
+    {"event": "answer", "id": 1, "status": 200, "data": {<same body as /interact/>}}
+    {"event": "error", "id": 1, "status": 4xx/5xx, "data": {"answer": ".."}}
+
+"candidates" is only sent for text questions that went through the index.
+The client's subscription is checked again for every message, a session whose
+subscription lapsed is closed with 4402.
+"""
+from asgiref.sync import sync_to_async, ThreadSensitiveContext
+from django.conf import settings
+from django.db import close_old_connections
+from urllib.parse import parse_qs
+from tenants.access import subscription_error
+from tenants.cache import get_tenant
+from .async_interact import astream_question, afaq_response, arule_response, InferenceBusy
+from .nlp import InferenceUnavailable
+from .views import faq_reply, INVALID_OPTION_REPLY, BUSY_REPLY
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = '/ws/chat/'
+
+# application close codes (4000-4999), mirroring the HTTP status of /interact/
+CLOSE_PAYMENT_REQUIRED = 4402
+CLOSE_NOT_FOUND = 4404
+
+
+async def in_request_context(func, *args):
+    '''
+    runs a coroutine the way django runs an ASGI request: its sync (ORM) calls
+    share one thread of their own and stale connections are closed afterwards.
+    '''
+    async with ThreadSensitiveContext():
+        try:
+            return await func(*args)
+        finally:
+            await sync_to_async(close_old_connections)()
+
+def authorize(client_id):
+    '''(tenant, None, None) or (None, error message, close code)'''
+    tenant = get_tenant(client_id) if client_id else None
+    if tenant is None:
+        return None, f"Client with ID '{client_id}' does not exist.", CLOSE_NOT_FOUND
+
+    error = subscription_error(tenant)
+    if error:
+        return None, error, CLOSE_PAYMENT_REQUIRED
+
+    return tenant, None, None
+
+async def send_event(send, event, message_id=None, **fields):
+    await send({'type': 'websocket.send', 'text': json.dumps({"event": event, "id": message_id, **fields})})
+
+async def close_with_error(send, error, close_code):
+    await send_event(send, 'error', status=close_code - 4000, data={"answer": error})
+    await send({'type': 'websocket.close', 'code': close_code})
+
+
+async def chat_websocket(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    client_id = parse_qs(scope.get('query_string', b'').decode()).get('client', [''])[0]
+
+    tenant, error, close_code = await in_request_context(sync_to_async(authorize), client_id)
+
+    # accepted first so the widget can read why it was turned away
+    await send({'type': 'websocket.accept'})
+    if error:
+        await close_with_error(send, error, close_code)
+        return
+
+    while True:
+        event = await receive()
+
+        if event['type'] == 'websocket.disconnect':
+            return
+        if event['type'] != 'websocket.receive':
+            continue
+
+        text = event.get('text')
+        if text is None:
+            text = (event.get('bytes') or b'').decode('utf-8', 'replace')
+
+        # the session may outlive the subscription (cancelled, expired, deactivated)
+        tenant, error, close_code = await in_request_context(sync_to_async(authorize), tenant.schema_name)
+        if error:
+            await close_with_error(send, error, close_code)
+            return
+
+        await in_request_context(handle_message, tenant, text, send)
+
+async def handle_message(tenant, text, send):
+    try:
+        message = json.loads(text)
+    except ValueError:
+        message = None
+
+    if not isinstance(message, dict):
+        await send_event(send, 'error', status=400, data={"answer": "Invalid message."})
+        return
+
+    message_id = message.get('id')
+    interaction_type = message.get('type', 'text')
+    payload = message.get('payload')
+
+    if not payload or not isinstance(payload, str) or len(payload) > settings.CHATBOT_WS_MAX_PAYLOAD:
+        await send_event(send, 'error', message_id, status=400, data={"answer": "No input received."})
+        return
+
+    await send_event(send, 'ack', message_id)
+
+    async def emit(event, data):
+        await send_event(send, event, message_id, data=data)
+
+    try:
+        if interaction_type == 'text':
+            best_faq, suggestions = await astream_question(tenant, payload, emit, k=settings.CHATBOT_STREAM_CANDIDATES)
+            body, status = faq_reply(best_faq, suggestions)
+            await send_event(send, 'answer', message_id, status=status, data=body)
+
+        elif interaction_type == 'faq':
+            faq = await afaq_response(tenant, payload)
+            if faq is None:
+                await send_event(send, 'error', message_id, status=404, data=INVALID_OPTION_REPLY)
+            else:
+                body, status = faq_reply(faq)
+                await send_event(send, 'answer', message_id, status=status, data=body)
+
+        elif interaction_type == 'rule':
+            response = await arule_response(tenant, payload)
+            if response is None:
+                await send_event(send, 'error', message_id, status=404, data=INVALID_OPTION_REPLY)
+            else:
+                await send_event(send, 'answer', message_id, status=200, data=response)
+
+        else:
+            await send_event(send, 'error', message_id, status=400, data={"answer": "Unknown interaction type."})
+
+    except InferenceBusy:
+        await send_event(send, 'error', message_id, status=503, data=BUSY_REPLY)
+    except InferenceUnavailable:
+        body, status = faq_reply(None, unavailable=True)
+        await send_event(send, 'error', message_id, status=status, data=body)
+    except Exception:
+        # one bad message must not end the chat session
+        logger.exception('Chat WebSocket message failed (tenant %s)', tenant.schema_name)
+        await send_event(send, 'error', message_id, status=500, data={
+            "answer": "Sorry, something went wrong. Please try again."
+        })
@@ -3,6 +3,8 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+    uvicorn config.config.asgi:application --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,6 +14,22 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.config.settings')
+# serve /api/v1/interact/ with the async view (chatbot.views.AsyncChatbotInteractView)
+os.environ.setdefault('CHATBOT_ASYNC_INTERACT', '1')
+
+
+django_application = get_asgi_application()
+
+# imported once the app registry is ready
+from chatbot.websocket import chat_websocket, CHAT_PATH
+
 
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == CHAT_PATH:
+            return await chat_websocket(scope, receive, send)
+        # no other WebSocket routes
+        await receive()
+        return await send({'type': 'websocket.close'})
 
-application = get_asgi_application()
+    return await django_application(scope, receive, send)
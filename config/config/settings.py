@@ -95,7 +95,7 @@ WSGI_APPLICATION = 'config.config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django_tenants.postgresql_backend',
+        'ENGINE': 'config.tenants.postgresql_backend',
         'NAME': 'chatter_platform',
         'USER': 'postgres',      
         'PASSWORD': 'Saas_tenant', 
@@ -210,3 +210,134 @@ RAZORPAY_KEY_SECRET = '7l1hZwaqZDrYVNu1NdWeegiO'
 
 # this is to be added later in live mode
 RAZORPAY_WEBHOOK_SECRET = 'a-line-of-control-for-payments'
+
+# --- NLP / FAQ SEARCH ---
+# 'exact' scans every FAQ vector, 'ivf' is an approximate index for large corpora
+# (a dotted path to a chatbot.nlp.SearchBackend subclass also works)
+NLP_SEARCH_BACKEND = os.environ.get('NLP_SEARCH_BACKEND', 'exact')
+
+# where the ivf backend persists one index file per tenant schema
+NLP_INDEX_DIR = os.environ.get('NLP_INDEX_DIR', os.path.join(BASE_DIR, 'var', 'faq_index'))
+
+# number of ivf clusters scanned per query, higher = better recall, slower search
+NLP_IVF_NPROBE = int(os.environ.get('NLP_IVF_NPROBE', 16))
+
+# storage format of FAQ.question_vector: 'float32' (exact), 'float16' (half size)
+# or 'int8' (quarter size, small precision loss). Rows of mixed formats can coexist.
+NLP_VECTOR_DTYPE = os.environ.get('NLP_VECTOR_DTYPE', 'float32')
+
+# sentence-transformers model used for FAQ embeddings, loaded lazily on first use
+NLP_MODEL_NAME = os.environ.get('NLP_MODEL_NAME', 'all-MiniLM-L6-v2')
+
+# load the model in ChatbotConfig.ready() (set by gunicorn.conf.py so preloaded workers share it)
+NLP_PRELOAD_MODEL = os.environ.get('NLP_PRELOAD_MODEL', '') == '1'
+
+# after a failed load, NLP stays unavailable for this long before retrying
+NLP_MODEL_RETRY_SECONDS = int(os.environ.get('NLP_MODEL_RETRY_SECONDS', 60))
+
+# torch intra-op threads per worker process
+NLP_TORCH_THREADS = int(os.environ.get('NLP_TORCH_THREADS', 1))
+
+# optional out-of-process embedding server (manage.py run_embedding_server),
+# e.g. http://127.0.0.1:8765. Empty = every worker embeds in-process.
+NLP_EMBEDDING_SERVER_URL = os.environ.get('NLP_EMBEDDING_SERVER_URL', '')
+NLP_EMBEDDING_SERVER_TIMEOUT = float(os.environ.get('NLP_EMBEDDING_SERVER_TIMEOUT', 2))
+NLP_EMBEDDING_SERVER_RETRY_SECONDS = int(os.environ.get('NLP_EMBEDDING_SERVER_RETRY_SECONDS', 30))
+# use the in-process model when the server is down
+NLP_EMBEDDING_SERVER_FALLBACK = os.environ.get('NLP_EMBEDDING_SERVER_FALLBACK', '1') == '1'
+NLP_EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get('NLP_EMBEDDING_MAX_BATCH_SIZE', 32))
+NLP_EMBEDDING_MAX_WAIT_MS = float(os.environ.get('NLP_EMBEDDING_MAX_WAIT_MS', 5))
+
+# cache of question text -> embedding and (tenant, question) -> answer in front of the encoder
+NLP_QUERY_CACHE_SIZE = int(os.environ.get('NLP_QUERY_CACHE_SIZE', 4096))
+NLP_QUERY_CACHE_TTL = int(os.environ.get('NLP_QUERY_CACHE_TTL', 3600))
+# optional CACHES alias (e.g. a redis cache) shared by all workers, empty = per-process only
+NLP_QUERY_CACHE_BACKEND = os.environ.get('NLP_QUERY_CACHE_BACKEND', '')
+# seconds a worker trusts the version tokens (chatbot_cacheversion) of the FAQ index and flow
+# graph it holds in memory: edits made by other processes show up at the latest after this long
+CHATBOT_VERSION_TTL = float(os.environ.get('CHATBOT_VERSION_TTL', 2))
+
+# hybrid matching, defaults for tenants without their own Client.match_threshold / lexical_weight
+NLP_CONFIDENCE_THRESHOLD = float(os.environ.get('NLP_CONFIDENCE_THRESHOLD', 0.5))
+NLP_LEXICAL_WEIGHT = float(os.environ.get('NLP_LEXICAL_WEIGHT', 0.3))
+# vector and BM25 candidates fused per question
+NLP_HYBRID_CANDIDATES = int(os.environ.get('NLP_HYBRID_CANDIDATES', 10))
+# below the threshold, up to NLP_SUGGESTIONS FAQs scoring at least NLP_SUGGESTION_THRESHOLD are offered as "did you mean"
+NLP_SUGGESTIONS = int(os.environ.get('NLP_SUGGESTIONS', 3))
+NLP_SUGGESTION_THRESHOLD = float(os.environ.get('NLP_SUGGESTION_THRESHOLD', 0.3))
+# questions accepted by one /api/v1/interact/batch/ request
+NLP_BATCH_MAX_MESSAGES = int(os.environ.get('NLP_BATCH_MAX_MESSAGES', 256))
+# also index FAQ answers in the BM25 index, their words count NLP_LEXICAL_ANSWER_WEIGHT of a question word
+NLP_LEXICAL_INCLUDE_ANSWERS = os.environ.get('NLP_LEXICAL_INCLUDE_ANSWERS', '') == '1'
+NLP_LEXICAL_ANSWER_WEIGHT = float(os.environ.get('NLP_LEXICAL_ANSWER_WEIGHT', 0.3))
+
+# embed FAQ questions in the background (manage.py embedding_worker) instead of inside the save request
+NLP_ASYNC_EMBEDDING = os.environ.get('NLP_ASYNC_EMBEDDING', '') == '1'
+# FAQs per encode call for the embedding worker and the bulk import endpoint
+NLP_EMBEDDING_BATCH_SIZE = int(os.environ.get('NLP_EMBEDDING_BATCH_SIZE', 64))
+NLP_IMPORT_BATCH_SIZE = int(os.environ.get('NLP_IMPORT_BATCH_SIZE', 256))
+NLP_IMPORT_MAX_ROWS = int(os.environ.get('NLP_IMPORT_MAX_ROWS', 10000))
+
+# --- TENANT RESOLUTION CACHE ---
+# resolved X-Client-ID -> client/subscription/plan snapshots kept per process
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', 2048))
+TENANT_CACHE_TTL = int(os.environ.get('TENANT_CACHE_TTL', 30))
+# optional CACHES alias shared by all workers, empty = per-process only
+TENANT_CACHE_BACKEND = os.environ.get('TENANT_CACHE_BACKEND', '')
+
+# --- ANALYTICS ---
+# buffer interaction events in memory and write them in batches (off the request path)
+ANALYTICS_BUFFER_ENABLED = os.environ.get('ANALYTICS_BUFFER_ENABLED', '1') == '1'
+# events kept in memory at most, newer events are dropped (and counted) beyond this
+ANALYTICS_BUFFER_SIZE = int(os.environ.get('ANALYTICS_BUFFER_SIZE', 10000))
+# flush as soon as this many events are waiting, or every ANALYTICS_FLUSH_INTERVAL seconds
+ANALYTICS_FLUSH_SIZE = int(os.environ.get('ANALYTICS_FLUSH_SIZE', 200))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 2))
+# rule node ids counted separately in the daily rollups (dashboard "chats started" / "redirects")
+ANALYTICS_ROLLUP_RULE_KEYS = ['welcome_node', 'show_form']
+# raw AnalyticsLog rows older than this are archived and deleted by manage.py archive_analytics
+ANALYTICS_RETENTION_DAYS = int(os.environ.get('ANALYTICS_RETENTION_DAYS', 365))
+ANALYTICS_ARCHIVE_DIR = os.environ.get('ANALYTICS_ARCHIVE_DIR', os.path.join(BASE_DIR, 'var', 'analytics_archive'))
+
+# --- WIDGET ---
+# browser cache lifetime (seconds) of /api/v1/widget/bootstrap/, revalidated with its ETag afterwards
+WIDGET_BOOTSTRAP_MAX_AGE = int(os.environ.get('WIDGET_BOOTSTRAP_MAX_AGE', 3600))
+
+# --- ASYNC INTERACT ---
+# /api/v1/interact/ is served by the async view, set by asgi.py (uvicorn config.config.asgi:application)
+CHATBOT_ASYNC_INTERACT = os.environ.get('CHATBOT_ASYNC_INTERACT', '') == '1'
+# threads the async path encodes questions in, and how many more may wait before answering 503
+NLP_INFERENCE_WORKERS = int(os.environ.get('NLP_INFERENCE_WORKERS', 2))
+NLP_INFERENCE_QUEUE_SIZE = int(os.environ.get('NLP_INFERENCE_QUEUE_SIZE', 64))
+# chat WebSocket (/ws/chat/, ASGI only): candidates sent before the answer, max message length
+CHATBOT_STREAM_CANDIDATES = int(os.environ.get('CHATBOT_STREAM_CANDIDATES', 3))
+CHATBOT_WS_MAX_PAYLOAD = int(os.environ.get('CHATBOT_WS_MAX_PAYLOAD', 2000))
+
+# --- REQUEST INSTRUMENTATION ---
+# per request stage timings and SQL counts in a Server-Timing header and the /metrics/ aggregates
+# (tenants/instrumentation.py). Off by default, it adds a little work to every request.
+REQUEST_INSTRUMENTATION = os.environ.get('REQUEST_INSTRUMENTATION', '') == '1'
+if REQUEST_INSTRUMENTATION:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('config.tenants.middleware.HeaderTenantMiddleware'),
+        'config.tenants.middleware.RequestInstrumentationMiddleware',
+    )
+# bearer token a scraper has to send to read /metrics/ (only routed with REQUEST_INSTRUMENTATION),
+# without one the endpoint answers 404
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# share of the instrumented (sync) requests run under cProfile, the stats of those
+# slower than REQUEST_PROFILE_SLOW_MS are written to REQUEST_PROFILE_DIR
+REQUEST_PROFILE_SAMPLE_RATE = float(os.environ.get('REQUEST_PROFILE_SAMPLE_RATE', 0))
+REQUEST_PROFILE_SLOW_MS = float(os.environ.get('REQUEST_PROFILE_SLOW_MS', 500))
+REQUEST_PROFILE_DIR = os.environ.get('REQUEST_PROFILE_DIR', os.path.join(BASE_DIR, 'var', 'profiles'))
+
+# --- DATABASE CONNECTIONS ---
+# config.tenants.postgresql_backend only sends SET search_path when the session's tenant changes,
+# which pays off once connections outlive the request. Seconds a connection is kept (0 = one per
+# request); the default is 0 under ASGI, where every request runs in threads of its own and
+# persistent connections would pile up (put pgbouncer in front instead).
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 0 if CHATBOT_ASYNC_INTERACT else 60))
+# check a kept connection before the first query of a request instead of failing it
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1'
+# pgbouncer in front of postgres has to run in session pooling mode: in transaction mode a
+# statement can land on a server connection whose search_path another tenant's request set
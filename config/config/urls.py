@@ -21,6 +21,7 @@ from django.urls import path, include, re_path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.views.generic.base import RedirectView
 from django.views.generic import TemplateView
+from tenants.instrumentation import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -37,6 +38,10 @@ urlpatterns = [
 
 ]
 
+if settings.REQUEST_INSTRUMENTATION:
+    # ahead of the dashboard catch-all
+    urlpatterns.insert(-1, path('metrics/', metrics_view, name='metrics'))
+
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS)
 
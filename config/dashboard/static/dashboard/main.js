@@ -173,7 +173,14 @@ const api = {
   deleteRule: (id) => api.request("DELETE", `/api/v1/rules/${id}/`),
 
   // Submission Endpoints
-  getSubmissions: () => api.request("GET", "/api/v1/submissions/"),
+  // paginated: returns { next, previous, results }, pass `next` back in for the following page
+  getSubmissions: (pageUrl) =>
+    api.request(
+      "GET",
+      pageUrl
+        ? new URL(pageUrl).pathname + new URL(pageUrl).search
+        : "/api/v1/submissions/"
+    ),
 
   // Billing Endpoints
   getPlans: () => api.request("GET", "/api/v1/public/plans/"),
@@ -999,27 +1006,10 @@ async function renderSubmissionsViewer(container) {
   container.innerHTML = `<h2 class="text-3xl font-bold mb-6">Form Submissions (Leads)</h2><div id="subs-container">Loading...</div>`;
   const subsContainer = document.getElementById("subs-container");
 
-  try {
-    const submissions = await api.getSubmissions();
-    if (!submissions.length) {
-      subsContainer.innerHTML = `<p class="text-center text-gray-500 mt-4">No submissions yet.</p>`;
-      return;
-    }
-
-    subsContainer.innerHTML = `
-            <div class="dashboard-card overflow-hidden fade-in">
-                <table class="min-w-full" id="data-table">
-                    <thead class="bg-gray-50"><tr class="text-left text-xs font-medium text-gray-500 uppercase">
-                        <th>Submitted On</th>
-                        <th>Name</th>
-                        <th>Email</th>
-                        <th>Phone</th>
-                        <th>Message</th>
-                    </tr></thead>
-                    <tbody class="bg-white divide-y divide-gray-200">
-                        ${submissions
-                          .map(
-                            (s) => `
+  const renderRows = (submissions) =>
+    submissions
+      .map(
+        (s) => `
                             <tr>
                                 <td class="text-sm text-gray-500">${new Date(
                                   s.submitted_at
@@ -1039,11 +1029,51 @@ async function renderSubmissionsViewer(container) {
                                   s.message
                                 }</td>
                             </tr>`
-                          )
-                          .join("")}
+      )
+      .join("");
+
+  try {
+    const page = await api.getSubmissions();
+    if (!page.results.length) {
+      subsContainer.innerHTML = `<p class="text-center text-gray-500 mt-4">No submissions yet.</p>`;
+      return;
+    }
+
+    subsContainer.innerHTML = `
+            <div class="dashboard-card overflow-hidden fade-in">
+                <table class="min-w-full" id="data-table">
+                    <thead class="bg-gray-50"><tr class="text-left text-xs font-medium text-gray-500 uppercase">
+                        <th>Submitted On</th>
+                        <th>Name</th>
+                        <th>Email</th>
+                        <th>Phone</th>
+                        <th>Message</th>
+                    </tr></thead>
+                    <tbody class="bg-white divide-y divide-gray-200" id="subs-rows">
+                        ${renderRows(page.results)}
                     </tbody>
                 </table>
+            </div>
+            <div class="text-center mt-4">
+                <button id="subs-load-more" class="text-blue-600 hover:underline">Load more</button>
             </div>`;
+
+    const rows = document.getElementById("subs-rows");
+    const loadMoreBtn = document.getElementById("subs-load-more");
+    let nextPage = page.next;
+    loadMoreBtn.style.display = nextPage ? "inline" : "none";
+
+    loadMoreBtn.onclick = async () => {
+      loadMoreBtn.disabled = true;
+      try {
+        const more = await api.getSubmissions(nextPage);
+        rows.insertAdjacentHTML("beforeend", renderRows(more.results));
+        nextPage = more.next;
+      } finally {
+        loadMoreBtn.disabled = false;
+        loadMoreBtn.style.display = nextPage ? "inline" : "none";
+      }
+    };
   } catch (err) {
     subsContainer.innerHTML = `<p class="text-red-500">Error loading submissions: ${err.message}</p>`;
   }
@@ -0,0 +1,53 @@
+"""
+Gunicorn settings for the chatbot platform.
+
+    gunicorn config.config.wsgi:application -c config/gunicorn.conf.py
+
+With preload_app the master imports Django and loads the embedding model
+once (ChatbotConfig.ready, NLP_PRELOAD_MODEL). Workers are forked from it
+and share the read-only model weights copy-on-write instead of each
+loading their own ~100MB copy.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+
+os.environ.setdefault('NLP_PRELOAD_MODEL', '1')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+timeout = 60
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def pre_fork(server, worker):
+    # move everything loaded so far into the permanent generation, otherwise the
+    # gc of each worker touches (and therefore copies) the shared object pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from django.conf import settings
+    from chatbot.nlp import embedding_model
+
+    try:
+        import torch
+        # N workers each running a full size intra-op pool would oversubscribe the cores
+        torch.set_num_threads(settings.NLP_TORCH_THREADS)
+    except ImportError:
+        pass
+
+    # the first encode allocates per-process buffers; doing it here (and not in the
+    # master) keeps torch's thread pools from being created before the fork
+    embedding_model.warm_up()
+    logger.info('worker nlp stats: %s', embedding_model.stats())
+
+
+def worker_exit(server, worker):
+    # write the analytics events still buffered in this worker
+    from chatbot.analytics import get_buffer
+    get_buffer().shutdown()
@@ -0,0 +1,41 @@
+"""
+Plan and subscription checks for the public (widget) endpoints.
+
+Shared by HeaderTenantMiddleware and the chat WebSocket (chatbot/websocket.py),
+which does not go through the middleware. Each check returns an error message
+for a 402 answer, or None when the request may go ahead.
+"""
+from django.utils import timezone
+from chatbot import usage
+
+# widget facing paths that require an active subscription
+PUBLIC_API_PREFIXES = ('/api/v1/interact', '/api/v1/widget', 'api/v1/submissions')
+
+def is_public_api(path):
+    return path.startswith(PUBLIC_API_PREFIXES)
+
+def subscription_error(tenant):
+    subscription = tenant.subscription
+
+    if not subscription:
+        return "No subscription found. Please subscribe."
+
+    if not subscription.active:
+        return "Subscription is inactive. Please contact support."
+
+    if subscription.expires_on and subscription.expires_on < timezone.now().date():
+        subscription.active = False
+        subscription.save()
+        return "Subscription has expired. Please renew."
+
+    return None
+
+def lead_limit_error(tenant):
+    '''needs the tenant's schema to be active (reads its usage counters)'''
+    if tenant.subscription and tenant.subscription.plan:
+        plan = tenant.subscription.plan
+
+        if usage.leads_this_month() >= plan.max_leads:
+            return f"Monthly lead limit of {plan.max_leads} reached for your plan. Please upgrade."
+
+    return None
@@ -19,6 +19,10 @@ class ClientAdmin(admin.ModelAdmin):
             'description':"Link the client to their subscription object. (Create the Subscription object first)",
             'fields':('subscription',)
         }), 
+        ('FAQ Matching',{
+            'description':"Leave empty to use the platform defaults.",
+            'fields':('match_threshold','lexical_weight')
+        }),
     )
 @admin.register(Domain)
 class DomainAdmin(admin.ModelAdmin):
@@ -5,3 +5,7 @@ class TenantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'config.tenants'
     label = 'tenants'
+
+    def ready(self):
+        # evicts cached tenant snapshots when a client, subscription or plan changes
+        from . import signals  # noqa: F401
@@ -0,0 +1,49 @@
+"""
+Cache of resolved tenants for HeaderTenantMiddleware.
+
+Every widget message carries an X-Client-ID header; instead of loading the
+Client + Subscription + Plan rows for each of them, the snapshot is kept in
+a process-local TTL cache (optionally backed by a shared django cache, see
+TENANT_CACHE_BACKEND). Saves and deletes of Client, Subscription and Plan
+evict the affected entries (tenants/signals.py); other processes pick the
+change up at the latest after TENANT_CACHE_TTL seconds.
+"""
+from django.conf import settings
+from chatbot.cache import TieredCache
+from .models import Client
+
+# cached for unknown ids too, so a bad header cannot hammer the database
+NOT_FOUND = False
+
+_tenants = None
+
+def _get_cache():
+    global _tenants
+
+    if _tenants is None:
+        _tenants = TieredCache(
+            'tenants:client',
+            maxsize=settings.TENANT_CACHE_SIZE,
+            ttl=settings.TENANT_CACHE_TTL,
+            shared_alias=settings.TENANT_CACHE_BACKEND or None,
+        )
+
+    return _tenants
+
+def get_tenant(schema_name):
+    '''returns the Client (with subscription and plan loaded) or None if it does not exist'''
+    cache = _get_cache()
+    tenant = cache.get(schema_name)
+
+    if tenant is None:
+        tenant = Client.objects.select_related('subscription', 'subscription__plan').filter(
+            schema_name=schema_name
+        ).first() or NOT_FOUND
+        cache.set(schema_name, tenant)
+
+    return tenant or None
+
+def invalidate_tenant(*schema_names):
+    cache = _get_cache()
+    for schema_name in schema_names:
+        cache.delete(schema_name)
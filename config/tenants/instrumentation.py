@@ -0,0 +1,317 @@
+"""
+Opt-in request instrumentation (REQUEST_INSTRUMENTATION=1), recorded by
+RequestInstrumentationMiddleware.
+
+While a request is handled its timings live in a context variable, so the
+code on its path only marks stages:
+
+    with stage('embed'):
+        vectors = model.encode(...)
+
+and every SQL statement is counted by an execute wrapper installed on each
+new database connection. Both work the same under WSGI and ASGI (the
+context is copied into sync_to_async threads) and cost next to nothing
+when instrumentation is off.
+
+Per request the stages end up in the Server-Timing header, and aggregated
+per process in the Prometheus text served by metrics_view (/metrics/, only
+routed while instrumentation is on and readable with the METRICS_TOKEN
+bearer token). With several gunicorn workers each scrape sees the worker
+that answered it, the `pid` label tells them apart.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+
+_current = ContextVar('request_timings', default=None)
+
+# upper bounds (seconds) of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTimings:
+    '''stage durations and SQL statements of one request'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.schema_name = None
+
+    def add(self, name, seconds):
+        total, count = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        '''Server-Timing header value, durations in ms'''
+        metrics = [f'{name};dur={seconds * 1000:.2f}' for name, (seconds, _) in self.stages.items()]
+        metrics.append(f'db;dur={self.query_seconds * 1000:.2f};desc="{self.queries} queries"')
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def current_timings():
+    return _current.get()
+
+@contextmanager
+def stage(name):
+    '''times the block as `name` when the request is instrumented (also usable as a decorator)'''
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+def count_query(execute, sql, params, many, context):
+    '''execute wrapper: adds the statement to the timings of the request it runs for'''
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.query_seconds += time.perf_counter() - started
+
+def _install_query_counter(sender, connection, **kwargs):
+    # connection_created fires again on every reconnect of the same wrapper
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+def install():
+    connection_created.connect(_install_query_counter, dispatch_uid='request_instrumentation')
+    # connections this thread opened before (connections are per thread, later ones get the signal)
+    for connection in connections.all(initialized_only=True):
+        _install_query_counter(None, connection)
+
+
+class Metrics:
+    '''process wide aggregates of the instrumented requests'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}      # (view, method, status) -> count
+        self.durations = {}     # view -> [bucket counts..., sum, count]
+        self.queries = {}       # view -> [statements, seconds]
+        self.stages = {}        # stage -> [seconds, count]
+        self.tenants = {}       # schema -> [requests, seconds]
+        self.profiles = 0
+
+    def observe(self, view, method, status, timings, total):
+        with self._lock:
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            histogram = self.durations.setdefault(view, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    histogram[i] += 1
+            histogram[-2] += total
+            histogram[-1] += 1
+
+            queries = self.queries.setdefault(view, [0, 0.0])
+            queries[0] += timings.queries
+            queries[1] += timings.query_seconds
+
+            for name, (seconds, count) in timings.stages.items():
+                totals = self.stages.setdefault(name, [0.0, 0])
+                totals[0] += seconds
+                totals[1] += count
+
+            if timings.schema_name:
+                tenant = self.tenants.setdefault(timings.schema_name, [0, 0.0])
+                tenant[0] += 1
+                tenant[1] += total
+
+    def render(self):
+        '''Prometheus text exposition format'''
+        pid = os.getpid()
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def sample(name, labels, value):
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in {'pid': pid, **labels}.items())
+            lines.append(f'{name}{{{label_text}}} {value}')
+
+        def metric(name, kind, help_text, samples):
+            header(name, kind, help_text)
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        with self._lock:
+            metric('chatbot_requests_total', 'counter', 'Instrumented requests.', [
+                ({'view': view, 'method': method, 'status': status}, count)
+                for (view, method, status), count in sorted(self.requests.items())
+            ])
+
+            header('chatbot_request_duration_seconds', 'histogram', 'Request duration.')
+            for view, histogram in sorted(self.durations.items()):
+                for i, bound in enumerate(DURATION_BUCKETS):
+                    sample('chatbot_request_duration_seconds_bucket', {'view': view, 'le': bound}, histogram[i])
+                sample('chatbot_request_duration_seconds_bucket', {'view': view, 'le': '+Inf'}, histogram[-1])
+                sample('chatbot_request_duration_seconds_sum', {'view': view}, f'{histogram[-2]:.6f}')
+                sample('chatbot_request_duration_seconds_count', {'view': view}, histogram[-1])
+
+            metric('chatbot_request_queries_total', 'counter', 'SQL statements run by requests.', [
+                ({'view': view}, statements) for view, (statements, _) in sorted(self.queries.items())
+            ])
+            metric('chatbot_request_query_seconds_total', 'counter', 'Time requests spent in SQL statements.', [
+                ({'view': view}, f'{seconds:.6f}') for view, (_, seconds) in sorted(self.queries.items())
+            ])
+            metric('chatbot_request_stage_seconds_total', 'counter', 'Time spent per request stage.', [
+                ({'stage': name}, f'{seconds:.6f}') for name, (seconds, _) in sorted(self.stages.items())
+            ])
+            metric('chatbot_request_stage_total', 'counter', 'Times each request stage ran.', [
+                ({'stage': name}, count) for name, (_, count) in sorted(self.stages.items())
+            ])
+            metric('chatbot_tenant_requests_total', 'counter', 'Instrumented requests per tenant schema.', [
+                ({'tenant': schema}, count) for schema, (count, _) in sorted(self.tenants.items())
+            ])
+            metric('chatbot_tenant_request_seconds_total', 'counter', 'Request time per tenant schema.', [
+                ({'tenant': schema}, f'{seconds:.6f}') for schema, (_, seconds) in sorted(self.tenants.items())
+            ])
+            metric('chatbot_request_profiles_total', 'counter', 'cProfile dumps written for slow requests.', [
+                ({}, self.profiles)
+            ])
+
+        from chatbot import analytics
+        if analytics._buffer is not None:
+            stats = analytics._buffer.stats()
+            metric('chatbot_analytics_events_total', 'counter', 'Analytics events by outcome.', [
+                ({'state': state}, stats[state]) for state in ('recorded', 'flushed', 'dropped', 'failed')
+            ])
+            metric('chatbot_analytics_buffered_events', 'gauge', 'Analytics events waiting to be written.', [
+                ({}, stats['buffered'])
+            ])
+
+        # counts of config.tenants.postgresql_backend, absent with another ENGINE
+        search_path_stats = getattr(connections['default'], 'search_path_stats', None)
+        if search_path_stats is not None:
+            counts = search_path_stats.snapshot()
+            metric('chatbot_db_search_path_total', 'counter', 'SET search_path statements sent and skipped.', [
+                ({'result': result}, counts[result]) for result in ('sent', 'skipped')
+            ])
+            metric('chatbot_db_connections_opened_total', 'counter', 'Database connections opened.', [
+                ({}, counts['connections'])
+            ])
+
+        from chatbot.nlp import _memory_usage
+        metric('chatbot_process_memory_megabytes', 'gauge', 'Memory of this worker process.', [
+            ({'kind': key[:-3]}, f'{value:.1f}') for key, value in _memory_usage().items()
+        ])
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
+
+
+def metrics_view(request):
+    '''
+    the process metrics for a scraper sending `Authorization: Bearer <METRICS_TOKEN>`,
+    404 for anyone else. the peer address proves nothing behind a local proxy.
+    '''
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class Profiler:
+    '''
+    cProfile for a sample (REQUEST_PROFILE_SAMPLE_RATE) of the requests; the
+    stats of those slower than REQUEST_PROFILE_SLOW_MS are written to
+    REQUEST_PROFILE_DIR, readable with `python -m pstats <file>`. One
+    request per process is profiled at a time, the profiler is per
+    interpreter.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def start(self):
+        '''a running profiler for this request, or None'''
+        rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        if not rate or random.random() >= rate or not self._lock.acquire(blocking=False):
+            return None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active in this process
+            self._lock.release()
+            return None
+        return profiler
+
+    def stop(self, profiler):
+        profiler.disable()
+        self._lock.release()
+
+    def dump(self, profiler, request, timings, total):
+        '''writes the stats of a stopped profiler if the request was slow'''
+        if total * 1000 < settings.REQUEST_PROFILE_SLOW_MS:
+            return
+
+        directory = Path(settings.REQUEST_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path_slug = re.sub(r'[^\w]+', '-', request.path).strip('-') or 'root'
+        name = (f"{timezone.now():%Y%m%dT%H%M%S}-{os.getpid()}-{timings.schema_name or 'public'}-"
+                f"{path_slug}-{total * 1000:.0f}ms.prof")
+        profiler.dump_stats(directory / name)
+        with metrics._lock:
+            metrics.profiles += 1
+
+profiler = Profiler()
+
+
+def begin_request():
+    '''starts collecting for the current context, returns (timings, token for end_request)'''
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+def end_request(token):
+    _current.reset(token)
+
+def record_request(request, response, timings):
+    '''adds the finished request to the metrics and its Server-Timing header, returns its duration'''
+    total = timings.elapsed()
+
+    tenant = getattr(request, 'tenant', None)
+    timings.schema_name = getattr(tenant, 'schema_name', None)
+
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match is not None else 'unresolved'
+    metrics.observe(view, request.method, response.status_code, timings, total)
+
+    response['Server-Timing'] = timings.server_timing(total)
+    return total
@@ -1,8 +1,11 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.db import connection
-from django.utils import timezone
 from django.http import Http404, JsonResponse
-from .models import Client
-from chatbot.models import FormSubmission
+from .access import is_public_api, subscription_error, lead_limit_error
+from .cache import get_tenant
+# absolute like in the chatbot app, so the stages recorded there land in the same context variable
+from tenants import instrumentation
+from tenants.instrumentation import stage
 
 class HeaderTenantMiddleware:
     """
@@ -10,52 +13,113 @@ class HeaderTenantMiddleware:
     """
     
     
+    sync_capable = True
+    async_capable = True
+
     def __init__(self,get_response):
         self.get_response = get_response
+        # under ASGI the async views (CHATBOT_ASYNC_INTERACT) are reached
+        # without a sync hop, the tenant lookup itself runs in a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        error_response = self.activate_tenant(request)
+        if error_response is not None:
+            return error_response
+        
+        response = self.get_response(request)
+
+        connection.set_schema_to_public()
+        return response
+
+    async def __acall__(self, request):
+        error_response = await sync_to_async(self.activate_tenant)(request)
+        if error_response is not None:
+            return error_response
+
+        response = await self.get_response(request)
+
+        await sync_to_async(connection.set_schema_to_public)()
+        return response
+
+    @stage('tenant')
+    def activate_tenant(self, request):
+        """
+        Sets the tenant of the X-Client-ID header on the connection and the request.
+        Returns an error response when the request must not go further.
+        """
         connection.set_schema_to_public()
         client_id_header = request.headers.get('X-Client-ID')
         
         if not client_id_header:
-            return self.get_response(request)
+            return None
         
-        try:
-            tenant = Client.objects.select_related('subscription','subscription__plan').get(schema_name=client_id_header)
-        except Client.DoesNotExist:
+        tenant = get_tenant(client_id_header)
+        if tenant is None:
             return JsonResponse({"error": f"Client with ID '{client_id_header}' does not exist."}, status=404)
 
-        is_public_api = request.path.startswith('/api/v1/interact') or \
-                            request.path.startswith('api/v1/submissions')
-        
-        if is_public_api:
-            subscription = tenant.subscription
-
-            if not subscription:
-                return JsonResponse({"error": "No subscription found. Please subscribe."}, status=402) # 402 Payment Required
-            
-            if not subscription.active:
-                return JsonResponse({"error": "Subscription is inactive. Please contact support."}, status=402)
-            
-            if subscription.expires_on and subscription.expires_on < timezone.now().date():
-                subscription.active= False
-                subscription.save()
-                return JsonResponse({"error": "Subscription has expired. Please renew."}, status=402)
+        if is_public_api(request.path):
+            error = subscription_error(tenant)
+            if error:
+                return JsonResponse({"error": error}, status=402) # 402 Payment Required
         
         connection.set_tenant(tenant)
         request.tenant = tenant
 
         if request.path.startswith('/api/v1/submissions/') and request.method == 'POST':
-            if tenant.subscription and tenant.subscription.plan:
-                plan = tenant.subscription.plan
-
-                current_leads = FormSubmission.objects.count()
-                if current_leads >= plan.max_leads:
-                    return JsonResponse({
-                        "error": f"Lead limit of {plan.max_leads} reached for your plan. Please upgrade."
-                    }, status=402)
-        
-        response = self.get_response(request)
+            error = lead_limit_error(tenant)
+            if error:
+                return JsonResponse({"error": error}, status=402)
 
-        connection.set_schema_to_public()
-        return response
\ No newline at end of file
+        return None
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Opt-in (REQUEST_INSTRUMENTATION=1) per request timings, placed in front of
+    HeaderTenantMiddleware: stage durations and SQL statements go to the
+    Server-Timing header and the /metrics/ aggregates, a sample of the sync
+    requests is profiled (see tenants/instrumentation.py).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrumentation.install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings, token = instrumentation.begin_request()
+        profiler = instrumentation.profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.end_request(token)
+            if profiler is not None:
+                instrumentation.profiler.stop(profiler)
+
+        total = instrumentation.record_request(request, response, timings)
+        if profiler is not None:
+            instrumentation.profiler.dump(profiler, request, timings, total)
+        return response
+
+    async def __acall__(self, request):
+        # not profiled: cProfile would only see the event loop thread
+        timings, token = instrumentation.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.end_request(token)
+
+        instrumentation.record_request(request, response, timings)
+        return response
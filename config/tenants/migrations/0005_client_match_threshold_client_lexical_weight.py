@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0004_plan_subscription_client_subscription'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='match_threshold',
+            field=models.FloatField(blank=True, help_text='Minimum match score (0-1) for answering with an FAQ. Empty uses the platform default.', null=True, validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)]),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='lexical_weight',
+            field=models.FloatField(blank=True, help_text='Share (0-1) of keyword overlap in the match score, 0 = semantic only. Empty uses the platform default.', null=True, validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)]),
+        ),
+    ]
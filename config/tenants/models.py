@@ -1,6 +1,7 @@
 from django.db import models
 from django_tenants.models import TenantMixin, DomainMixin
 from django.conf import settings
+from django.core.validators import MinValueValidator, MaxValueValidator
 
 class Plan(models.Model):
     name = models.CharField(max_length=100)
@@ -59,6 +60,19 @@ class Client(TenantMixin):
         help_text="The client's current subscription package."
     )
 
+    # FAQ matching, empty = the platform defaults (NLP_CONFIDENCE_THRESHOLD / NLP_LEXICAL_WEIGHT)
+    match_threshold = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Minimum match score (0-1) for answering with an FAQ. Empty uses the platform default."
+    )
+
+    lexical_weight = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Share (0-1) of keyword overlap in the match score, 0 = semantic only. Empty uses the platform default."
+    )
+
     auto_create_schema = True
 
     def __str__(self):
@@ -0,0 +1,102 @@
+"""
+django-tenants database backend that only sends `SET search_path` when the
+session's path has to change.
+
+HeaderTenantMiddleware switches the connection to the tenant of the request
+and back to public on every request. The stock backend follows each switch
+(and without TENANT_LIMIT_SET_CALLS every cursor) with a SET round trip;
+this wrapper remembers the path the postgres session already has, so with
+persistent connections (DB_CONN_MAX_AGE) statements under an unchanged
+tenant don't repeat it. The remembered path is dropped whenever postgres may
+no longer have it: a new connection, a rollback (SET is transactional) or a
+SET that failed.
+
+search_path is session state. Behind pgbouncer this is only safe in session
+pooling mode, in transaction mode the next statement may run on a server
+connection another client set to its own tenant.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django_tenants.postgresql_backend import base
+import django.db.utils
+import threading
+
+
+class SearchPathStats:
+    '''process wide counts of the search_path statements sent and skipped, and the connections opened'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'sent': 0, 'skipped': 0, 'connections': 0}
+
+    def add(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # False sends the path with every cursor like the stock backend (manage.py benchmark_schema_switch)
+    reuse_search_path = True
+    search_path_stats = SearchPathStats()
+
+    def __init__(self, *args, **kwargs):
+        # the search path the postgres session has, None when unknown
+        self.session_search_path = None
+        super().__init__(*args, **kwargs)
+
+    def get_new_connection(self, conn_params):
+        self.session_search_path = None
+        connection = super().get_new_connection(conn_params)
+        self.search_path_stats.add('connections')
+        return connection
+
+    def close(self):
+        self.session_search_path = None
+        super().close()
+
+    def _rollback(self):
+        # a SET in the rolled back transaction is undone with it
+        self.session_search_path = None
+        super()._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.session_search_path = None
+        super()._savepoint_rollback(sid)
+
+    def _cursor(self, name=None):
+        # the cursor of the original backend, without the search path handling of django-tenants
+        cursor = super(base.DatabaseWrapper, self)._cursor(name=name)
+
+        if not self.schema_name:
+            raise ImproperlyConfigured("Database schema not set. Did you forget "
+                                       "to call set_schema() or set_tenant()?")
+
+        search_paths = self._get_cursor_search_paths()
+        if self.reuse_search_path and search_paths == self.session_search_path:
+            self.search_path_stats.add('skipped')
+            return cursor
+
+        if name or base.is_psycopg3:
+            # named cursors can only be used once, see django-tenants
+            cursor_for_search_path = self.connection.cursor()
+        else:
+            cursor_for_search_path = cursor
+
+        try:
+            formatted_search_paths = ['\'{}\''.format(s) for s in search_paths]
+            cursor_for_search_path.execute('SET search_path = {0}'.format(','.join(formatted_search_paths)))
+        except (django.db.utils.DatabaseError, base.psycopg.InternalError):
+            # the transaction already failed, the statement after this one (if not a rollback) fails too
+            self.session_search_path = None
+        else:
+            self.session_search_path = search_paths
+            self.search_path_stats.add('sent')
+        finally:
+            if name or base.is_psycopg3:
+                cursor_for_search_path.close()
+
+        self.search_path_set_schemas = self.session_search_path
+        return cursor
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .cache import invalidate_tenant
+from .models import Client, Subscription, Plan
+
+def evict(schema_names):
+    '''
+    drops the cached tenants now and again after commit, so a request that
+    cached the pre-commit rows in the meantime doesn't keep them
+    '''
+    schema_names = list(schema_names)
+    invalidate_tenant(*schema_names)
+    transaction.on_commit(lambda: invalidate_tenant(*schema_names))
+
+@receiver([post_save, post_delete], sender=Client)
+def client_changed(sender, instance, **kwargs):
+    evict([instance.schema_name])
+
+# deleting a subscription or plan first sets the references to it to NULL
+# (on_delete=SET_NULL), so its clients are collected before the delete
+@receiver(pre_delete, sender=Subscription)
+def subscription_deleting(sender, instance, **kwargs):
+    instance._tenant_schema_names = list(
+        Client.objects.filter(subscription=instance).values_list('schema_name', flat=True)
+    )
+
+@receiver(pre_delete, sender=Plan)
+def plan_deleting(sender, instance, **kwargs):
+    instance._tenant_schema_names = list(
+        Client.objects.filter(subscription__plan=instance).values_list('schema_name', flat=True)
+    )
+
+@receiver(post_save, sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    evict(Client.objects.filter(subscription=instance).values_list('schema_name', flat=True))
+
+@receiver(post_save, sender=Plan)
+def plan_changed(sender, instance, **kwargs):
+    evict(Client.objects.filter(subscription__plan=instance).values_list('schema_name', flat=True))
+
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=Plan)
+def subscription_or_plan_deleted(sender, instance, **kwargs):
+    evict(getattr(instance, '_tenant_schema_names', ()))
@@ -1,3 +1,151 @@
 from django.test import TestCase
+from tenants.cache import get_tenant, invalidate_tenant
+from tenants.models import Client, Plan, Subscription
 
-# Create your tests here.
+class TenantCacheTestCase(TestCase):
+    """
+    The middleware's tenant lookup hits the database once and is
+    refreshed when the client's subscription or plan changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = Plan.objects.create(name='Starter', price=10, max_faqs=10, max_leads=100)
+        cls.subscription = Subscription.objects.create(plan=cls.plan)
+        cls.client_obj = Client.objects.create(name='Cache Co', schema_name='cache_co', subscription=cls.subscription)
+
+    def setUp(self):
+        invalidate_tenant('cache_co', 'missing_co')
+
+    def test_lookup_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_tenant('cache_co').pk, self.client_obj.pk)
+        with self.assertNumQueries(0):
+            tenant = get_tenant('cache_co')
+            self.assertEqual(tenant.subscription.plan.max_faqs, 10)
+
+    def test_unknown_client_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_tenant('missing_co'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_tenant('missing_co'))
+
+    def test_plan_change_invalidates(self):
+        get_tenant('cache_co')
+        self.plan.max_faqs = 50
+        self.plan.save()
+        self.assertEqual(get_tenant('cache_co').subscription.plan.max_faqs, 50)
+
+    def test_subscription_change_invalidates(self):
+        get_tenant('cache_co')
+        self.subscription.active = False
+        self.subscription.save()
+        self.assertFalse(get_tenant('cache_co').subscription.active)
+
+    def test_subscription_delete_invalidates(self):
+        get_tenant('cache_co')
+        self.subscription.delete()
+        self.assertIsNone(get_tenant('cache_co').subscription)
+
+    def test_plan_delete_invalidates(self):
+        get_tenant('cache_co')
+        self.plan.delete()
+        self.assertIsNone(get_tenant('cache_co').subscription.plan)
+
+    def test_invalidated_again_after_commit(self):
+        from tenants.cache import _get_cache
+
+        stale = get_tenant('cache_co')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subscription.active = False
+            self.subscription.save()
+            # a concurrent request caches the row it still sees before the commit
+            _get_cache().set('cache_co', stale)
+        self.assertFalse(get_tenant('cache_co').subscription.active)
+
+
+class RequestInstrumentationTestCase(TestCase):
+    """
+    Stages and SQL statements of an instrumented request end up in its
+    Server-Timing header and in the /metrics/ aggregates.
+    """
+
+    def test_stages_and_queries_are_reported(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from tenants.instrumentation import stage, metrics
+        from tenants.middleware import RequestInstrumentationMiddleware
+
+        def view(request):
+            with stage('search'):
+                Plan.objects.count()
+            return HttpResponse('ok')
+
+        response = RequestInstrumentationMiddleware(view)(RequestFactory().get('/api/v1/interact/'))
+
+        server_timing = response['Server-Timing']
+        self.assertIn('search;dur=', server_timing)
+        self.assertIn('desc="1 queries"', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+        rendered = metrics.render()
+        self.assertIn('stage="search"', rendered)
+        self.assertIn('chatbot_requests_total{', rendered)
+
+        # outside a request stages are a no-op
+        with stage('search'):
+            pass
+
+    def test_metrics_need_the_token(self):
+        from django.http import Http404
+        from django.test import RequestFactory, override_settings
+        from tenants.instrumentation import metrics_view
+
+        def scrape(**headers):
+            # a local proxy: every client has the loopback address
+            request = RequestFactory().get('/metrics/', REMOTE_ADDR='127.0.0.1', headers=headers)
+            try:
+                return metrics_view(request).status_code
+            except Http404:
+                return 404
+
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(scrape(), 404)
+            self.assertEqual(scrape(authorization='Bearer '), 404)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(scrape(), 404)
+            self.assertEqual(scrape(authorization='Bearer wrong'), 404)
+            self.assertEqual(scrape(authorization='Bearer s3cret'), 200)
+
+
+class SearchPathTestCase(TestCase):
+    """
+    The database backend only sends the search_path when the session's
+    schema changes, and again after a rollback that may have undone it.
+    """
+
+    def test_search_path_sent_on_change(self):
+        from django.db import connection, transaction
+        stats = connection.search_path_stats
+
+        connection.set_schema_to_public()
+        Plan.objects.count()
+        sent = stats.snapshot()['sent']
+
+        # the middleware switches back to public around every request
+        connection.set_schema_to_public()
+        Plan.objects.count()
+        Plan.objects.count()
+        self.assertEqual(stats.snapshot()['sent'], sent)
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            connection.set_schema('other_co')
+            connection.cursor().close()
+            self.assertEqual(stats.snapshot()['sent'], sent + 1)
+            raise ValueError
+
+        connection.set_schema_to_public()
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW search_path')
+            self.assertEqual(cursor.fetchone()[0], "public")
+        self.assertEqual(stats.snapshot()['sent'], sent + 2)
@@ -13,6 +13,11 @@
   const API_INTERACT_URL = `${API_BASE_URL}/api/v1/interact/`;
   // --- NEW: API Endpoint for Form Submission ---
   const API_SUBMIT_URL = `${API_BASE_URL}/api/v1/submissions/`;
+  // Rule flow prefetch (cached by the browser) and analytics for locally rendered clicks
+  const API_BOOTSTRAP_URL = `${API_BASE_URL}/api/v1/widget/bootstrap/`;
+  const API_EVENTS_URL = `${API_BASE_URL}/api/v1/widget/events/`;
+  // Chat session channel on ASGI deployments, fetch to /interact/ is the fallback
+  const WS_CHAT_URL = `${API_BASE_URL.replace(/^http/, "ws")}/ws/chat/?client=${encodeURIComponent(CLIENT_ID)}`;
 
   /* ----------------------------
      Styles (Updated for a professional look)
@@ -375,6 +380,113 @@
   ----------------------------- */
   let chatStarted = false;
 
+  // { entry, nodes: { node_id: rule_data } } from the bootstrap endpoint, null until loaded
+  let flow = null;
+  let pendingEvents = [];
+  let eventsTimer = null;
+
+  async function loadFlow() {
+    try {
+      const response = await fetch(API_BOOTSTRAP_URL, {
+        headers: { "X-Client-ID": CLIENT_ID },
+      });
+      if (response.ok) {
+        flow = await response.json();
+      }
+    } catch (error) {
+      // rule clicks fall back to /interact/
+      console.error("Chatter: could not prefetch the chat flow:", error);
+    }
+  }
+
+  // Clicks rendered from the prefetched flow are reported in small batches
+  function trackRuleClick(payload) {
+    pendingEvents.push({ type: "rule", payload: payload });
+    if (!eventsTimer) {
+      eventsTimer = setTimeout(flushEvents, 2000);
+    }
+  }
+
+  function flushEvents() {
+    clearTimeout(eventsTimer);
+    eventsTimer = null;
+    if (!pendingEvents.length) return;
+
+    const events = pendingEvents;
+    pendingEvents = [];
+    fetch(API_EVENTS_URL, {
+      method: "POST",
+      keepalive: true, // still delivered when the page is being closed
+      headers: {
+        "Content-Type": "application/json",
+        "X-Client-ID": CLIENT_ID,
+      },
+      body: JSON.stringify({ events: events }),
+    }).catch(() => {});
+  }
+
+  window.addEventListener("pagehide", flushEvents);
+
+  const flowReady = loadFlow();
+
+  // One WebSocket for the whole chat session, see chatbot/websocket.py
+  let socket = null;
+  let socketOpened = false;
+  let socketFailed = false; // refused or not supported by the server, stay on fetch
+  let nextMessageId = 1;
+  const pendingReplies = new Map(); // message id -> { type, payload, typingIndicator }
+
+  function openSocket() {
+    if (socket || socketFailed || !("WebSocket" in window)) return;
+
+    socketOpened = false;
+    socket = new WebSocket(WS_CHAT_URL);
+    socket.onopen = () => {
+      socketOpened = true;
+    };
+    socket.onmessage = (e) => handleSocketEvent(JSON.parse(e.data));
+    socket.onclose = (e) => {
+      if (!socketOpened || e.code >= 4000) {
+        socketFailed = true;
+      }
+      socket = null;
+      // anything still waiting for an answer is retried over HTTP
+      pendingReplies.forEach((pending) =>
+        fetchInteraction(pending.type, pending.payload, pending.typingIndicator)
+      );
+      pendingReplies.clear();
+    };
+  }
+
+  function sendOverSocket(type, payload, typingIndicator) {
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+      openSocket(); // reconnects for the next message
+      return false;
+    }
+
+    const id = nextMessageId++;
+    pendingReplies.set(id, { type, payload, typingIndicator });
+    socket.send(JSON.stringify({ id: id, type: type, payload: payload }));
+    return true;
+  }
+
+  function handleSocketEvent(message) {
+    const pending = pendingReplies.get(message.id);
+    if (!pending) {
+      if (message.event === "error") {
+        console.error("Chatter:", message.data && message.data.answer);
+      }
+      return;
+    }
+
+    // "ack" and "candidates" keep the typing indicator up until the answer arrives
+    if (message.event === "answer" || message.event === "error") {
+      pendingReplies.delete(message.id);
+      pending.typingIndicator.remove();
+      renderBotResponse(message.data);
+    }
+  }
+
   function addMessage(who, text, isHtml = false) {
     const msg = document.createElement("div");
     msg.className = `chatter-msg ${who}`;
@@ -410,7 +522,8 @@
       btn.textContent = opt.text;
       btn.onclick = () => {
             addMessage("user", opt.text);
-            handleInteraction("rule", opt.payload);
+            // rule nodes, or "faq" for a "did you mean" suggestion
+            handleInteraction(opt.type || "rule", opt.payload);
       };
       quickMenu.appendChild(btn);
     });
@@ -477,16 +590,47 @@
     }
   }
 
+  // Renders a bot response (FAQ answer or rule node) and its quick buttons
+  function renderBotResponse(botResponse) {
+    if (botResponse.response_type === "rich" && botResponse.rich_response) {
+      addMessage("bot", botResponse.rich_response.message, true);
+      setQuickButtons(botResponse.rich_response.options);
+    } else if (botResponse.type === "options" || botResponse.type === "suggestions") {
+      addMessage("bot", botResponse.message, true);
+      setQuickButtons(botResponse.options);
+    } else if (botResponse.type === "show_form") {
+      addMessage("bot", botResponse.message, true);
+      showChatForm();
+    } else {
+      // It's a simple text response
+      addMessage("bot", botResponse.answer, true);
+    }
+  }
+
   // --- UPDATED: Main interaction function ---
   async function handleInteraction(type, payload) {
     if (type === "text") {
       addMessage("user", payload);
     }
 
+    // Guided-flow clicks are answered from the prefetched flow, no round trip
+    if (type === "rule" && flow && flow.nodes[payload]) {
+      setQuickButtons([]);
+      renderBotResponse(flow.nodes[payload]);
+      trackRuleClick(payload);
+      return;
+    }
+
     input.value = "";
     setQuickButtons([]); // Hide buttons
     const typingIndicator = showTyping();
 
+    if (!sendOverSocket(type, payload, typingIndicator)) {
+      await fetchInteraction(type, payload, typingIndicator);
+    }
+  }
+
+  async function fetchInteraction(type, payload, typingIndicator) {
     try {
       const response = await fetch(API_INTERACT_URL, {
         method: "POST",
@@ -508,21 +652,7 @@
 
       typingIndicator.remove();
 
-      // Handle the bot's response based on our new backend logic
-      if (botResponse.response_type === "rich" && botResponse.rich_response) {
-        addMessage("bot", botResponse.rich_response.message, true);
-        setQuickButtons(botResponse.rich_response.options);
-      } else if (botResponse.type === "options") {
-        addMessage("bot", botResponse.message, true);
-        setQuickButtons(botResponse.options);
-      } else if (botResponse.type === "show_form") {
-        // --- THIS IS THE FIX ---
-        addMessage("bot", botResponse.message, true);
-        showChatForm(); // Call the new function
-      } else {
-        // It's a simple text response
-        addMessage("bot", botResponse.answer, true);
-      }
+      renderBotResponse(botResponse);
     } catch (error) {
       typingIndicator.remove();
       console.error("Chat API error:", error);
@@ -538,7 +668,8 @@
     chatStarted = true;
     chatBody.innerHTML = "";
     hideChatForm(); // Make sure form is hidden on start
-    handleInteraction("rule", "welcome_node");
+    openSocket();
+    flowReady.then(() => handleInteraction("rule", flow ? flow.entry : "welcome_node"));
   }
 
   /* ----------------------------